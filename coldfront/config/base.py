@@ -96,6 +96,8 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "simple_history.middleware.HistoryRequestMiddleware",
     "django_htmx.middleware.HtmxMiddleware",
+    "coldfront.core.utils.middleware.AttributeExpansionMiddleware",
+    "coldfront.core.utils.middleware.PermissionCacheMiddleware",
 ]
 
 # ------------------------------------------------------------------------------
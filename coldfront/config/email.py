@@ -15,6 +15,11 @@ EMAIL_HOST_USER = ENV.str("EMAIL_HOST_USER", default="")
 EMAIL_HOST_PASSWORD = ENV.str("EMAIL_HOST_PASSWORD", default="")
 EMAIL_USE_TLS = ENV.bool("EMAIL_USE_TLS", default=False)
 EMAIL_TIMEOUT = ENV.int("EMAIL_TIMEOUT", default=3)
+EMAIL_QUEUE_ENABLED = ENV.bool("EMAIL_QUEUE_ENABLED", default=False)
+EMAIL_QUEUE_BATCH_SIZE = ENV.int("EMAIL_QUEUE_BATCH_SIZE", default=100)
+EMAIL_QUEUE_RETRIES = ENV.int("EMAIL_QUEUE_RETRIES", default=3)
+EMAIL_QUEUE_RETRY_BACKOFF = ENV.float("EMAIL_QUEUE_RETRY_BACKOFF", default=1)
+EMAIL_QUEUE_RETENTION_DAYS = ENV.int("EMAIL_QUEUE_RETENTION_DAYS", default=30)
 EMAIL_SUBJECT_PREFIX = ENV.str("EMAIL_SUBJECT_PREFIX", default="[ColdFront]")
 EMAIL_ADMIN_LIST = ENV.list("EMAIL_ADMIN_LIST", default=[])
 EMAIL_SENDER = ENV.str("EMAIL_SENDER", default="")
@@ -15,6 +15,14 @@ PROJECT_OPENLDAP_BIND_USER = ENV.str("PROJECT_OPENLDAP_BIND_USER", default="")
 PROJECT_OPENLDAP_BIND_PASSWORD = ENV.str("PROJECT_OPENLDAP_BIND_PASSWORD", default="")
 # Timeout and SSL settings
 PROJECT_OPENLDAP_CONNECT_TIMEOUT = ENV.float("PROJECT_OPENLDAP_CONNECT_TIMEOUT", default=2.5)
+# Connection pool shared by the sync command and tasks
+PROJECT_OPENLDAP_POOL_SIZE = ENV.int("PROJECT_OPENLDAP_POOL_SIZE", default=4)  # idle connections kept open
+PROJECT_OPENLDAP_POOL_LIFETIME = ENV.float(
+    "PROJECT_OPENLDAP_POOL_LIFETIME", default=300
+)  # seconds a connection is reused before binding again
+PROJECT_OPENLDAP_PAGE_SIZE = ENV.int(
+    "PROJECT_OPENLDAP_PAGE_SIZE", default=1000
+)  # entries per page when reading all project posixGroups for project_openldap_sync --snapshot
 PROJECT_OPENLDAP_USE_SSL = ENV.bool("PROJECT_OPENLDAP_USE_SSL", default=True)
 PROJECT_OPENLDAP_USE_TLS = ENV.bool("PROJECT_OPENLDAP_USE_TLS", default=False)
 PROJECT_OPENLDAP_PRIV_KEY_FILE = ENV.str("PROJECT_OPENLDAP_PRIV_KEY_FILE", default=None)
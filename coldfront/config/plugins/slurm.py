@@ -11,6 +11,8 @@ INSTALLED_APPS += [
 
 SLURM_SACCTMGR_PATH = ENV.str("SLURM_SACCTMGR_PATH", default="/usr/bin/sacctmgr")
 SLURM_NOOP = ENV.bool("SLURM_NOOP", False)
+SLURM_ENABLE_SIGNALS = ENV.bool("SLURM_ENABLE_SIGNALS", default=False)
+SLURM_BATCH_SIZE = ENV.int("SLURM_BATCH_SIZE", default=100)
 SLURM_IGNORE_USERS = ENV.list("SLURM_IGNORE_USERS", default=["root"])
 SLURM_IGNORE_ACCOUNTS = ENV.list("SLURM_IGNORE_ACCOUNTS", default=[])
 SLURM_SUBMISSION_INFO = ENV.list("SLURM_SUBMISSION_INFO", default=["account"])
@@ -370,17 +370,25 @@ class AllocationUserAdmin(SimpleHistoryAdmin):
         else:
             return super().get_inline_instances(request)
 
+    def _set_status(self, queryset, status_name):
+        status = AllocationUserStatusChoice.objects.get(name=status_name)
+        # saved one at a time rather than updated in bulk, so the post_save receivers keep the allocation
+        # visibility index and cached list counts up to date
+        for allocation_user in queryset.exclude(status=status):
+            allocation_user.status = status
+            allocation_user.save()
+
     @admin.action(description="Set Selected User's Status To Active")
     def set_active(self, request, queryset):
-        queryset.update(status=AllocationUserStatusChoice.objects.get(name="Active"))
+        self._set_status(queryset, "Active")
 
     @admin.action(description="Set Selected User's Status To Denied")
     def set_denied(self, request, queryset):
-        queryset.update(status=AllocationUserStatusChoice.objects.get(name="Denied"))
+        self._set_status(queryset, "Denied")
 
     @admin.action(description="Set Selected User's Status To Removed")
     def set_removed(self, request, queryset):
-        queryset.update(status=AllocationUserStatusChoice.objects.get(name="Removed"))
+        self._set_status(queryset, "Removed")
 
     actions = [
         set_active,
@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.core.management.base import BaseCommand
+
+from coldfront.core.allocation.models import Allocation
+from coldfront.core.allocation.utils import update_allocation_visibility
+
+
+class Command(BaseCommand):
+    help = "Rebuild the allocation visibility index used to list the allocations a user can see"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", help="Number of allocations to rebuild at a time", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        allocation_ids = list(Allocation.objects.order_by("pk").values_list("pk", flat=True))
+        chunk_size = options["chunk_size"]
+        for i in range(0, len(allocation_ids), chunk_size):
+            update_allocation_visibility(allocations=allocation_ids[i : i + chunk_size])
+
+        self.stdout.write(f"Rebuilt allocation visibility for {len(allocation_ids)} allocations")
@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Generated by Django 5.2.18 on 2026-10-17 17:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_allocation_visibility(apps, schema_editor):
+    Allocation = apps.get_model("allocation", "Allocation")
+    AllocationUser = apps.get_model("allocation", "AllocationUser")
+    AllocationVisibility = apps.get_model("allocation", "AllocationVisibility")
+    ProjectUser = apps.get_model("project", "ProjectUser")
+
+    project_allocations = {}
+    for allocation_id, project_id in Allocation.objects.values_list("pk", "project_id"):
+        project_allocations.setdefault(project_id, []).append(allocation_id)
+
+    rows = {}
+    for user_id, project_id, role, status in ProjectUser.objects.values_list(
+        "user_id", "project_id", "role__name", "status__name"
+    ):
+        for allocation_id in project_allocations.get(project_id, []):
+            rows[(user_id, allocation_id)] = AllocationVisibility(
+                user_id=user_id, allocation_id=allocation_id, role=role, project_user_status=status
+            )
+
+    for user_id, allocation_id, status in AllocationUser.objects.values_list(
+        "user_id", "allocation_id", "status__name"
+    ):
+        row = rows.setdefault(
+            (user_id, allocation_id), AllocationVisibility(user_id=user_id, allocation_id=allocation_id)
+        )
+        row.allocation_user_status = status
+
+    AllocationVisibility.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("allocation", "0006_alter_historicalallocation_options_and_more"),
+        ("project", "0006_historicalproject_institution_project_institution"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AllocationVisibility",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("role", models.CharField(blank=True, max_length=64)),
+                ("project_user_status", models.CharField(blank=True, max_length=64)),
+                ("allocation_user_status", models.CharField(blank=True, max_length=64)),
+                (
+                    "allocation",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="allocation.allocation"),
+                ),
+                ("user", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                "unique_together": {("user", "allocation")},
+            },
+        ),
+        migrations.RunPython(build_allocation_visibility, migrations.RunPython.noop),
+    ]
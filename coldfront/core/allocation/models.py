@@ -9,21 +9,28 @@ from enum import Enum
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import escape, format_html
 from django.utils.module_loading import import_string
 from django.utils.safestring import SafeString
 from model_utils.models import TimeStampedModel
 from simple_history.models import HistoricalRecords
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
 import coldfront.core.attribute_expansion as attribute_expansion
 from coldfront.config.core import ALLOCATION_EULA_ENABLE
-from coldfront.core.allocation.signals import allocation_activate_user, allocation_remove_user
+from coldfront.core.allocation.signals import (
+    allocation_activate_user,
+    allocation_disable_batch,
+    allocation_remove_user,
+)
 from coldfront.core.project.models import Project, ProjectPermission
 from coldfront.core.resource.models import Resource
 from coldfront.core.utils.common import import_from_settings
 from coldfront.core.utils.mail import build_link, send_email_template
+from coldfront.core.utils.permissions import cached_permissions
 from coldfront.core.utils.validate import AttributeValidator
 
 logger = logging.getLogger(__name__)
@@ -31,6 +38,8 @@ logger = logging.getLogger(__name__)
 ALLOCATION_ATTRIBUTE_VIEW_LIST = import_from_settings("ALLOCATION_ATTRIBUTE_VIEW_LIST", [])
 ALLOCATION_FUNCS_ON_EXPIRE = import_from_settings("ALLOCATION_FUNCS_ON_EXPIRE", [])
 ALLOCATION_RESOURCE_ORDERING = import_from_settings("ALLOCATION_RESOURCE_ORDERING", ["-is_allocatable", "name"])
+ALLOCATION_USAGE_BATCH_SIZE = 1000
+ALLOCATION_STATUS_BATCH_SIZE = 1000
 
 EMAIL_SENDER = import_from_settings("EMAIL_SENDER")
 
@@ -276,6 +285,66 @@ class Allocation(TimeStampedModel):
         usage.value = value
         usage.save()
 
+    @classmethod
+    def bulk_set_usage(cls, usages):
+        """Set the usage of many allocation attributes at once, as set_usage does for each one
+
+        Params:
+            usages (dict): {allocation_id: {attribute_name: value}}; None values are skipped
+
+        Returns:
+            int: the number of usages created or updated
+        """
+        wanted = {}
+        for allocation_id, values in usages.items():
+            for name, value in values.items():
+                if value is not None:
+                    wanted[(allocation_id, name)] = value
+
+        names = {name for _, name in wanted}
+        allocation_ids = sorted({allocation_id for allocation_id, _ in wanted})
+        now = timezone.now()
+        to_create = []
+        to_update = []
+
+        for i in range(0, len(allocation_ids), ALLOCATION_USAGE_BATCH_SIZE):
+            # The first attribute of each type gets the usage, like set_usage
+            attributes = (
+                AllocationAttribute.objects.filter(
+                    allocation_id__in=allocation_ids[i : i + ALLOCATION_USAGE_BATCH_SIZE],
+                    allocation_attribute_type__name__in=names,
+                )
+                .select_related("allocation_attribute_type", "allocationattributeusage")
+                .order_by("pk")
+            )
+            seen = set()
+            for attr in attributes:
+                key = (attr.allocation_id, attr.allocation_attribute_type.name)
+                if key in seen or key not in wanted:
+                    continue
+                seen.add(key)
+
+                if not attr.allocation_attribute_type.has_usage:
+                    continue
+
+                try:
+                    usage = attr.allocationattributeusage
+                except AllocationAttributeUsage.DoesNotExist:
+                    to_create.append(AllocationAttributeUsage(allocation_attribute=attr, value=wanted[key]))
+                    continue
+
+                usage.value = wanted[key]
+                usage.modified = now
+                to_update.append(usage)
+
+        with transaction.atomic():
+            bulk_create_with_history(to_create, AllocationAttributeUsage, batch_size=ALLOCATION_USAGE_BATCH_SIZE)
+            bulk_update_with_history(
+                to_update, AllocationAttributeUsage, ["value", "modified"], batch_size=ALLOCATION_USAGE_BATCH_SIZE
+            )
+
+        return len(to_create) + len(to_update)
+
     def get_attribute_list(self, name, expand=True, typed=True, extra_allocations=[]):
         """
         Params:
@@ -325,6 +394,9 @@ class Allocation(TimeStampedModel):
         if user.is_superuser:
             return list(AllocationPermission)
 
+        return cached_permissions(("allocation", self.pk, user.pk), lambda: self._user_permissions(user))
+
+    def _user_permissions(self, user):
         project_perms = self.project.user_permissions(user)
 
         if ProjectPermission.USER not in project_perms:
@@ -438,6 +510,51 @@ class Allocation(TimeStampedModel):
         self.end_date = datetime.datetime.now()
         self.save()
 
+    @classmethod
+    def bulk_expire(cls, allocations, signal_sender=None, batch_size=ALLOCATION_STATUS_BATCH_SIZE):
+        """Set the status of many allocations to "Expired", batch_size at a time.
+
+        As when saving each allocation, the ALLOCATION_FUNCS_ON_EXPIRE are run for each allocation that wasn't
+        already expired and a history record is written for it. The statuses and history records of a batch
+        are written with one bulk update, and then `allocation_disable_batch` is sent once with the pks of
+        the batch. Each batch is loaded with the allocations filter, so an allocation that no longer matches
+        it, e.g. because it was renewed while earlier batches were expired, is skipped.
+
+        Params:
+            allocations (QuerySet[Allocation]): allocations to expire
+            signal_sender (str): Sender for the `allocation_disable_batch` signal.
+            batch_size (int): number of allocations updated at a time
+
+        Returns:
+            list[int]: the pks of the allocations that were expired
+        """
+        expired_status = AllocationStatusChoice.objects.get(name="Expired")
+        allocations = allocations.exclude(status=expired_status)
+        pks = list(allocations.order_by("pk").values_list("pk", flat=True))
+
+        expired = []
+        for i in range(0, len(pks), batch_size):
+            batch = list(allocations.filter(pk__in=pks[i : i + batch_size]).order_by("pk"))
+            if not batch:
+                continue
+            for func_string in ALLOCATION_FUNCS_ON_EXPIRE:
+                func_to_run = import_string(func_string)
+                for allocation in batch:
+                    func_to_run(allocation.pk)
+
+            now = timezone.now()
+            for allocation in batch:
+                allocation.status = expired_status
+                allocation.modified = now
+            with transaction.atomic():
+                bulk_update_with_history(batch, cls, ["status", "modified"], batch_size=batch_size)
+
+            batch_pks = [allocation.pk for allocation in batch]
+            allocation_disable_batch.send(sender=signal_sender, allocation_pks=batch_pks)
+            expired.extend(batch_pks)
+
+        return expired
+
     def get_absolute_url(self):
         return reverse("allocation-detail", kwargs={"pk": self.pk})
 
@@ -460,7 +577,7 @@ class Allocation(TimeStampedModel):
         users = allocation_users.values_list("user", flat=True)
         filter_options = {
             "user__in": users,
-            "staus__name": "Active",
+            "status__name": "Active",
             "enable_notifications": True,
         }
 
@@ -640,12 +757,17 @@ class AllocationAttribute(TimeStampedModel):
             return raw_value
 
         allocs = [self.allocation] + extra_allocations
-        resources = list(self.allocation.resources.all())
         attrib_name = self.allocation_attribute_type.name
 
-        attriblist = attribute_expansion.get_attriblist_str(
-            attribute_name=attrib_name, resources=resources, allocations=allocs
-        )
+        context = attribute_expansion.get_expansion_context()
+        if context is not None:
+            resources = context.get_resources(self.allocation)
+            attriblist = context.get_attriblist_str(attribute_name=attrib_name, resources=resources, allocations=allocs)
+        else:
+            resources = list(self.allocation.resources.all())
+            attriblist = attribute_expansion.get_attriblist_str(
+                attribute_name=attrib_name, resources=resources, allocations=allocs
+            )
 
         if not attriblist:
             # We do not have an attriblist, return raw_value
@@ -657,6 +779,7 @@ class AllocationAttribute(TimeStampedModel):
             attriblist_string=attriblist,
             resources=resources,
             allocations=allocs,
+            context=context,
         )
         return expanded
 
@@ -740,6 +863,33 @@ class AllocationUser(TimeStampedModel):
         unique_together = ("user", "allocation")
 
 
+class AllocationVisibility(models.Model):
+    """An allocation visibility records how a user is related to an allocation, through its project and as an
+    allocation user. It is kept up to date by signals (see coldfront.core.allocation.receivers) and can be rebuilt
+    with the rebuild_allocation_visibility command. Used to find the allocations a user can see.
+
+    Attributes:
+        allocation (Allocation): allocation the user is related to
+        user (User): user related to the allocation
+        role (str): name of the user's project user role, empty if the user is not on the project
+        project_user_status (str): name of the user's project user status, empty if the user is not on the project
+        allocation_user_status (str): name of the user's allocation user status, empty if the user is not on the
+            allocation
+    """
+
+    allocation = models.ForeignKey(Allocation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    role = models.CharField(max_length=64, blank=True)
+    project_user_status = models.CharField(max_length=64, blank=True)
+    allocation_user_status = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        unique_together = ("user", "allocation")
+
+    def __str__(self):
+        return "%s (%s)" % (self.user, self.allocation_id)
+
+
 class AllocationAccount(TimeStampedModel):
     """An allocation account
     #come back to
@@ -0,0 +1,29 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from coldfront.core.allocation.models import Allocation, AllocationUser
+from coldfront.core.allocation.utils import update_allocation_visibility
+from coldfront.core.project.models import ProjectUser
+
+
+@receiver(post_save, sender=Allocation)
+def update_allocation_visibility_allocation(sender, instance, **kwargs):
+    update_allocation_visibility(allocations=[instance.pk])
+
+
+@receiver(post_save, sender=AllocationUser)
+@receiver(post_delete, sender=AllocationUser)
+def update_allocation_visibility_allocation_user(sender, instance, **kwargs):
+    update_allocation_visibility(allocations=[instance.allocation_id], users=[instance.user_id])
+
+
+@receiver(post_save, sender=ProjectUser)
+@receiver(post_delete, sender=ProjectUser)
+def update_allocation_visibility_project_user(sender, instance, **kwargs):
+    update_allocation_visibility(
+        allocations=Allocation.objects.filter(project_id=instance.project_id), users=[instance.user_id]
+    )
@@ -10,6 +10,8 @@ allocation_activate = django.dispatch.Signal()
 # providing_args=["allocation_pk"]
 allocation_disable = django.dispatch.Signal()
 # providing_args=["allocation_pk"]
+allocation_disable_batch = django.dispatch.Signal()
+# providing_args=["allocation_pks"]
 
 allocation_activate_user = django.dispatch.Signal()
 # providing_args=["allocation_user_pk"]
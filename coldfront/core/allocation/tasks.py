@@ -7,8 +7,16 @@ import datetime
 # import the logging library
 import logging
 
-from coldfront.core.allocation.models import Allocation, AllocationStatusChoice
-from coldfront.core.user.models import User
+from django.db.models import Exists, OuterRef, Subquery
+
+from coldfront.core.allocation.models import (
+    ALLOCATION_RESOURCE_ORDERING,
+    Allocation,
+    AllocationAttribute,
+    AllocationUser,
+)
+from coldfront.core.project.models import ProjectUser
+from coldfront.core.resource.models import Resource, ResourceAttribute
 from coldfront.core.utils.common import import_from_settings
 from coldfront.core.utils.mail import send_email_template
 
@@ -36,7 +44,6 @@ EMAIL_ALLOCATION_EULA_IGNORE_OPT_OUT = import_from_settings("EMAIL_ALLOCATION_EU
 
 
 def update_statuses():
-    expired_status_choice = AllocationStatusChoice.objects.get(name="Expired")
     allocations_to_expire = Allocation.objects.filter(
         status__name__in=[
             "Active",
@@ -46,192 +53,253 @@ def update_statuses():
         ],
         end_date__lt=datetime.datetime.now().date(),
     )
-    for sub_obj in allocations_to_expire:
-        sub_obj.status = expired_status_choice
-        sub_obj.save()
+    expired = Allocation.bulk_expire(allocations_to_expire, signal_sender=__name__)
 
-    logger.info("Allocations set to expired: {}".format(allocations_to_expire.count()))
+    logger.info("Allocations set to expired: {}".format(len(expired)))
 
 
-def send_eula_reminders():
-    for allocation in Allocation.objects.all():
-        if not allocation.get_eula():
-            continue
+def parent_resource(field):
+    """Subquery for a field of the parent resource of the allocation the outer query is about, as returned
+    by Allocation.get_parent_resource"""
+    return Subquery(
+        Resource.objects.filter(allocation=OuterRef("allocation"))
+        .order_by(*ALLOCATION_RESOURCE_ORDERING)
+        .values(field)[:1]
+    )
 
-        email_receivers = allocation.get_user_emails(status_name="PendingEULA")
 
-        if not email_receivers:
-            continue
+def get_pending_eula_reminders():
+    """Finds the allocation users who still have to agree to the EULA of a resource of their allocation.
 
-        template_context = {
-            "resource": allocation.get_parent_resource,
-            "url": f"{CENTER_BASE_URL.strip('/')}/{'allocation'}/{allocation.pk}/review-eula",
-        }
+    Users who are not active project users with notifications enabled are left out, unless
+    EMAIL_ALLOCATION_EULA_IGNORE_OPT_OUT is set.
+
+    Returns:
+        QuerySet[dict]: one row per allocation user, with the allocation's parent resource, ordered by user then
+            allocation
+    """
+    allocation_users = AllocationUser.objects.filter(
+        Exists(
+            ResourceAttribute.objects.filter(
+                resource__allocation=OuterRef("allocation"), resource_attribute_type__name="eula"
+            ).exclude(value="")
+        ),
+        status__name="PendingEULA",
+    )
+    if not EMAIL_ALLOCATION_EULA_IGNORE_OPT_OUT:
+        allocation_users = allocation_users.filter(
+            Exists(
+                ProjectUser.objects.filter(
+                    project=OuterRef("allocation__project"),
+                    user=OuterRef("user"),
+                    status__name="Active",
+                    enable_notifications=True,
+                )
+            )
+        )
+
+    return (
+        allocation_users.annotate(
+            resource_name=parent_resource("name"), resource_type=parent_resource("resource_type__name")
+        )
+        .order_by("user_id", "allocation_id")
+        .values(
+            "user_id",
+            "user__email",
+            "allocation_id",
+            "allocation__project__pi__username",
+            "resource_name",
+            "resource_type",
+        )
+    )
+
+
+def send_eula_reminders():
+    """Emails each user with allocations pending their agreement to a EULA one reminder listing them all"""
+    digests = {}
+    for row in get_pending_eula_reminders():
+        digest = digests.setdefault(row["user_id"], {"email": row["user__email"], "allocations": []})
+        digest["allocations"].append(
+            {
+                "resource": f"{row['resource_name']} ({row['resource_type']})",
+                "resource_name": row["resource_name"],
+                "url": f"{CENTER_BASE_URL.strip('/')}/allocation/{row['allocation_id']}/review-eula",
+                "pi": row["allocation__project__pi__username"],
+            }
+        )
+
+    for user_id, digest in digests.items():
+        allocations = digest["allocations"]
+        if len(allocations) == 1:
+            subject = f"Reminder: Agree to EULA for {allocations[0]['resource_name']} ({allocations[0]['pi']})"
+        else:
+            subject = f"Reminder: Agree to EULAs for {len(allocations)} allocations"
 
         send_email_template(
-            f"Reminder: Agree to EULA for {allocation}",
+            subject,
             "email/allocation_eula_reminder.txt",
-            template_context,
-            email_receivers,
+            {"allocations": allocations},
+            [digest["email"]],
+        )
+        logger.debug(f"Allocation(s) EULA reminder sent to user {user_id}.")
+
+
+EXPIRING_ALLOCATION_STATUSES = ["Active", "Payment Pending", "Payment Requested", "Unpaid"]
+
+
+def get_expiry_notifications(end_date, statuses=None):
+    """Finds who to notify about allocations ending on end_date, with everything the expiry emails need.
+
+    Only active allocation users who are active project users with notifications enabled are included.
+    The allocation's EXPIRE NOTIFICATION and CLOUD_USAGE_NOTIFICATION values and its parent resource are
+    fetched in the same query.
+
+    Params:
+        end_date (date): end date of the allocations
+        statuses (list[str]): names of the allocation statuses to include, all statuses if None
+
+    Returns:
+        QuerySet[dict]: one row per allocation user, ordered by user then allocation user
+    """
+
+    def attribute_value(name):
+        return Subquery(
+            AllocationAttribute.objects.filter(allocation=OuterRef("allocation"), allocation_attribute_type__name=name)
+            .order_by("pk")
+            .values("value")[:1]
         )
-        logger.debug(f"Allocation(s) EULA reminder sent to users {email_receivers}.")
+
+    allocation_users = AllocationUser.objects.filter(allocation__end_date=end_date, status__name="Active")
+    if statuses is not None:
+        allocation_users = allocation_users.filter(allocation__status__name__in=statuses)
+
+    return (
+        allocation_users.filter(
+            Exists(
+                ProjectUser.objects.filter(
+                    project=OuterRef("allocation__project"),
+                    user=OuterRef("user"),
+                    status__name="Active",
+                    enable_notifications=True,
+                )
+            )
+        )
+        .annotate(
+            expire_notification=attribute_value("EXPIRE NOTIFICATION"),
+            cloud_usage_notification=attribute_value("CLOUD_USAGE_NOTIFICATION"),
+            resource_name=parent_resource("name"),
+        )
+        .order_by("user_id", "pk")
+        .values(
+            "user_id",
+            "user__email",
+            "allocation_id",
+            "allocation__status__name",
+            "allocation__project_id",
+            "allocation__project__title",
+            "allocation__project__pi__username",
+            "expire_notification",
+            "cloud_usage_notification",
+            "resource_name",
+        )
+    )
 
 
 def send_expiry_emails():
-    # TODO: cleanup
-    # Allocations expiring soon
-    for user in User.objects.all():
-        projectdict = {}
-        expirationdict = {}
-        email_receiver_list = []
-        for days_remaining in sorted(set(EMAIL_ALLOCATION_EXPIRING_NOTIFICATION_DAYS)):
-            expring_in_days = (datetime.datetime.today() + datetime.timedelta(days=days_remaining)).date()
-
-            for allocationuser in user.allocationuser_set.all():
-                allocation = allocationuser.allocation
-
-                if (allocation.status.name in ["Active", "Payment Pending", "Payment Requested", "Unpaid"]) and (
-                    allocation.end_date == expring_in_days
-                ):
-                    project_url = f"{CENTER_BASE_URL.strip('/')}/{'project'}/{allocation.project.pk}/"
-
-                    if allocation.status.name in ["Payment Pending", "Payment Requested", "Unpaid"]:
-                        allocation_renew_url = f"{CENTER_BASE_URL.strip('/')}/{'allocation'}/{allocation.pk}/"
-                    else:
-                        allocation_renew_url = f"{CENTER_BASE_URL.strip('/')}/{'allocation'}/{allocation.pk}/{'renew'}/"
-
-                    resource_name = allocation.get_parent_resource.name
-
-                    template_context = {
-                        "expring_in_days": days_remaining,
-                        "project_dict": projectdict,
-                        "expiration_dict": expirationdict,
-                        "expiration_days": sorted(set(EMAIL_ALLOCATION_EXPIRING_NOTIFICATION_DAYS)),
-                        "project_renewal_help_url": CENTER_PROJECT_RENEWAL_HELP_URL,
-                        "opt_out_instruction_url": EMAIL_OPT_OUT_INSTRUCTION_URL,
-                        "signature": EMAIL_SIGNATURE,
-                    }
-
-                    expire_notification = allocation.allocationattribute_set.filter(
-                        allocation_attribute_type__name="EXPIRE NOTIFICATION"
-                    ).first()
-                    if expire_notification and expire_notification.value == "No":
-                        continue
-
-                    cloud_usage_notification = allocation.allocationattribute_set.filter(
-                        allocation_attribute_type__name="CLOUD_USAGE_NOTIFICATION"
-                    ).first()
-                    if cloud_usage_notification and cloud_usage_notification.value == "No":
-                        continue
-
-                    for projectuser in allocation.project.projectuser_set.filter(user=user, status__name="Active"):
-                        if (projectuser.enable_notifications) and (
-                            allocationuser.user == user and allocationuser.status.name == "Active"
-                        ):
-                            if user.email not in email_receiver_list:
-                                email_receiver_list.append(user.email)
-
-                            if days_remaining not in expirationdict:
-                                expirationdict[days_remaining] = []
-                                expirationdict[days_remaining].append(
-                                    (project_url, allocation_renew_url, resource_name)
-                                )
-                            else:
-                                expirationdict[days_remaining].append(
-                                    (project_url, allocation_renew_url, resource_name)
-                                )
-
-                            if allocation.project.title not in projectdict:
-                                projectdict[allocation.project.title] = (
-                                    project_url,
-                                    allocation.project.pi.username,
-                                )
-
-        if email_receiver_list:
-            send_email_template(
-                f"Your access to {CENTER_NAME}'s resources is expiring soon",
-                "email/allocation_expiring.txt",
-                template_context,
-                email_receiver_list,
+    """Emails each user a digest of their allocations expiring in the EMAIL_ALLOCATION_EXPIRING_NOTIFICATION_DAYS
+    windows, and of those that expired yesterday, with one query per window"""
+    base_url = CENTER_BASE_URL.strip("/")
+    expiration_days = sorted(set(EMAIL_ALLOCATION_EXPIRING_NOTIFICATION_DAYS))
+
+    # Allocations expiring soon, one digest per user covering every notification window
+    digests = {}
+    for days_remaining in expiration_days:
+        expring_in_days = (datetime.datetime.today() + datetime.timedelta(days=days_remaining)).date()
+
+        for row in get_expiry_notifications(expring_in_days, EXPIRING_ALLOCATION_STATUSES):
+            if row["expire_notification"] == "No" or row["cloud_usage_notification"] == "No":
+                continue
+
+            project_url = f"{base_url}/project/{row['allocation__project_id']}/"
+            if row["allocation__status__name"] in ["Payment Pending", "Payment Requested", "Unpaid"]:
+                allocation_renew_url = f"{base_url}/allocation/{row['allocation_id']}/"
+            else:
+                allocation_renew_url = f"{base_url}/allocation/{row['allocation_id']}/renew/"
+
+            digest = digests.setdefault(row["user_id"], {"email": row["user__email"], "projects": {}, "expiration": {}})
+            digest["days_remaining"] = days_remaining
+            digest["expiration"].setdefault(days_remaining, []).append(
+                (project_url, allocation_renew_url, row["resource_name"])
+            )
+            digest["projects"].setdefault(
+                row["allocation__project__title"], (project_url, row["allocation__project__pi__username"])
             )
 
-            logger.debug(f"Allocation(s) expiring in soon, email sent to user {user}.")
+    for user_id, digest in sorted(digests.items()):
+        template_context = {
+            "expring_in_days": digest["days_remaining"],
+            "project_dict": digest["projects"],
+            "expiration_dict": digest["expiration"],
+            "expiration_days": expiration_days,
+            "project_renewal_help_url": CENTER_PROJECT_RENEWAL_HELP_URL,
+            "opt_out_instruction_url": EMAIL_OPT_OUT_INSTRUCTION_URL,
+            "signature": EMAIL_SIGNATURE,
+        }
+
+        send_email_template(
+            f"Your access to {CENTER_NAME}'s resources is expiring soon",
+            "email/allocation_expiring.txt",
+            template_context,
+            [digest["email"]],
+        )
+
+        logger.debug(f"Allocation(s) expiring in soon, email sent to user {user_id}.")
 
     # Allocations expired
+    digests = {}
     admin_projectdict = {}
     admin_allocationdict = {}
-    for user in User.objects.all():
-        projectdict = {}
-        allocationdict = {}
-        email_receiver_list = []
-
-        expring_in_days = (datetime.datetime.today() + datetime.timedelta(days=-1)).date()
-
-        for allocationuser in user.allocationuser_set.all():
-            allocation = allocationuser.allocation
-
-            if allocation.end_date == expring_in_days:
-                project_url = f"{CENTER_BASE_URL.strip('/')}/{'project'}/{allocation.project.pk}/"
-
-                allocation_renew_url = f"{CENTER_BASE_URL.strip('/')}/{'allocation'}/{allocation.pk}/{'renew'}/"
-
-                allocation_url = f"{CENTER_BASE_URL.strip('/')}/{'allocation'}/{allocation.pk}/"
-
-                resource_name = allocation.get_parent_resource.name
-
-                template_context = {
-                    "project_dict": projectdict,
-                    "allocation_dict": allocationdict,
-                    "project_renewal_help_url": CENTER_PROJECT_RENEWAL_HELP_URL,
-                    "opt_out_instruction_url": EMAIL_OPT_OUT_INSTRUCTION_URL,
-                    "signature": EMAIL_SIGNATURE,
-                }
-
-                expire_notification = allocation.allocationattribute_set.filter(
-                    allocation_attribute_type__name="EXPIRE NOTIFICATION"
-                ).first()
-
-                for projectuser in allocation.project.projectuser_set.filter(user=user, status__name="Active"):
-                    if (projectuser.enable_notifications) and (
-                        allocationuser.user == user and allocationuser.status.name == "Active"
-                    ):
-                        if expire_notification and expire_notification.value == "Yes":
-                            if user.email not in email_receiver_list:
-                                email_receiver_list.append(user.email)
-
-                            if project_url not in allocationdict:
-                                allocationdict[project_url] = []
-                                allocationdict[project_url].append({allocation_renew_url: resource_name})
-                            else:
-                                if {allocation_renew_url: resource_name} not in allocationdict[project_url]:
-                                    allocationdict[project_url].append({allocation_renew_url: resource_name})
-
-                            if allocation.project.title not in projectdict:
-                                projectdict[allocation.project.title] = (project_url, allocation.project.pi.username)
-
-                        if EMAIL_ADMINS_ON_ALLOCATION_EXPIRE:
-                            if project_url not in admin_allocationdict:
-                                admin_allocationdict[project_url] = []
-                                admin_allocationdict[project_url].append({allocation_url: resource_name})
-                            else:
-                                if {allocation_url: resource_name} not in admin_allocationdict[project_url]:
-                                    admin_allocationdict[project_url].append({allocation_url: resource_name})
-
-                            if allocation.project.title not in admin_projectdict:
-                                admin_projectdict[allocation.project.title] = (
-                                    project_url,
-                                    allocation.project.pi.username,
-                                )
-
-        if email_receiver_list:
-            send_email_template(
-                "Your access to resource(s) have expired",
-                "email/allocation_expired.txt",
-                template_context,
-                email_receiver_list,
+    expring_in_days = (datetime.datetime.today() + datetime.timedelta(days=-1)).date()
+
+    for row in get_expiry_notifications(expring_in_days):
+        project_url = f"{base_url}/project/{row['allocation__project_id']}/"
+        allocation_renew_url = f"{base_url}/allocation/{row['allocation_id']}/renew/"
+        allocation_url = f"{base_url}/allocation/{row['allocation_id']}/"
+        resource_name = row["resource_name"]
+        project = (project_url, row["allocation__project__pi__username"])
+
+        if row["expire_notification"] == "Yes":
+            digest = digests.setdefault(
+                row["user_id"], {"email": row["user__email"], "projects": {}, "allocations": {}}
             )
+            allocations = digest["allocations"].setdefault(project_url, [])
+            if {allocation_renew_url: resource_name} not in allocations:
+                allocations.append({allocation_renew_url: resource_name})
+            digest["projects"].setdefault(row["allocation__project__title"], project)
+
+        if EMAIL_ADMINS_ON_ALLOCATION_EXPIRE:
+            allocations = admin_allocationdict.setdefault(project_url, [])
+            if {allocation_url: resource_name} not in allocations:
+                allocations.append({allocation_url: resource_name})
+            admin_projectdict.setdefault(row["allocation__project__title"], project)
+
+    for user_id, digest in sorted(digests.items()):
+        template_context = {
+            "project_dict": digest["projects"],
+            "allocation_dict": digest["allocations"],
+            "project_renewal_help_url": CENTER_PROJECT_RENEWAL_HELP_URL,
+            "opt_out_instruction_url": EMAIL_OPT_OUT_INSTRUCTION_URL,
+            "signature": EMAIL_SIGNATURE,
+        }
+
+        send_email_template(
+            "Your access to resource(s) have expired",
+            "email/allocation_expired.txt",
+            template_context,
+            [digest["email"]],
+        )
 
-            logger.debug(f"Allocation(s) expired email sent to user {user}.")
+        logger.debug(f"Allocation(s) expired email sent to user {user_id}.")
 
     if EMAIL_ADMINS_ON_ALLOCATION_EXPIRE:
         if admin_projectdict:
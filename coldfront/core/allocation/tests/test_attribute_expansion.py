@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""Unit tests for attribute expansion"""
+
+import logging
+import time
+
+from django.test import SimpleTestCase
+
+from coldfront.core import attribute_expansion
+
+logger = logging.getLogger(__name__)
+
+ATTRIBLIST = """
+# Slurm specs
+fairshare := :fairshare
+fairshare *= 2
+fairshare |= 1
+cores := RESOURCE:core_count
+cores /= 3
+cores (= floor
+qos := 'normal'
+qos += ','
+qos += ALLOCATION:qos
+missing |= 'default'
+ratio := 0.5
+"""
+
+
+class FakeAttributes:
+    """Stands in for an Allocation or Resource with the given attributes"""
+
+    def __init__(self, pk, **attributes):
+        self.pk = pk
+        self.attributes = attributes
+        self.lookups = 0
+
+    def get_attribute(self, name):
+        self.lookups += 1
+        return self.attributes.get(name)
+
+
+class AttributeExpansionTests(SimpleTestCase):
+    def setUp(self):
+        attribute_expansion.compile_attriblist.cache_clear()
+        self.resource = FakeAttributes(1, core_count=64, fairshare=1)
+        self.allocation = FakeAttributes(2, fairshare=100, qos="debug")
+
+    def _make_apdict(self, attriblist=ATTRIBLIST):
+        return attribute_expansion.make_attribute_parameter_dictionary(
+            attribute_name="slurm_specs",
+            attribute_parameter_string=attriblist,
+            resources=[self.resource],
+            allocations=[self.allocation],
+        )
+
+    def test_make_attribute_parameter_dictionary(self):
+        self.assertEqual(
+            self._make_apdict(),
+            {"fairshare": 200, "cores": 21, "qos": "normal,debug", "missing": "default", "ratio": 0.5},
+        )
+
+    def test_statement_by_statement(self):
+        """Processing the statements one at a time gives the same dictionary"""
+        apdict = {}
+        for line in ATTRIBLIST.splitlines():
+            apdict = attribute_expansion.process_attribute_parameter_string(
+                parameter_string=line,
+                attribute_name="slurm_specs",
+                attribute_parameter_dict=apdict,
+                resources=[self.resource],
+                allocations=[self.allocation],
+            )
+
+        self.assertEqual(apdict, self._make_apdict())
+
+    def test_invalid_statements(self):
+        """Invalid statements are skipped and bad arguments evaluate to None"""
+        apdict = self._make_apdict("a := 1\nnot a statement\nb := 'unterminated\nc := nonsense\na -= :nothing")
+
+        self.assertEqual(apdict, {"a": None, "b": None, "c": None})
+
+    def test_attribute_looked_up_once(self):
+        """Each attribute referenced by the program is looked up once per expansion"""
+        self._make_apdict("a := ALLOCATION:fairshare\na += ALLOCATION:fairshare\na += ALLOCATION:fairshare")
+        self.assertEqual(self.allocation.lookups, 1)
+
+    def test_compile_attriblist_cached(self):
+        program = attribute_expansion.compile_attriblist("slurm_specs", ATTRIBLIST)
+        self.assertIs(attribute_expansion.compile_attriblist("slurm_specs", ATTRIBLIST), program)
+        self.assertEqual([statement.pname for statement in program][:3], ["fairshare", "fairshare", "fairshare"])
+
+    def test_expand_attribute(self):
+        expanded = attribute_expansion.expand_attribute(
+            raw_value="Fairshare={fairshare}:GrpTRES=cpu={cores}:QOS={qos}",
+            attribute_name="slurm_specs",
+            attriblist_string=ATTRIBLIST,
+            resources=[self.resource],
+            allocations=[self.allocation],
+        )
+        self.assertEqual(expanded, "Fairshare=200:GrpTRES=cpu=21:QOS=normal,debug")
+
+    def test_expand_attribute_benchmark(self):
+        """Expand the same attriblist for many allocations"""
+        allocations = [FakeAttributes(i, fairshare=i, qos="debug") for i in range(5000)]
+
+        def expand_all():
+            return [
+                attribute_expansion.make_attribute_parameter_dictionary(
+                    attribute_name="slurm_specs",
+                    attribute_parameter_string=ATTRIBLIST,
+                    resources=[self.resource],
+                    allocations=[allocation],
+                )
+                for allocation in allocations
+            ]
+
+        def expand_all_uncompiled():
+            results = []
+            for allocation in allocations:
+                attribute_expansion.compile_attriblist.cache_clear()
+                results.append(
+                    attribute_expansion.make_attribute_parameter_dictionary(
+                        attribute_name="slurm_specs",
+                        attribute_parameter_string=ATTRIBLIST,
+                        resources=[self.resource],
+                        allocations=[allocation],
+                    )
+                )
+            return results
+
+        start = time.perf_counter()
+        uncompiled = expand_all_uncompiled()
+        uncompiled_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        compiled = expand_all()
+        compiled_elapsed = time.perf_counter() - start
+
+        logger.info(
+            "Expanded attriblist for %d allocations in %.3fs compiled once, %.3fs compiled each time",
+            len(allocations),
+            compiled_elapsed,
+            uncompiled_elapsed,
+        )
+
+        self.assertEqual(compiled, uncompiled)
+        self.assertEqual(compiled[10]["fairshare"], 20)
+        self.assertEqual(attribute_expansion.compile_attriblist.cache_info().misses, 1)
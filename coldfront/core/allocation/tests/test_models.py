@@ -10,13 +10,19 @@ from unittest.mock import patch
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from coldfront.core.allocation.models import (
     Allocation,
+    AllocationAttribute,
+    AllocationAttributeUsage,
     AllocationStatusChoice,
     AllocationUser,
 )
+from coldfront.core.allocation.signals import allocation_attribute_changed
+from coldfront.core.attribute_expansion import expansion_context
 from coldfront.core.project.models import Project
 from coldfront.core.test_helpers.factories import (
     AAttributeTypeFactory,
@@ -27,6 +33,8 @@ from coldfront.core.test_helpers.factories import (
     AllocationUserFactory,
     AllocationUserStatusChoiceFactory,
     ProjectFactory,
+    ResourceAttributeFactory,
+    ResourceAttributeTypeFactory,
     ResourceFactory,
     UserFactory,
 )
@@ -262,6 +270,120 @@ class AllocationAttributeModelCleanMethodTests(TestCase):
         self._test_clean("Date", ["foobar", "", " ", "\0", "1", "1.0", "2e30", "1j"], True)
 
 
+class AllocationAttributeExpandedValueTests(TestCase):
+    """tests for AllocationAttribute.expanded_value"""
+
+    @classmethod
+    def setUpTestData(cls):
+        resource = ResourceFactory()
+        ResourceAttributeFactory(
+            resource=resource,
+            resource_attribute_type=ResourceAttributeTypeFactory(name="slurm_specs_attriblist"),
+            value="fairshare := :fairshare\nfairshare *= 2",
+        )
+        cls.allocation = AllocationFactory()
+        cls.allocation.resources.add(resource)
+        cls.fairshare = AllocationAttributeFactory(
+            allocation=cls.allocation,
+            allocation_attribute_type=AllocationAttributeTypeFactory(name="fairshare"),
+            value="100",
+        )
+        cls.specs = AllocationAttributeFactory(
+            allocation=cls.allocation,
+            allocation_attribute_type=AllocationAttributeTypeFactory(
+                name="slurm_specs", attribute_type=AAttributeTypeFactory(name="Attribute Expanded Text")
+            ),
+            value="Fairshare={fairshare}",
+        )
+
+    def test_expanded_value(self):
+        self.assertEqual(self.specs.expanded_value(), "Fairshare=200")
+
+    def test_expanded_value_cached_in_context(self):
+        """Repeated expansions within an expansion context do not query the database again"""
+        with expansion_context():
+            self.assertEqual(self.specs.expanded_value(), "Fairshare=200")
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(10):
+                    self.assertEqual(self.specs.expanded_value(), "Fairshare=200")
+
+        self.assertEqual(len(queries), 0)
+
+    def test_expanded_value_invalidated(self):
+        """Expansions within an expansion context reflect attribute changes"""
+        with expansion_context():
+            self.assertEqual(self.specs.expanded_value(), "Fairshare=200")
+
+            self.fairshare.value = "50"
+            self.fairshare.save()
+            self.assertEqual(self.specs.expanded_value(), "Fairshare=100")
+
+            AllocationAttribute.objects.filter(pk=self.fairshare.pk).update(value="10")
+            allocation_attribute_changed.send(
+                sender=self.__class__, attribute_pk=self.fairshare.pk, allocation_pk=self.allocation.pk
+            )
+            self.assertEqual(self.specs.expanded_value(), "Fairshare=20")
+
+
+class AllocationBulkSetUsageTests(TestCase):
+    """tests for Allocation.bulk_set_usage"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hours_type = AllocationAttributeTypeFactory(name="Core Usage (Hours)", has_usage=True)
+        storage_type = AllocationAttributeTypeFactory(name="Storage Quota (GB)", has_usage=True)
+        cls.allocations = [AllocationFactory() for _ in range(5)]
+        cls.hours = [
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=cls.hours_type, value=1000)
+            for allocation in cls.allocations
+        ]
+        cls.storage = AllocationAttributeFactory(
+            allocation=cls.allocations[0], allocation_attribute_type=storage_type, value=10
+        )
+        cls.no_usage = AllocationAttributeFactory(
+            allocation=cls.allocations[0],
+            allocation_attribute_type=AllocationAttributeTypeFactory(name="slurm_account_name"),
+            value="physics",
+        )
+        # an attribute whose usage was removed gets a new one
+        AllocationAttributeUsage.objects.filter(allocation_attribute=cls.hours[4]).delete()
+
+    def _usage(self, attribute):
+        return AllocationAttributeUsage.objects.get(allocation_attribute=attribute).value
+
+    def test_bulk_set_usage(self):
+        usages = {allocation.pk: {"Core Usage (Hours)": 10.0 * i} for i, allocation in enumerate(self.allocations)}
+        usages[self.allocations[0].pk].update({"Storage Quota (GB)": 2.5, "slurm_account_name": 1, "missing": 1})
+        usages[self.allocations[1].pk]["Storage Quota (GB)"] = 3
+
+        self.assertEqual(Allocation.bulk_set_usage(usages), 6)
+
+        self.assertEqual([self._usage(attribute) for attribute in self.hours], [0, 10, 20, 30, 40])
+        self.assertEqual(self._usage(self.storage), 2.5)
+        self.assertFalse(AllocationAttributeUsage.objects.filter(allocation_attribute=self.no_usage).exists())
+        self.assertEqual(AllocationAttributeUsage.history.filter(allocation_attribute=self.hours[1]).first().value, 10)
+
+    def test_bulk_set_usage_matches_set_usage(self):
+        self.allocations[0].set_usage("Core Usage (Hours)", 5)
+        self.allocations[4].set_usage("Core Usage (Hours)", 5)
+        expected = dict(AllocationAttributeUsage.objects.values_list("pk", "value"))
+
+        AllocationAttributeUsage.objects.filter(allocation_attribute=self.hours[4]).delete()
+        Allocation.bulk_set_usage({self.allocations[0].pk: {"Core Usage (Hours)": 5}})
+        Allocation.bulk_set_usage({self.allocations[4].pk: {"Core Usage (Hours)": 5}})
+
+        self.assertEqual(dict(AllocationAttributeUsage.objects.values_list("pk", "value")), expected)
+
+    def test_bulk_set_usage_query_count(self):
+        """The number of queries does not grow with the number of allocations"""
+        with CaptureQueriesContext(connection) as few:
+            Allocation.bulk_set_usage({self.allocations[0].pk: {"Core Usage (Hours)": 1}})
+        with CaptureQueriesContext(connection) as many:
+            Allocation.bulk_set_usage({allocation.pk: {"Core Usage (Hours)": 1} for allocation in self.allocations})
+
+        self.assertLessEqual(len(many), len(few) + 2)
+
+
 class AllocationModelStrTests(TestCase):
     """Tests for Allocation.__str__"""
 
@@ -0,0 +1,310 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""Unit tests for the allocation tasks"""
+
+import datetime
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from coldfront.core.allocation import tasks
+from coldfront.core.allocation.models import Allocation
+from coldfront.core.allocation.signals import allocation_disable_batch
+from coldfront.core.test_helpers.factories import (
+    AAttributeTypeFactory,
+    AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationFactory,
+    AllocationStatusChoiceFactory,
+    AllocationUserFactory,
+    AllocationUserStatusChoiceFactory,
+    ProjectFactory,
+    ProjectUserFactory,
+    ResourceAttributeFactory,
+    ResourceAttributeTypeFactory,
+    ResourceFactory,
+    UserFactory,
+)
+
+BASE_URL = tasks.CENTER_BASE_URL.strip("/")
+
+expire_funcs_run = []
+renewing = []
+
+
+def record_expire(allocation_pk):
+    expire_funcs_run.append(allocation_pk)
+
+
+def renew_and_record_expire(allocation_pk):
+    """Renews the allocations in renewing, as a user could while bulk_expire is running"""
+    expire_funcs_run.append(allocation_pk)
+    Allocation.objects.filter(pk__in=renewing).update(end_date=datetime.date.today())
+
+
+class UpdateStatusesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        AllocationStatusChoiceFactory(name="Expired")
+        cls.expiring = [
+            AllocationFactory(end_date=yesterday, status=AllocationStatusChoiceFactory(name=status))
+            for status in ["Active", "Active", "Unpaid", "Payment Pending", "Payment Requested"]
+        ]
+        cls.current = AllocationFactory(end_date=datetime.date.today())
+        cls.denied = AllocationFactory(end_date=yesterday, status=AllocationStatusChoiceFactory(name="Denied"))
+
+    def setUp(self):
+        expire_funcs_run.clear()
+        renewing.clear()
+        self.batches = []
+
+        def receiver(sender, allocation_pks, **kwargs):
+            self.batches.append(allocation_pks)
+
+        allocation_disable_batch.connect(receiver, weak=False, dispatch_uid="test_update_statuses")
+        self.addCleanup(allocation_disable_batch.disconnect, dispatch_uid="test_update_statuses")
+
+    def test_update_statuses(self):
+        with (
+            patch(
+                "coldfront.core.allocation.models.ALLOCATION_FUNCS_ON_EXPIRE",
+                [f"{__name__}.record_expire"],
+            ),
+            patch.object(tasks.logger, "info") as log_info,
+        ):
+            tasks.update_statuses()
+
+        pks = sorted(allocation.pk for allocation in self.expiring)
+        log_info.assert_called_once_with("Allocations set to expired: 5")
+        self.assertEqual(set(Allocation.objects.filter(pk__in=pks).values_list("status__name", flat=True)), {"Expired"})
+        self.assertEqual(Allocation.objects.get(pk=self.current.pk).status.name, "Active")
+        self.assertEqual(Allocation.objects.get(pk=self.denied.pk).status.name, "Denied")
+        self.assertEqual(expire_funcs_run, pks)
+        self.assertEqual(self.batches, [pks])
+
+        history = self.expiring[0].history.first()
+        self.assertEqual((history.history_type, history.status.name), ("~", "Expired"))
+
+    def test_bulk_expire_batches(self):
+        pks = sorted(allocation.pk for allocation in self.expiring)
+
+        with self.assertNumQueries(17):
+            expired = Allocation.bulk_expire(
+                Allocation.objects.filter(pk__in=pks[:4] + [self.current.pk]), batch_size=2
+            )
+
+        self.assertEqual(expired, sorted(pks[:4] + [self.current.pk]))
+        self.assertEqual(self.batches, [expired[:2], expired[2:4], expired[4:]])
+        # already expired allocations are skipped
+        self.assertEqual(Allocation.bulk_expire(Allocation.objects.filter(pk__in=pks[:4])), [])
+
+    def test_bulk_expire_rechecks_batches(self):
+        """An allocation renewed while earlier batches are expired isn't expired"""
+        pks = sorted(allocation.pk for allocation in self.expiring)
+        renewing.append(pks[-1])
+
+        with patch(
+            "coldfront.core.allocation.models.ALLOCATION_FUNCS_ON_EXPIRE", [f"{__name__}.renew_and_record_expire"]
+        ):
+            expired = Allocation.bulk_expire(
+                Allocation.objects.filter(pk__in=pks, end_date__lt=datetime.date.today()), batch_size=2
+            )
+
+        self.assertEqual(expired, pks[:-1])
+        self.assertEqual(expire_funcs_run, pks[:-1])
+        self.assertEqual(self.batches, [pks[:2], pks[2:4]])
+        self.assertNotEqual(Allocation.objects.get(pk=pks[-1]).status.name, "Expired")
+
+
+class SendExpiryEmailsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = datetime.date.today()
+        cluster = ResourceFactory(name="cluster", is_allocatable=True)
+        storage = ResourceFactory(name="storage", is_allocatable=False)
+        text = AAttributeTypeFactory(name="Text")
+        expire_notification = AllocationAttributeTypeFactory(name="EXPIRE NOTIFICATION", attribute_type=text)
+        cloud_usage_notification = AllocationAttributeTypeFactory(name="CLOUD_USAGE_NOTIFICATION", attribute_type=text)
+
+        cls.alice = UserFactory(username="alice")
+        cls.bob = UserFactory(username="bob")
+        quiet = UserFactory(username="quiet")
+        removed = UserFactory(username="removed")
+        cls.physics = ProjectFactory(title="Physics", pi=cls.alice)
+        cls.chemistry = ProjectFactory(title="Chemistry", pi=cls.bob)
+        for project, user in [(cls.physics, cls.alice), (cls.physics, removed), (cls.chemistry, cls.bob)]:
+            ProjectUserFactory(project=project, user=user)
+        ProjectUserFactory(project=cls.physics, user=quiet, enable_notifications=False)
+
+        def allocation(project, days, status, resources, users):
+            obj = AllocationFactory(
+                project=project,
+                end_date=today + datetime.timedelta(days=days),
+                status=AllocationStatusChoiceFactory(name=status),
+            )
+            obj.resources.add(*resources)
+            for user in users:
+                AllocationUserFactory(allocation=obj, user=user)
+            AllocationUserFactory(
+                allocation=obj, user=removed, status=AllocationUserStatusChoiceFactory(name="Removed")
+            )
+            return obj
+
+        cls.cluster_7 = allocation(cls.physics, 7, "Active", [storage, cluster], [cls.alice, quiet])
+        cls.storage_30 = allocation(cls.physics, 30, "Payment Pending", [storage], [cls.alice])
+        cls.chemistry_7 = allocation(cls.chemistry, 7, "Active", [cluster], [cls.bob])
+        cls.opted_out = allocation(cls.chemistry, 7, "Active", [storage], [cls.bob])
+        AllocationAttributeFactory(allocation=cls.opted_out, allocation_attribute_type=expire_notification, value="No")
+        cls.no_cloud = allocation(cls.physics, 7, "Active", [storage], [cls.alice])
+        AllocationAttributeFactory(
+            allocation=cls.no_cloud, allocation_attribute_type=cloud_usage_notification, value="No"
+        )
+        cls.inactive = allocation(cls.physics, 7, "Denied", [cluster], [cls.alice])
+
+        cls.expired = allocation(cls.physics, -1, "Expired", [cluster], [cls.alice, quiet])
+        AllocationAttributeFactory(allocation=cls.expired, allocation_attribute_type=expire_notification, value="Yes")
+        cls.expired_quietly = allocation(cls.chemistry, -1, "Active", [storage], [cls.bob])
+
+    def send_expiry_emails(self):
+        with (
+            patch.object(tasks, "EMAIL_ALLOCATION_EXPIRING_NOTIFICATION_DAYS", [30, 7, 7]),
+            patch.object(tasks, "EMAIL_ADMINS_ON_ALLOCATION_EXPIRE", True),
+            patch.object(tasks, "send_email_template") as send_email_template,
+        ):
+            tasks.send_expiry_emails()
+        return [call.args for call in send_email_template.call_args_list]
+
+    def test_expiry_emails(self):
+        emails = self.send_expiry_emails()
+        physics_url = f"{BASE_URL}/project/{self.physics.pk}/"
+        chemistry_url = f"{BASE_URL}/project/{self.chemistry.pk}/"
+
+        self.assertEqual(
+            [(template, receivers) for subject, template, context, receivers in emails],
+            [
+                ("email/allocation_expiring.txt", [self.alice.email]),
+                ("email/allocation_expiring.txt", [self.bob.email]),
+                ("email/allocation_expired.txt", [self.alice.email]),
+                ("email/admin_allocation_expired.txt", [tasks.EMAIL_ADMIN_LIST]),
+            ],
+        )
+
+        alice_expiring = emails[0][2]
+        self.assertEqual(alice_expiring["project_dict"], {"Physics": (physics_url, "alice")})
+        self.assertEqual(
+            alice_expiring["expiration_dict"],
+            {
+                7: [(physics_url, f"{BASE_URL}/allocation/{self.cluster_7.pk}/renew/", "cluster")],
+                30: [(physics_url, f"{BASE_URL}/allocation/{self.storage_30.pk}/", "storage")],
+            },
+        )
+        self.assertEqual(alice_expiring["expiration_days"], [7, 30])
+        self.assertEqual(
+            emails[1][2]["expiration_dict"],
+            {7: [(chemistry_url, f"{BASE_URL}/allocation/{self.chemistry_7.pk}/renew/", "cluster")]},
+        )
+
+        self.assertEqual(
+            emails[2][2]["allocation_dict"],
+            {physics_url: [{f"{BASE_URL}/allocation/{self.expired.pk}/renew/": "cluster"}]},
+        )
+        self.assertEqual(
+            emails[3][2]["project_dict"], {"Physics": (physics_url, "alice"), "Chemistry": (chemistry_url, "bob")}
+        )
+        self.assertEqual(
+            emails[3][2]["allocation_dict"],
+            {
+                physics_url: [{f"{BASE_URL}/allocation/{self.expired.pk}/": "cluster"}],
+                chemistry_url: [{f"{BASE_URL}/allocation/{self.expired_quietly.pk}/": "storage"}],
+            },
+        )
+
+    def test_expiry_email_queries(self):
+        """One query for each notification window and one for expired allocations, however many allocations"""
+        with self.assertNumQueries(3):
+            self.send_expiry_emails()
+
+
+class SendEulaRemindersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        eula = ResourceAttributeTypeFactory(name="eula")
+        cluster = ResourceFactory(name="cluster", is_allocatable=True)
+        storage = ResourceFactory(name="storage", is_allocatable=False)
+        scratch = ResourceFactory(name="scratch")
+        ResourceAttributeFactory(resource=cluster, resource_attribute_type=eula, value="Be nice")
+        ResourceAttributeFactory(resource=storage, resource_attribute_type=eula, value="Back up your data")
+        ResourceAttributeFactory(resource=scratch, resource_attribute_type=eula, value="")
+        pending = AllocationUserStatusChoiceFactory(name="PendingEULA")
+
+        cls.alice = UserFactory(username="alice")
+        cls.bob = UserFactory(username="bob")
+        cls.quiet = UserFactory(username="quiet")
+        project = ProjectFactory(pi=cls.alice)
+        ProjectUserFactory(project=project, user=cls.alice)
+        ProjectUserFactory(project=project, user=cls.bob)
+        ProjectUserFactory(project=project, user=cls.quiet, enable_notifications=False)
+
+        def allocation(resources, users):
+            obj = AllocationFactory(project=project)
+            obj.resources.add(*resources)
+            for user, status in users:
+                AllocationUserFactory(allocation=obj, user=user, status=status)
+            return obj
+
+        active = AllocationUserStatusChoiceFactory(name="Active")
+        cls.cluster = allocation([cluster, storage], [(cls.alice, pending), (cls.bob, pending), (cls.quiet, pending)])
+        cls.storage = allocation([storage], [(cls.alice, pending), (cls.bob, active)])
+        allocation([scratch], [(cls.alice, pending)])
+
+    def send_eula_reminders(self, ignore_opt_out=False):
+        with (
+            patch.object(tasks, "EMAIL_ALLOCATION_EULA_IGNORE_OPT_OUT", ignore_opt_out),
+            patch.object(tasks, "send_email_template") as send_email_template,
+        ):
+            tasks.send_eula_reminders()
+        return [call.args for call in send_email_template.call_args_list]
+
+    def test_one_digest_per_user(self):
+        with self.assertNumQueries(1):
+            emails = self.send_eula_reminders()
+
+        cluster = {
+            "resource": "cluster (Storage)",
+            "resource_name": "cluster",
+            "url": f"{BASE_URL}/allocation/{self.cluster.pk}/review-eula",
+            "pi": "alice",
+        }
+        storage = {
+            "resource": "storage (Storage)",
+            "resource_name": "storage",
+            "url": f"{BASE_URL}/allocation/{self.storage.pk}/review-eula",
+            "pi": "alice",
+        }
+        self.assertEqual(
+            emails,
+            [
+                (
+                    "Reminder: Agree to EULAs for 2 allocations",
+                    "email/allocation_eula_reminder.txt",
+                    {"allocations": [cluster, storage]},
+                    [self.alice.email],
+                ),
+                (
+                    "Reminder: Agree to EULA for cluster (alice)",
+                    "email/allocation_eula_reminder.txt",
+                    {"allocations": [cluster]},
+                    [self.bob.email],
+                ),
+            ],
+        )
+
+    def test_ignore_opt_out(self):
+        emails = self.send_eula_reminders(ignore_opt_out=True)
+
+        self.assertEqual(
+            [receivers for *_, receivers in emails], [[user.email] for user in (self.alice, self.bob, self.quiet)]
+        )
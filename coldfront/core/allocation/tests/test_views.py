@@ -5,11 +5,17 @@
 import logging
 from datetime import date
 from http import HTTPStatus
+from io import StringIO
+from unittest.mock import patch
 
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from coldfront.core.allocation.models import (
@@ -17,7 +23,9 @@ from coldfront.core.allocation.models import (
     AllocationAttribute,
     AllocationAttributeChangeRequest,
     AllocationChangeRequest,
+    AllocationVisibility,
 )
+from coldfront.core.allocation.utils import update_allocation_visibility
 from coldfront.core.project.models import (
     Project,
     ProjectUser,
@@ -102,6 +110,10 @@ class AllocationListViewTest(AllocationViewBaseTest):
             allocation.resources.add(ResourceFactory(name="holylfs09/tier1"))
         cls.nonproj_nonallocation_user = UserFactory()
 
+    def setUp(self):
+        # counts cached by other tests may have been rolled back
+        cache.clear()
+
     def test_allocation_list_access_admin(self):
         """Confirm that AllocationList access control works for admin"""
         self.allocation_access_tstbase("/allocation/")
@@ -147,6 +159,136 @@ class AllocationListViewTest(AllocationViewBaseTest):
         response = self.client.get(base_url + f"&resource_name={self.allocation.resources.first().pk}")
         self.assertEqual(len(response.context["allocation_list"]), 1)
 
+    def test_allocation_list_visibility_updated(self):
+        """Confirm that AllocationList follows changes to allocation users and project users"""
+        self.client.force_login(self.proj_nonallocation_user, backend=BACKEND)
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            allocation_user = AllocationUserFactory(allocation=self.allocation, user=self.proj_nonallocation_user)
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 1)
+
+        allocation_user.status = AllocationUserStatusChoiceFactory(name="Removed")
+        with self.captureOnCommitCallbacks(execute=True):
+            allocation_user.save()
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 0)
+
+        project_user = ProjectUser.objects.get(project=self.project, user=self.proj_nonallocation_user)
+        project_user.role = ProjectUserRoleChoiceFactory(name="Manager")
+        with self.captureOnCommitCallbacks(execute=True):
+            project_user.save()
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 1)
+
+    def _page_through(self, url, cursor_param="after"):
+        """Follow the Next (or Previous) cursor links from url, returning the allocation pks in page order"""
+        pks = []
+        while url:
+            response = self.client.get(url)
+            page = response.context["page_obj"]
+            pks.append([allocation.pk for allocation in response.context["allocation_list"]])
+            url = None
+            if cursor_param == "after" and page.has_next():
+                url = f"/allocation/?page={page.next_page_number()}&after={page.next_cursor}&{self.sort_parameters}"
+            elif cursor_param == "before" and page.has_previous():
+                url = f"/allocation/?page={page.previous_page_number()}&before={page.previous_cursor}&{self.sort_parameters}"
+        return pks
+
+    def test_allocation_list_keyset_pagination(self):
+        """Confirm that following the AllocationList cursors visits every allocation in sort order"""
+        self.client.force_login(self.admin_user, backend=BACKEND)
+        self.sort_parameters = "show_all_allocations=on&order_by=project__pi__username&direction=des"
+        expected = list(Allocation.objects.order_by("-project__pi__username", "-pk").values_list("pk", flat=True))
+
+        pages = self._page_through(f"/allocation/?{self.sort_parameters}")
+        self.assertEqual([len(page) for page in pages], [25, 25, 25, 25, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        # walking back from the last page gives the same pages
+        response = self.client.get(f"/allocation/?page=5&{self.sort_parameters}")
+        page = response.context["page_obj"]
+        self.assertEqual(page.number, 5)
+        pages_back = self._page_through(
+            f"/allocation/?page=4&before={page.previous_cursor}&{self.sort_parameters}", "before"
+        )
+        self.assertEqual(pages_back, pages[3::-1])
+
+    def test_allocation_list_keyset_invalid_cursor(self):
+        """Confirm that AllocationList falls back to the page number when the cursor is not valid"""
+        self.client.force_login(self.admin_user, backend=BACKEND)
+        response = self.client.get("/allocation/?show_all_allocations=on&page=2&after=notacursor")
+        expected = list(Allocation.objects.order_by("pk").values_list("pk", flat=True)[25:50])
+        self.assertEqual([allocation.pk for allocation in response.context["allocation_list"]], expected)
+
+    def test_allocation_list_count_cached(self):
+        """Confirm that the AllocationList count is cached until allocations change"""
+        self.client.force_login(self.admin_user, backend=BACKEND)
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 101)
+
+        # a page past the first one, with the same filters, reuses the count
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/allocation/?show_all_allocations=on&page=2")
+        self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+
+        # counts are refreshed once the change is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            AllocationFactory()
+        response = self.client.get("/allocation/?show_all_allocations=on")
+        self.assertEqual(response.context["allocations_count"], 102)
+
+    def test_rebuild_allocation_visibility(self):
+        """Confirm that rebuild_allocation_visibility recreates the allocation visibility index"""
+        expected = set(AllocationVisibility.objects.values_list("user", "allocation", "role", "allocation_user_status"))
+        self.assertTrue(expected)
+
+        AllocationVisibility.objects.all().delete()
+        call_command("rebuild_allocation_visibility", chunk_size=7, stdout=StringIO())
+
+        self.assertEqual(
+            set(AllocationVisibility.objects.values_list("user", "allocation", "role", "allocation_user_status")),
+            expected,
+        )
+
+    def test_update_allocation_visibility_concurrent(self):
+        """Confirm that update_allocation_visibility upserts rows another update inserted meanwhile"""
+        bulk_create = AllocationVisibility.objects.bulk_create
+
+        def concurrent_bulk_create(rows, **kwargs):
+            AllocationVisibility.objects.filter(allocation=self.allocation, user=self.allocation_user).delete()
+            bulk_create([AllocationVisibility(allocation=self.allocation, user=self.allocation_user)])
+            return bulk_create(rows, **kwargs)
+
+        with patch.object(AllocationVisibility.objects, "bulk_create", concurrent_bulk_create):
+            update_allocation_visibility(allocations=[self.allocation.pk], users=[self.allocation_user.pk])
+
+        self.assertEqual(
+            AllocationVisibility.objects.get(
+                allocation=self.allocation, user=self.allocation_user
+            ).allocation_user_status,
+            "Active",
+        )
+
+    def test_admin_status_action_updates_visibility(self):
+        """Confirm that the AllocationUser admin status actions keep the allocation visibility index up to date"""
+        self.client.force_login(self.admin_user, backend=BACKEND)
+        allocation_user = self.allocation.allocationuser_set.get(user=self.allocation_user)
+
+        self.client.post(
+            "/admin/allocation/allocationuser/",
+            {"action": "set_removed", "_selected_action": [allocation_user.pk]},
+        )
+
+        self.assertEqual(
+            AllocationVisibility.objects.get(
+                allocation=self.allocation, user=self.allocation_user
+            ).allocation_user_status,
+            "Removed",
+        )
+
 
 class AllocationChangeDetailViewTest(AllocationViewBaseTest):
     """Tests for AllocationChangeDetailView"""
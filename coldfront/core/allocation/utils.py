@@ -2,11 +2,20 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+from django.db import transaction
 from django.db.models import Q
 
-from coldfront.core.allocation.models import AllocationUser, AllocationUserStatusChoice
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationUser,
+    AllocationUserStatusChoice,
+    AllocationVisibility,
+)
+from coldfront.core.project.models import ProjectUser
 from coldfront.core.resource.models import Resource
 
+ALLOCATION_VISIBILITY_BATCH_SIZE = 1000
+
 
 def set_allocation_user_status_to_error(allocation_user_pk):
     allocation_user_obj = AllocationUser.objects.get(pk=allocation_user_pk)
@@ -66,3 +75,61 @@ def get_user_resources(user_obj):
 
 def test_allocation_function(allocation_pk):
     print("test_allocation_function", allocation_pk)
+
+
+def update_allocation_visibility(allocations=None, users=None):
+    """Recompute the AllocationVisibility rows of the given allocations and users from their project users and
+    allocation users.
+
+    Params:
+        allocations (QuerySet[Allocation] | list[int]): allocations (or pks) to update, all allocations if None
+        users (QuerySet[User] | list[int]): users (or pks) to update, all users if None
+    """
+
+    allocation_filter = Q()
+    if allocations is not None:
+        allocation_filter = Q(pk__in=allocations)
+    project_allocations = {}
+    allocation_ids = []
+    for allocation_id, project_id in Allocation.objects.filter(allocation_filter).values_list("pk", "project_id"):
+        project_allocations.setdefault(project_id, []).append(allocation_id)
+        allocation_ids.append(allocation_id)
+
+    project_users = ProjectUser.objects.filter(project_id__in=project_allocations.keys())
+    allocation_users = AllocationUser.objects.filter(allocation_id__in=allocation_ids)
+    visibility = AllocationVisibility.objects.filter(allocation_id__in=allocation_ids)
+    if users is not None:
+        project_users = project_users.filter(user__in=users)
+        allocation_users = allocation_users.filter(user__in=users)
+        visibility = visibility.filter(user__in=users)
+
+    rows = {}
+    for user_id, project_id, role, status in project_users.values_list(
+        "user_id", "project_id", "role__name", "status__name"
+    ):
+        for allocation_id in project_allocations[project_id]:
+            rows[(user_id, allocation_id)] = AllocationVisibility(
+                user_id=user_id, allocation_id=allocation_id, role=role, project_user_status=status
+            )
+
+    for user_id, allocation_id, status in allocation_users.values_list("user_id", "allocation_id", "status__name"):
+        row = rows.setdefault(
+            (user_id, allocation_id), AllocationVisibility(user_id=user_id, allocation_id=allocation_id)
+        )
+        row.allocation_user_status = status
+
+    stale = [
+        pk
+        for pk, user_id, allocation_id in visibility.values_list("pk", "user_id", "allocation_id")
+        if (user_id, allocation_id) not in rows
+    ]
+    with transaction.atomic():
+        AllocationVisibility.objects.filter(pk__in=stale).delete()
+        # upserted, so rows inserted by a concurrent update of the same users and allocations don't conflict
+        AllocationVisibility.objects.bulk_create(
+            rows.values(),
+            batch_size=ALLOCATION_VISIBILITY_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["user", "allocation"],
+            update_fields=["role", "project_user_status", "allocation_user_status"],
+        )
@@ -12,7 +12,6 @@ from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.forms import formset_factory
@@ -76,6 +75,7 @@ from coldfront.core.utils.mail import (
     send_allocation_eula_customer_email,
     send_email_template,
 )
+from coldfront.core.utils.mixins.views import KeysetPaginationMixin
 
 ALLOCATION_ENABLE_ALLOCATION_RENEWAL = import_from_settings("ALLOCATION_ENABLE_ALLOCATION_RENEWAL", True)
 ALLOCATION_DEFAULT_ALLOCATION_LENGTH = import_from_settings("ALLOCATION_DEFAULT_ALLOCATION_LENGTH", 365)
@@ -434,11 +434,12 @@ class AllocationEULAView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
         return HttpResponseRedirect(reverse("allocation-review-eula", kwargs={"pk": pk}))
 
 
-class AllocationListView(LoginRequiredMixin, ListView):
+class AllocationListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Allocation
     template_name = "allocation/allocation_list.html"
     context_object_name = "allocation_list"
     paginate_by = 25
+    keyset_fields = ("id", "project__pi__username", "status__name")
 
     def get_queryset(self):
         order_by = self.request.GET.get("order_by")
@@ -449,6 +450,9 @@ class AllocationListView(LoginRequiredMixin, ListView):
         else:
             order_by = "id"
 
+        # Filtering or ordering on the many-to-many relations below can return an allocation more than once
+        distinct = order_by.lstrip("-").startswith("resources")
+
         allocation_search_form = AllocationSearchForm(self.request.GET)
 
         if allocation_search_form.is_valid():
@@ -475,15 +479,13 @@ class AllocationListView(LoginRequiredMixin, ListView):
                     )
                     .filter(
                         Q(project__status__name__in=["New", "Active"])
-                        & Q(project__projectuser__status__name__in=["Active"])
-                        & Q(project__projectuser__user=self.request.user)
+                        & Q(allocationvisibility__user=self.request.user)
+                        & Q(allocationvisibility__project_user_status="Active")
                         & (
-                            Q(project__projectuser__role__name="Manager")
-                            | Q(allocationuser__user=self.request.user)
-                            & Q(allocationuser__status__name__in=["Active", "PendingEULA"])
+                            Q(allocationvisibility__role="Manager")
+                            | Q(allocationvisibility__allocation_user_status__in=["Active", "PendingEULA"])
                         )
                     )
-                    .distinct()
                     .order_by(order_by)
                 )
 
@@ -498,14 +500,17 @@ class AllocationListView(LoginRequiredMixin, ListView):
                     | Q(allocationuser__user__username__icontains=data.get("username"))
                     & Q(allocationuser__status__name__in=["PendingEULA", "Active"])
                 )
+                distinct = True
 
             # Resource Type
             if data.get("resource_type"):
                 allocations = allocations.filter(resources__resource_type=data.get("resource_type"))
+                distinct = True
 
             # Resource Name
             if data.get("resource_name"):
                 allocations = allocations.filter(resources__in=data.get("resource_name"))
+                distinct = True
 
             # Allocation Attribute Name
             if data.get("allocation_attribute_name") and data.get("allocation_attribute_value"):
@@ -513,6 +518,7 @@ class AllocationListView(LoginRequiredMixin, ListView):
                     Q(allocationattribute__allocation_attribute_type=data.get("allocation_attribute_name"))
                     & Q(allocationattribute__value=data.get("allocation_attribute_value"))
                 )
+                distinct = True
 
             # End Date
             if data.get("end_date"):
@@ -539,18 +545,21 @@ class AllocationListView(LoginRequiredMixin, ListView):
                     "status",
                 )
                 .filter(
-                    Q(allocationuser__user=self.request.user)
-                    & Q(allocationuser__status__name__in=["PendingEULA", "Active"])
+                    Q(allocationvisibility__user=self.request.user)
+                    & Q(allocationvisibility__allocation_user_status__in=["PendingEULA", "Active"])
                 )
                 .order_by(order_by)
             )
 
-        return allocations.distinct()
+        if distinct:
+            allocations = allocations.distinct()
+
+        return allocations
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        allocations_count = self.get_queryset().count()
-        context["allocations_count"] = allocations_count
+        # The paginator has already counted the allocations
+        context["allocations_count"] = context["paginator"].count
 
         allocation_search_form = AllocationSearchForm(self.request.GET)
 
@@ -582,18 +591,6 @@ class AllocationListView(LoginRequiredMixin, ListView):
         context["filter_parameters"] = filter_parameters
         context["filter_parameters_with_order_by"] = filter_parameters_with_order_by
 
-        allocation_list = context.get("allocation_list")
-        paginator = Paginator(allocation_list, self.paginate_by)
-
-        page = self.request.GET.get("page")
-
-        try:
-            allocation_list = paginator.page(page)
-        except PageNotAnInteger:
-            allocation_list = paginator.page(1)
-        except EmptyPage:
-            allocation_list = paginator.page(paginator.num_pages)
-
         return context
 
 
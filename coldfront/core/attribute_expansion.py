@@ -9,8 +9,16 @@
 # attributes.  Used in the expanded_value() method of AllocationAttribute
 # and ResourceAttribute.
 
+import functools
 import logging
 import math
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from coldfront.core.allocation.signals import allocation_attribute_changed
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +27,120 @@ logger = logging.getLogger(__name__)
 
 ATTRIBUTE_EXPANSION_TYPE_PREFIX = "Attribute Expanded"
 ATTRIBUTE_EXPANSION_ATTRIBLIST_SUFFIX = "_attriblist"
+ATTRIBUTE_EXPANSION_PROGRAM_CACHE_SIZE = 1024
+ATTRIBUTE_PARAMETER_SOURCES = [":APDICT", "RESOURCE:", "ALLOCATION:", ":"]
+
+_expansion_context = ContextVar("attribute_expansion_context", default=None)
+
+
+class ExpansionContext:
+    """Cache of the lookups made while expanding attributes.
+
+    Expanding the same attribute for many allocations (e.g. in a Slurm dump
+    or on the allocation detail page) otherwise re-queries the resources
+    of the allocation, the attriblist attributes and re-parses the
+    attriblist each time.  An ExpansionContext is active for the duration
+    of a request (see AttributeExpansionMiddleware) or a management command
+    (see expansion_context()), and cached entries for an allocation are
+    dropped when one of its attributes changes.
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.attriblists = {}
+        self.parameter_dicts = {}
+
+    @staticmethod
+    def _key(attribute_name, resources, allocations):
+        return (attribute_name, tuple(r.pk for r in resources), tuple(a.pk for a in allocations))
+
+    def get_resources(self, allocation):
+        """Returns the list of resources of allocation"""
+        if allocation.pk not in self.resources:
+            self.resources[allocation.pk] = list(allocation.resources.all())
+        return self.resources[allocation.pk]
+
+    def get_attriblist_str(self, attribute_name, resources=[], allocations=[]):
+        """Cached version of get_attriblist_str()"""
+        key = self._key(attribute_name, resources, allocations)
+        if key not in self.attriblists:
+            self.attriblists[key] = get_attriblist_str(
+                attribute_name=attribute_name, resources=resources, allocations=allocations
+            )
+        return self.attriblists[key]
+
+    def make_attribute_parameter_dictionary(
+        self, attribute_name, attribute_parameter_string, resources=[], allocations=[]
+    ):
+        """Cached version of make_attribute_parameter_dictionary()"""
+        key = self._key(attribute_name, resources, allocations) + (attribute_parameter_string,)
+        if key not in self.parameter_dicts:
+            self.parameter_dicts[key] = make_attribute_parameter_dictionary(
+                attribute_name=attribute_name,
+                attribute_parameter_string=attribute_parameter_string,
+                resources=resources,
+                allocations=allocations,
+            )
+        return self.parameter_dicts[key]
+
+    def clear(self):
+        """Drop all cached entries"""
+        self.resources.clear()
+        self.attriblists.clear()
+        self.parameter_dicts.clear()
+
+    def invalidate_allocation(self, allocation_pk):
+        """Drop all cached entries that depend on the allocation with pk allocation_pk"""
+        self.resources.pop(allocation_pk, None)
+        for cache in (self.attriblists, self.parameter_dicts):
+            for key in [k for k in cache if allocation_pk in k[2]]:
+                del cache[key]
+
+
+def get_expansion_context():
+    """Returns the active ExpansionContext, or None if attribute expansion is not being cached"""
+    return _expansion_context.get()
+
+
+@contextmanager
+def expansion_context():
+    """Cache attribute expansion lookups within the with block.
+
+    If a context is already active it is reused, so nested blocks share
+    the same cache.
+    """
+    context = _expansion_context.get()
+    if context is not None:
+        yield context
+        return
+
+    token = _expansion_context.set(ExpansionContext())
+    try:
+        yield _expansion_context.get()
+    finally:
+        _expansion_context.reset(token)
+
+
+@receiver(allocation_attribute_changed)
+def invalidate_allocation_attribute_changed(sender, **kwargs):
+    context = _expansion_context.get()
+    if context is not None:
+        context.invalidate_allocation(kwargs.get("allocation_pk"))
+
+
+@receiver(post_save, sender="allocation.AllocationAttribute")
+@receiver(post_delete, sender="allocation.AllocationAttribute")
+def invalidate_allocation_attribute_saved(sender, instance, **kwargs):
+    context = _expansion_context.get()
+    if context is not None:
+        context.invalidate_allocation(instance.allocation_id)
+
+
+@receiver(m2m_changed, sender="allocation.Allocation_resources")
+def invalidate_allocation_resources_changed(sender, **kwargs):
+    context = _expansion_context.get()
+    if context is not None:
+        context.clear()
 
 
 def is_expandable_type(attribute_type):
@@ -99,7 +221,23 @@ def get_attribute_parameter_value(argument, attribute_parameter_dict, error_text
     This method returns the expanded value, or None if unable to
     evaluate
     """
-    value = None
+    source, value = parse_attribute_parameter_argument(argument, error_text)
+    return _evaluate_attribute_parameter_argument(
+        source, value, attribute_parameter_dict, resources=resources, allocations=allocations
+    )
+
+
+def parse_attribute_parameter_argument(argument, error_text):
+    """Parses the argument of an attribute parameter statement.
+
+    Returns a (source, value) tuple.  For string and numeric constants
+    source is None and value is the constant (or None if the constant is
+    invalid).  Otherwise source is the matching prefix from
+    ATTRIBUTE_PARAMETER_SOURCES and value is the name of the parameter or
+    attribute to dereference.
+
+    See get_attribute_parameter_value() for the recognized arguments.
+    """
 
     # Check for string constant
     if argument.startswith("'"):
@@ -111,7 +249,7 @@ def get_attribute_parameter_value(argument, attribute_parameter_dict, error_text
         if tmp == "'":
             # Good string literal
             tmpstr = tmpstr[:-1]
-            return tmpstr
+            return None, tmpstr
         else:
             # Bad string literal
             logger.warning(
@@ -119,62 +257,77 @@ def get_attribute_parameter_value(argument, attribute_parameter_dict, error_text
                     argument, error_text
                 )
             )
-            return None
+            return None, None
 
-    # If argument if prefixed with any of the strings in attrib_sources,
-    # strip the prefix and set attrib_source accordingly
-    attrib_source = None
-    attrib_sources = [":APDICT", "RESOURCE:", "ALLOCATION:", ":"]
-    for asrc in attrib_sources:
+    # If argument if prefixed with any of the strings in
+    # ATTRIBUTE_PARAMETER_SOURCES, strip the prefix and return it as the source
+    for asrc in ATTRIBUTE_PARAMETER_SOURCES:
         if argument.startswith(asrc):
-            # Got a match
-            attrib_source = asrc
-            tmplen = len(asrc)
-            argument = argument[tmplen:]
-            break
-
-    # Try expanding as a parameter/attribute
-    # We do attribute_parameter_dict first, then allocations, then
-    # resources to try to get value most specific to use case
-    if attribute_parameter_dict is not None and (attrib_source == ":" or attrib_source == "APDICT:"):
-        if argument in attribute_parameter_dict:
-            return attribute_parameter_dict[argument]
-
-    if attrib_source == ":" or attrib_source == "ALLOCATION:":
-        for alloc in allocations:
-            tmp = alloc.get_attribute(argument)
-            if tmp is not None:
-                return tmp
-
-    if attrib_source == ":" or attrib_source == "RESOURCE:":
-        for res in resources:
-            tmp = res.get_attribute(argument)
-            if tmp is not None:
-                return tmp
-
-    if attrib_source is not None:
-        # We were given an attribute or parameter name, but could not
-        # find it.  Just return None
-        return None
+            return asrc, argument[len(asrc) :]
 
     # If reach here, argument is not a string literal, or a
     # parameter or attribute name, so try numeric constant
     try:
-        value = int(argument)
-        return value
+        return None, int(argument)
     except ValueError:
         try:
-            value = float(argument)
-            return value
+            return None, float(argument)
         except ValueError:
             logger.warning(
                 "Unable to evaluate argument '{arg}' while processing {etxt}, returning None".format(
                     arg=argument, etxt=error_text
                 )
             )
-            return None
+            return None, None
+
+
+def _lookup_attribute(objects, source, name, values):
+    """Returns the value of the first attribute named name in objects.  Values
+    already looked up are remembered in the values dict, if given."""
+
+    key = (source, name)
+    if values is not None and key in values:
+        return values[key]
+
+    value = None
+    for obj in objects:
+        value = obj.get_attribute(name)
+        if value is not None:
+            break
+
+    if values is not None:
+        values[key] = value
+    return value
+
+
+def _evaluate_attribute_parameter_argument(
+    source, value, attribute_parameter_dict, resources=[], allocations=[], values=None
+):
+    """Dereferences an argument parsed by parse_attribute_parameter_argument()"""
 
-    # Should not reach here
+    if source is None:
+        # String or numeric constant
+        return value
+
+    # Try expanding as a parameter/attribute
+    # We do attribute_parameter_dict first, then allocations, then
+    # resources to try to get value most specific to use case
+    if attribute_parameter_dict is not None and (source == ":" or source == "APDICT:"):
+        if value in attribute_parameter_dict:
+            return attribute_parameter_dict[value]
+
+    if source == ":" or source == "ALLOCATION:":
+        tmp = _lookup_attribute(allocations, "ALLOCATION:", value, values)
+        if tmp is not None:
+            return tmp
+
+    if source == ":" or source == "RESOURCE:":
+        tmp = _lookup_attribute(resources, "RESOURCE:", value, values)
+        if tmp is not None:
+            return tmp
+
+    # We were given an attribute or parameter name, but could not
+    # find it.  Just return None
     return None
 
 
@@ -212,6 +365,67 @@ def process_attribute_parameter_operation(opcode, oldvalue, argument, error_text
     parameter.  Generally returns None on errors (e.g. undefined
     required values, or bad types, etc)
     """
+    return _apply_attribute_parameter_operation(
+        ATTRIBUTE_PARAMETER_OPERATIONS.get(opcode), opcode, oldvalue, argument, error_text
+    )
+
+
+def _operation_assign(oldvalue, argument, error_text):
+    # Assignment operation
+    return argument
+
+
+def _operation_default(oldvalue, argument, error_text):
+    # Defaulting operation
+    if oldvalue is None:
+        return argument
+    return oldvalue
+
+
+def _operation_add(oldvalue, argument, error_text):
+    # Addition/concatenation operation
+    if isinstance(oldvalue, (int, float, str)):
+        return oldvalue + argument
+    logger.warning(
+        "Operator += acting on parameter of type {} in {}, returning None".format(type(oldvalue), error_text)
+    )
+    return None
+
+
+def _operation_subtract(oldvalue, argument, error_text):
+    return oldvalue - argument
+
+
+def _operation_multiply(oldvalue, argument, error_text):
+    return oldvalue * argument
+
+
+def _operation_divide(oldvalue, argument, error_text):
+    return oldvalue / argument
+
+
+def _operation_function(oldvalue, argument, error_text):
+    if argument == "floor":
+        return math.floor(oldvalue)
+    logger.error("Unrecognized function named {} in (= for {}, returning None".format(argument, error_text))
+    return None
+
+
+ATTRIBUTE_PARAMETER_OPERATIONS = {
+    ":": _operation_assign,
+    "|": _operation_default,
+    "+": _operation_add,
+    "-": _operation_subtract,
+    "*": _operation_multiply,
+    "/": _operation_divide,
+    "(": _operation_function,
+}
+
+
+def _apply_attribute_parameter_operation(operation, opcode, oldvalue, argument, error_text):
+    """Applies operation, the ATTRIBUTE_PARAMETER_OPERATIONS entry for opcode.
+    See process_attribute_parameter_operation()."""
+
     # Argument should never be None
     if argument is None:
         logger.warning("Operator {}= acting on None argument in {}, returning None".format(opcode, error_text))
@@ -222,50 +436,13 @@ def process_attribute_parameter_operation(opcode, oldvalue, argument, error_text
             logger.warning("Operator {}= acting on oldvalue=None in {}, returning None".format(opcode, error_text))
             return None
 
-    try:
-        if opcode == ":":
-            # Assignment operation
-            return argument
-        if opcode == "|":
-            # Defaulting operation
-            if oldvalue is None:
-                return argument
-            else:
-                return oldvalue
-        if opcode == "+":
-            # Addition/concatenation operation
-            if isinstance(oldvalue, int) or isinstance(oldvalue, float):
-                newval = oldvalue + argument
-                return newval
-            elif isinstance(oldvalue, str):
-                newval = oldvalue + argument
-                return newval
-            else:
-                logger.warning(
-                    "Operator {}= acting on parameter of type {} in {}, returning None".format(
-                        opcode, type(oldvalue), error_text
-                    )
-                )
-                return None
-        if opcode == "-":
-            newval = oldvalue - argument
-            return newval
-        if opcode == "*":
-            newval = oldvalue * argument
-            return newval
-        if opcode == "/":
-            newval = oldvalue / argument
-            return newval
-        if opcode == "(":
-            if argument == "floor":
-                newval = math.floor(oldvalue)
-            else:
-                logger.error(
-                    "Unrecognized function named {} in {}= for {}, returning None".format(argument, opcode, error_text)
-                )
-                return None
-        # If reached here, we do not recognize opcode
+    if operation is None:
+        # We do not recognize opcode
         logger.error("Unrecognized operation {}= in {}, returning None".format(opcode, error_text))
+        return None
+
+    try:
+        return operation(oldvalue, argument, error_text)
     except Exception:
         logger.warning(
             "Error performing operator {op}= on oldvalue='{old}' and argument={arg} in {errtext}".format(
@@ -306,62 +483,125 @@ def process_attribute_parameter_string(
     the operations and argument values.
     """
 
+    statement = compile_attribute_parameter_string(parameter_string, attribute_name)
+    if statement is None:
+        return attribute_parameter_dict
+    return statement.run(attribute_parameter_dict, resources=resources, allocations=allocations)
+
+
+class AttributeParameterStatement:
+    """A compiled attribute parameter definition/statement.
+
+    Holds the parameter name, the operation and the parsed argument of the
+    statement, so running it only dereferences the argument and applies
+    the operation.  See compile_attribute_parameter_string().
+    """
+
+    __slots__ = ("pname", "opcode", "operation", "source", "argument", "error_text")
+
+    def __init__(self, pname, opcode, source, argument, error_text):
+        self.pname = pname
+        self.opcode = opcode
+        self.operation = ATTRIBUTE_PARAMETER_OPERATIONS.get(opcode)
+        self.source = source
+        self.argument = argument
+        self.error_text = error_text
+
+    def run(self, attribute_parameter_dict, resources=[], allocations=[], values=None):
+        """Runs the statement, storing the new value of the parameter in
+        attribute_parameter_dict, which is also returned.  Values, if given,
+        is a dict remembering the attribute values already looked up."""
+
+        # Argument is a parameter/attribute/constant unless opcode is '('
+        if self.opcode == "(":
+            value = self.argument
+        else:
+            value = _evaluate_attribute_parameter_argument(
+                self.source,
+                self.argument,
+                attribute_parameter_dict,
+                resources=resources,
+                allocations=allocations,
+                values=values,
+            )
+
+        attribute_parameter_dict[self.pname] = _apply_attribute_parameter_operation(
+            self.operation, self.opcode, attribute_parameter_dict.get(self.pname), value, self.error_text
+        )
+        return attribute_parameter_dict
+
+
+def compile_attribute_parameter_string(parameter_string, attribute_name):
+    """Compiles a single attribute parameter definition/statement.
+
+    Returns an AttributeParameterStatement, or None for comment and
+    blank lines and invalid statements.  See
+    process_attribute_parameter_string() for the format of the statement.
+    """
+
     # Strip leading/trailing white space
     parmstr = parameter_string.strip()
-    # Ignore comment lines/blank lines (return attribute_parameter_dict)
+    # Ignore comment lines/blank lines
     if not parmstr:
-        return attribute_parameter_dict
+        return None
     if parmstr.startswith("#"):
-        return attribute_parameter_dict
+        return None
 
     # Parse the parameter string to get pname, op, and argument
     tmp = parmstr.split("=", 1)
     if len(tmp) != 2:
         # No '=' found, so invalid format of parmstr
-        # Log error and return unmodified attribute_parameter_dict
         logger.error(
             "Invalid parameter string '{pstr}', no '=', while "
             "creating attribute parameter dictionary for expanding "
             "attribute {aname}".format(aname=attribute_name, pstr=parameter_string)
         )
-        return attribute_parameter_dict
+        return None
     pname = tmp[0]
     argument = tmp[1].strip()
     # Remove opcode and remove trailing whitespace from pname
     opcode = pname[-1:]
     pname = pname[:-1].strip()
 
-    # Argument is a parameter/attribute/constant unless opcode is '('
-    # So get its value if parameter/attribute/constant
-    value = None
-    if opcode == "(":
-        value = argument
-    else:
-        # Extra text to display in diagnostics if error occurs
-        error_text = "processing attribute_parameter_string={pstr} for expansion of attribute {aname}".format(
-            pstr=parameter_string, aname=attribute_name
-        )
-        value = get_attribute_parameter_value(
-            argument=argument,
-            attribute_parameter_dict=attribute_parameter_dict,
-            resources=resources,
-            allocations=allocations,
-            error_text=error_text,
-        )
+    # Extra text to display in diagnostics if error occurs
+    error_text = "processing attribute_parameter_string={pstr} for expansion of attribute {aname}".format(
+        pstr=parameter_string, aname=attribute_name
+    )
 
-    # Get the old value of the parameter
-    if pname in attribute_parameter_dict:
-        oldval = attribute_parameter_dict[pname]
-    else:
-        oldval = None
+    # The argument of '(' is a function name, not a parameter/attribute/constant
+    source = None
+    if opcode != "(":
+        source, argument = parse_attribute_parameter_argument(argument, error_text)
 
-    # Perform the requested operation
-    newval = process_attribute_parameter_operation(
-        opcode=opcode, oldvalue=oldval, argument=value, error_text=error_text
+    return AttributeParameterStatement(pname, opcode, source, argument, error_text)
+
+
+@functools.lru_cache(maxsize=ATTRIBUTE_EXPANSION_PROGRAM_CACHE_SIZE)
+def compile_attriblist(attribute_name, attriblist_string):
+    """Compiles an attriblist string into a program.
+
+    The program is a tuple of AttributeParameterStatements, one for each
+    statement in attriblist_string.  Programs are cached, so an attriblist
+    shared by many attributes is only parsed once.  Run the program with
+    run_attriblist_program().
+    """
+
+    statements = (
+        compile_attribute_parameter_string(line.strip(), attribute_name) for line in attriblist_string.splitlines()
     )
-    # Set value in dictionary and return
-    attribute_parameter_dict[pname] = newval
-    return attribute_parameter_dict
+    return tuple(statement for statement in statements if statement is not None)
+
+
+def run_attriblist_program(program, resources=[], allocations=[]):
+    """Runs a program from compile_attriblist() and returns the resulting
+    attribute parameter dictionary.  Each attribute referenced by the
+    program is only looked up once in the resources and allocations."""
+
+    apdict = dict()
+    values = dict()
+    for statement in program:
+        statement.run(apdict, resources=resources, allocations=allocations, values=values)
+    return apdict
 
 
 def make_attribute_parameter_dictionary(attribute_name, attribute_parameter_string, resources=[], allocations=[]):
@@ -384,24 +624,11 @@ def make_attribute_parameter_dictionary(attribute_name, attribute_parameter_stri
     of each line.
     """
 
-    # Initialize our dictionary
-    apdict = dict()
+    program = compile_attriblist(attribute_name, attribute_parameter_string)
+    return run_attriblist_program(program, resources=resources, allocations=allocations)
 
-    # Covert attribute_parameter_string to a real list
-    attrib_parm_list = list(map(str.strip, attribute_parameter_string.splitlines()))
-    # Process each element in the list
-    for parmstr in attrib_parm_list:
-        apdict = process_attribute_parameter_string(
-            parameter_string=parmstr,
-            attribute_parameter_dict=apdict,
-            attribute_name=attribute_name,
-            resources=resources,
-            allocations=allocations,
-        )
-    return apdict
 
-
-def expand_attribute(raw_value, attribute_name, attriblist_string, resources=[], allocations=[]):
+def expand_attribute(raw_value, attribute_name, attriblist_string, resources=[], allocations=[], context=None):
     """Main method to expand parameters in an attribute.
 
     This takes the (raw) value raw_value of either an AllocationAttribute
@@ -442,13 +669,19 @@ def expand_attribute(raw_value, attribute_name, attriblist_string, resources=[],
     format() method to expand the parameters in the raw_value.  If all
     of this is successful, we return the expanded string.
 
+    If an ExpansionContext is given as context, the attribute parameter
+    dictionary is cached in it.
+
     On errors, we just return the raw_value
     """
 
     # We wrap everything in a try block so we can return raw_value on error
     try:
         # Create the attribute parameter dictionary
-        apdict = make_attribute_parameter_dictionary(
+        make_apdict = make_attribute_parameter_dictionary
+        if context is not None:
+            make_apdict = context.make_attribute_parameter_dictionary
+        apdict = make_apdict(
             attribute_parameter_string=attriblist_string,
             attribute_name=attribute_name,
             resources=resources,
@@ -5,6 +5,8 @@
 from django.contrib import admin
 from django.contrib.admin.models import LogEntry
 
+from coldfront.core.portal.models import PortalStatistic
+
 
 @admin.register(LogEntry)
 class LogEntryAdmin(admin.ModelAdmin):
@@ -19,3 +21,10 @@ class LogEntryAdmin(admin.ModelAdmin):
     )
 
     search_fields = ["user__username", "user__first_name", "user__last_name"]
+
+
+@admin.register(PortalStatistic)
+class PortalStatisticAdmin(admin.ModelAdmin):
+    list_display = ("name", "key", "value", "modified")
+    list_filter = ("name",)
+    readonly_fields = ("created", "modified")
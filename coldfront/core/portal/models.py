@@ -2,4 +2,29 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-# Create your models here.
+from django.db import models
+from model_utils.models import TimeStampedModel
+
+
+class PortalStatistic(TimeStampedModel):
+    """A precomputed figure shown on the center summary, see coldfront.core.portal.utils.get_statistics.
+
+    Attributes:
+        name (str): the statistic, e.g. allocations_by_status, or version/ refreshed for the bookkeeping rows
+        key (str): what is counted within the statistic, e.g. a status name, blank for single figures
+        value (float): the count or total
+    """
+
+    class Meta:
+        ordering = [
+            "name",
+            "key",
+        ]
+        unique_together = ("name", "key")
+
+    name = models.CharField(max_length=64)
+    key = models.CharField(max_length=255, blank=True)
+    value = models.FloatField(default=0)
+
+    def __str__(self):
+        return "%s %s: %s" % (self.name, self.key, self.value)
@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from coldfront.core.allocation.models import Allocation, AllocationUser
+from coldfront.core.allocation.signals import allocation_disable_batch
+from coldfront.core.grant.models import Grant
+from coldfront.core.portal.utils import invalidate_statistics
+from coldfront.core.project.models import Project
+from coldfront.core.research_output.models import ResearchOutput
+from coldfront.core.resource.models import Resource
+
+
+@receiver(post_save, sender=Allocation)
+@receiver(post_delete, sender=Allocation)
+@receiver(allocation_disable_batch)
+def invalidate_allocation_statistics(sender, **kwargs):
+    invalidate_statistics("allocations", "allocation_users")
+
+
+@receiver(m2m_changed, sender=Allocation.resources.through)
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_allocation_resource_statistics(sender, **kwargs):
+    invalidate_statistics("allocations")
+
+
+@receiver(post_save, sender=AllocationUser)
+@receiver(post_delete, sender=AllocationUser)
+def invalidate_allocation_user_statistics(sender, **kwargs):
+    invalidate_statistics("allocation_users")
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_statistics(sender, **kwargs):
+    invalidate_statistics("allocations", "allocation_users", "projects")
+
+
+@receiver(post_save, sender=Grant)
+@receiver(post_delete, sender=Grant)
+def invalidate_grant_statistics(sender, **kwargs):
+    invalidate_statistics("grants")
+
+
+@receiver(post_save, sender=ResearchOutput)
+@receiver(post_delete, sender=ResearchOutput)
+def invalidate_research_output_statistics(sender, **kwargs):
+    invalidate_statistics("research_outputs")
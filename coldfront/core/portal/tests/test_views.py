@@ -2,11 +2,31 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import datetime
 import logging
+from unittest.mock import patch
 
+from django.db import transaction
 from django.test import TestCase
 
+from coldfront.core.allocation.models import Allocation
+from coldfront.core.grant.models import Grant
+from coldfront.core.portal import utils as portal_utils
+from coldfront.core.portal.models import PortalStatistic
+from coldfront.core.portal.utils import refresh_statistics
 from coldfront.core.test_helpers import utils
+from coldfront.core.test_helpers.factories import (
+    AllocationFactory,
+    AllocationStatusChoiceFactory,
+    AllocationUserFactory,
+    FieldOfScienceFactory,
+    GrantFundingAgencyFactory,
+    GrantStatusChoiceFactory,
+    ProjectFactory,
+    ProjectStatusChoiceFactory,
+    ResourceFactory,
+    ResourceTypeFactory,
+)
 
 logging.disable(logging.CRITICAL)
 
@@ -35,3 +55,138 @@ class CenterSummaryViewTest(PortalViewBaseTest):
         self.assertContains(response, "Active Allocations and Users")
         self.assertContains(response, "Resources and Allocations Summary")
         self.assertNotContains(response, "We're having a bit of system trouble at the moment. Please check back soon!")
+
+
+class CenterSummaryStatisticsTest(PortalViewBaseTest):
+    """Tests for the center summary charts and JSON endpoints"""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Set up allocations, resources and grants to summarize"""
+        today = datetime.date.today()
+        cluster = ResourceFactory(name="cluster", resource_type=ResourceTypeFactory(name="Cluster"))
+        partition = ResourceFactory(name="partition", parent_resource=cluster, is_allocatable=True)
+        cls.storage = ResourceFactory(name="storage", resource_type=ResourceTypeFactory(name="Storage"))
+        cls.project = ProjectFactory(
+            field_of_science=FieldOfScienceFactory(description="Physics"),
+            status=ProjectStatusChoiceFactory(name="Active"),
+        )
+
+        def allocation(status, resources, end_date=today):
+            obj = AllocationFactory(
+                project=cls.project, status=AllocationStatusChoiceFactory(name=status), end_date=end_date
+            )
+            obj.resources.add(*resources)
+            return obj
+
+        AllocationUserFactory(allocation=allocation("Active", [partition, cls.storage]))
+        AllocationUserFactory(allocation=allocation("Active", [cls.storage]))
+        allocation("New", [cls.storage])
+        allocation("Expired", [cls.storage], end_date=today - datetime.timedelta(days=1))
+        allocation("Expired", [cls.storage], end_date=datetime.date(today.year - 2, 1, 1))
+
+        funding_agency = GrantFundingAgencyFactory(name="NSF")
+        grant_status = GrantStatusChoiceFactory(name="Active")
+        for role, amount in [("PI", "1000.5"), ("CoPI", "250"), ("SP", "0")]:
+            Grant.objects.create(
+                project=cls.project,
+                title=f"{role} grant",
+                grant_number="1",
+                role=role,
+                funding_agency=funding_agency,
+                grant_start=today,
+                grant_end=today,
+                total_amount_awarded=amount,
+                status=grant_status,
+            )
+
+    def test_allocation_by_status(self):
+        refresh_statistics()
+
+        with self.assertNumQueries(1):
+            response = self.client.get("/portal/data/allocation-by-status/")
+
+        self.assertEqual(
+            response.json()["data"],
+            [
+                {"name": "Active", "total": 2},
+                {"name": "New", "total": 1},
+                {"name": "Renewal Requested", "total": 0},
+                {"name": "Expired", "total": 1},
+            ],
+        )
+
+    def test_resource_by_type(self):
+        response = self.client.get("/portal/data/resource-by-type/")
+
+        self.assertEqual(
+            response.json()["data"],
+            [
+                {"name": "Cluster", "total": 1},
+                {"name": "Cloud", "total": 0},
+                {"name": "Server", "total": 0},
+                {"name": "Storage", "total": 1},
+            ],
+        )
+
+    def test_summaries(self):
+        response = self.client.get("/allocation-summary")
+        self.assertEqual(
+            {resource.name: total for resource, total in response.context["allocations_count_by_resource"].items()},
+            {"cluster": 1, "storage": 1},
+        )
+
+        response = self.client.get("/allocation-by-fos")
+        self.assertEqual(response.context["allocations_by_fos"], {"Physics": 2})
+        self.assertEqual(response.context["active_users_by_fos"], {"Physics": 2})
+        self.assertEqual(response.context["total_allocations_users"], 2)
+        self.assertEqual(response.context["active_pi_count"], 1)
+
+        response = self.client.get("/center-summary")
+        self.assertEqual(response.context["grant_total"], "1,250")
+        self.assertEqual(response.context["grant_total_pi_only"], "1,000")
+        self.assertEqual(response.context["grant_total_copi_only"], "250")
+        self.assertEqual(response.context["grant_total_sp_only"], "0")
+
+    def test_changes_invalidate(self):
+        """Saving an allocation marks the allocation statistics out of date, and reading them starts one task
+        refreshing them while serving the last refreshed ones"""
+        refresh_statistics()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for allocation in Allocation.objects.filter(status__name="New"):
+                allocation.status = AllocationStatusChoiceFactory(name="Active")
+                allocation.save()
+            allocation.resources.add(self.storage)
+        versions = dict(PortalStatistic.objects.filter(name="version").values_list("key", "value"))
+        self.assertGreater(versions["allocations"], 0)
+        self.assertEqual(versions["grants"], 0)
+
+        with patch.object(portal_utils, "async_task") as async_task:
+            response = self.client.get("/portal/data/allocation-by-status/")
+            self.assertEqual(response.json()["data"][:2], [{"name": "Active", "total": 2}, {"name": "New", "total": 1}])
+            self.client.get("/portal/data/allocation-by-status/")
+
+        async_task.assert_called_once_with(
+            "coldfront.core.portal.utils.refresh_statistics", ["allocations"], stale_only=True
+        )
+        refresh_statistics(*async_task.call_args.args[1:], **async_task.call_args.kwargs)
+
+        response = self.client.get("/portal/data/allocation-by-status/")
+        self.assertEqual(response.json()["data"][:2], [{"name": "Active", "total": 3}, {"name": "New", "total": 0}])
+
+    def test_overlapping_refreshes(self):
+        """A refresh that waited on another one for the lock skips the statistics it brought up to date, and
+        forced refreshes replace the rows rather than adding to them"""
+        with transaction.atomic():
+            refresh_statistics(["grants"])
+            with transaction.atomic():
+                with patch.dict(portal_utils.STATISTICS, {"grants": lambda: self.fail("grants recomputed")}):
+                    refresh_statistics(["grants"], stale_only=True)
+                refresh_statistics(["grants"])
+
+        self.assertEqual(PortalStatistic.objects.filter(name="grant_totals").count(), 4)
+        self.assertEqual(
+            PortalStatistic.objects.get(name="refreshed", key="grants").value,
+            PortalStatistic.objects.get(name="version", key="grants").value,
+        )
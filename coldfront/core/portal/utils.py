@@ -0,0 +1,245 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import datetime
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from django_q.tasks import async_task
+
+from coldfront.core.allocation.models import ALLOCATION_RESOURCE_ORDERING, Allocation, AllocationUser
+from coldfront.core.grant.models import Grant
+from coldfront.core.portal.models import PortalStatistic
+from coldfront.core.project.models import Project
+from coldfront.core.research_output.models import ResearchOutput
+from coldfront.core.resource.models import Resource
+
+ALLOCATION_SUMMARY_STATUSES = ["Active", "New", "Renewal Requested", "Expired"]
+
+# bookkeeping rows, keyed by source: version is bumped when the source's data changes, refreshed holds the version
+# the statistics were computed at and requested the last version a refresh task was started for
+VERSION = "version"
+REFRESHED = "refreshed"
+REQUESTED = "requested"
+
+
+def allocation_statistics():
+    """
+    Returns:
+        dict: allocation counts by status, and active allocation counts by parent resource, resource type and field
+            of science
+    """
+    now = datetime.datetime.now()
+    expired_since = datetime.date(now.year - 1, 1, 1)
+    by_status = dict.fromkeys(ALLOCATION_SUMMARY_STATUSES, 0)
+    by_status.update(
+        Allocation.objects.filter(
+            Q(status__name__in=ALLOCATION_SUMMARY_STATUSES[:-1])
+            | Q(status__name="Expired", end_date__gte=expired_since)
+        )
+        .order_by()
+        .values_list("status__name")
+        .annotate(total=Count("pk"))
+    )
+
+    # the parent resource of the allocation, as returned by Allocation.get_parent_resource, or its own parent
+    parent_resource = Resource.objects.filter(allocation=OuterRef("pk")).order_by(*ALLOCATION_RESOURCE_ORDERING)
+    active = Allocation.objects.filter(status__name="Active").order_by()
+    by_resource = dict(
+        active.annotate(
+            summary_resource=Coalesce(
+                Subquery(parent_resource.values("parent_resource")[:1]),
+                Subquery(parent_resource.values("pk")[:1]),
+                output_field=IntegerField(),
+            )
+        )
+        .exclude(summary_resource=None)
+        .values_list("summary_resource")
+        .annotate(total=Count("pk"))
+    )
+    by_resource_type = {}
+    for pk, resource_type in Resource.objects.filter(pk__in=by_resource).values_list("pk", "resource_type__name"):
+        by_resource_type[resource_type] = by_resource_type.get(resource_type, 0) + by_resource[pk]
+
+    return {
+        "allocations_by_status": by_status,
+        "allocations_by_resource": {str(pk): total for pk, total in by_resource.items()},
+        "allocations_by_resource_type": by_resource_type,
+        "allocations_by_fos": dict(
+            active.values_list("project__field_of_science__description").annotate(total=Count("pk"))
+        ),
+    }
+
+
+def allocation_user_statistics():
+    """
+    Returns:
+        dict: active allocation user counts by field of science, and the number of users with active allocations
+    """
+    users = AllocationUser.objects.filter(status__name="Active", allocation__status__name="Active").order_by()
+    return {
+        "active_users_by_fos": dict(
+            users.values_list("allocation__project__field_of_science__description").annotate(total=Count("pk"))
+        ),
+        "active_users": {"": users.values("user").distinct().count()},
+    }
+
+
+def project_statistics():
+    """
+    Returns:
+        dict: the number of PIs of active or new projects
+    """
+    return {
+        "active_pis": {
+            "": Project.objects.filter(status__name__in=["Active", "New"])
+            .values_list("pi__username", flat=True)
+            .distinct()
+            .count()
+        }
+    }
+
+
+def grant_statistics():
+    """
+    Returns:
+        dict: total amount awarded for all grants, blank key, and for each of the PI, CoPI and SP roles
+    """
+    amount = Cast("total_amount_awarded", FloatField())
+    totals = Grant.objects.aggregate(
+        total=Sum(amount, default=0),
+        **{role: Sum(amount, filter=Q(role=role), default=0) for role in ["PI", "CoPI", "SP"]},
+    )
+    totals[""] = totals.pop("total")
+    return {"grant_totals": totals}
+
+
+def research_output_statistics():
+    """
+    Returns:
+        dict: the number of research outputs
+    """
+    return {"research_outputs": {"": ResearchOutput.objects.count()}}
+
+
+# the functions computing the statistics, by the data they're computed from
+STATISTICS = {
+    "allocations": allocation_statistics,
+    "allocation_users": allocation_user_statistics,
+    "projects": project_statistics,
+    "grants": grant_statistics,
+    "research_outputs": research_output_statistics,
+}
+
+STATISTIC_SOURCES = {
+    "allocations_by_status": "allocations",
+    "allocations_by_resource": "allocations",
+    "allocations_by_resource_type": "allocations",
+    "allocations_by_fos": "allocations",
+    "active_users_by_fos": "allocation_users",
+    "active_users": "allocation_users",
+    "active_pis": "projects",
+    "grant_totals": "grants",
+    "research_outputs": "research_outputs",
+}
+
+
+def refresh_statistics(sources=None, stale_only=False):
+    """Recomputes the statistics computed from the given sources, all of them by default. Runs as a scheduled task,
+    and as a task started by get_statistics when it finds statistics out of date.
+
+    Refreshes of a source are serialized by locking its version row, so concurrent refreshes don't both replace
+    its rows.
+
+    Params:
+        sources (list[str]): keys of STATISTICS
+        stale_only (bool): skip sources another refresh brought up to date while waiting for the lock
+    """
+    for source in STATISTICS if sources is None else sources:
+        with transaction.atomic():
+            PortalStatistic.objects.get_or_create(name=VERSION, key=source)
+            # read before computing, so changes committed meanwhile leave the statistics out of date
+            version = PortalStatistic.objects.select_for_update().get(name=VERSION, key=source)
+            if stale_only and PortalStatistic.objects.filter(name=REFRESHED, key=source, value=version.value).exists():
+                continue
+
+            statistics = STATISTICS[source]()
+
+            PortalStatistic.objects.filter(name__in=statistics).delete()
+            PortalStatistic.objects.bulk_create(
+                PortalStatistic(name=name, key=key or "", value=value or 0)
+                for name, values in statistics.items()
+                for key, value in values.items()
+            )
+            PortalStatistic.objects.update_or_create(name=REFRESHED, key=source, defaults={"value": version.value})
+
+
+def _read_statistics(names, sources):
+    statistics = {name: {} for name in [*names, VERSION, REFRESHED, REQUESTED]}
+    for name, key, value in PortalStatistic.objects.filter(
+        Q(name__in=names) | Q(name__in=[VERSION, REFRESHED, REQUESTED], key__in=sources)
+    ).values_list("name", "key", "value"):
+        statistics[name][key] = value
+    return statistics
+
+
+def get_statistics(*names):
+    """
+    Params:
+        names (str): keys of STATISTIC_SOURCES
+
+    Returns:
+        dict: {key: value} for each of the named statistics as last refreshed. Statistics out of date are
+            refreshed by a task, except the ones never computed, which are computed first
+    """
+    sources = {STATISTIC_SOURCES[name] for name in names}
+    statistics = _read_statistics(names, sources)
+    missing = [source for source in sources if source not in statistics[REFRESHED]]
+    if missing:
+        refresh_statistics(missing, stale_only=True)
+        statistics = _read_statistics(names, sources)
+
+    stale = [
+        source
+        for source in sources
+        if statistics[REFRESHED][source] != statistics[VERSION][source]
+        and statistics[REQUESTED].get(source) != statistics[VERSION][source]
+    ]
+    if stale:
+        _request_refresh(stale, statistics[VERSION])
+
+    return {name: statistics[name] for name in names}
+
+
+def _request_refresh(sources, versions):
+    """Starts a task refreshing the given sources, unless one was already started for their current version"""
+    requested = []
+    for source in sources:
+        if (
+            PortalStatistic.objects.filter(name=REQUESTED, key=source)
+            .exclude(value=versions[source])
+            .update(value=versions[source])
+        ):
+            requested.append(source)
+        elif PortalStatistic.objects.get_or_create(name=REQUESTED, key=source, defaults={"value": versions[source]})[1]:
+            requested.append(source)
+
+    if requested:
+        async_task("coldfront.core.portal.utils.refresh_statistics", requested, stale_only=True)
+
+
+def invalidate_statistics(*sources):
+    """Marks the statistics computed from the given sources out of date once the current transaction commits, so
+    they are refreshed after the next time they're read.
+
+    Params:
+        sources (str): keys of STATISTICS
+    """
+    transaction.on_commit(partial(_bump_versions, sources))
+
+
+def _bump_versions(sources):
+    PortalStatistic.objects.filter(name=VERSION, key__in=sources).update(value=F("value") + 1)
@@ -2,21 +2,16 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-import datetime
-from collections import Counter
-
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import intcomma
-from django.db.models import FloatField, Q, Sum
-from django.db.models.functions import Cast
+from django.db.models import Q
 from django.http import JsonResponse
 from django.shortcuts import render
-from django.views.decorators.cache import cache_page
 
-from coldfront.core.allocation.models import Allocation, AllocationUser
-from coldfront.core.grant.models import Grant
+from coldfront.core.allocation.models import Allocation
+from coldfront.core.portal.utils import ALLOCATION_SUMMARY_STATUSES, get_statistics
 from coldfront.core.project.models import Project
-from coldfront.core.research_output.models import ResearchOutput
+from coldfront.core.resource.models import Resource
 from coldfront.core.utils.common import import_from_settings
 
 ALLOCATION_EULA_ENABLE = import_from_settings("ALLOCATION_EULA_ENABLE", False)
@@ -109,104 +104,55 @@ def home(request):
 
 
 def center_summary(request):
+    statistics = get_statistics("research_outputs", "grant_totals")
+    grant_totals = statistics["grant_totals"]
+
     context = {}
-    context["research_outputs_count"] = ResearchOutput.objects.all().distinct().count()
-
-    sum_agg = Sum(Cast("total_amount_awarded", FloatField()), default=0)
-    context["grant_total"] = intcomma(
-        int(Grant.objects.aggregate(total_amount_awarded__sum=sum_agg)["total_amount_awarded__sum"])
-    )
-    context["grant_total_pi_only"] = intcomma(
-        int(Grant.objects.filter(role="PI").aggregate(total_amount_awarded__sum=sum_agg)["total_amount_awarded__sum"])
-    )
-    context["grant_total_copi_only"] = intcomma(
-        int(Grant.objects.filter(role="CoPI").aggregate(total_amount_awarded__sum=sum_agg)["total_amount_awarded__sum"])
-    )
-    context["grant_total_sp_only"] = intcomma(
-        int(Grant.objects.filter(role="SP").aggregate(total_amount_awarded__sum=sum_agg)["total_amount_awarded__sum"])
-    )
+    context["research_outputs_count"] = int(statistics["research_outputs"].get("", 0))
+    context["grant_total"] = intcomma(int(grant_totals.get("", 0)))
+    context["grant_total_pi_only"] = intcomma(int(grant_totals.get("PI", 0)))
+    context["grant_total_copi_only"] = intcomma(int(grant_totals.get("CoPI", 0)))
+    context["grant_total_sp_only"] = intcomma(int(grant_totals.get("SP", 0)))
     return render(request, "portal/center_summary.html", context)
 
 
-@cache_page(60 * 15)
 def allocation_by_fos(request):
-    allocations_by_fos = Counter(
-        list(
-            Allocation.objects.filter(status__name="Active").values_list(
-                "project__field_of_science__description", flat=True
-            )
-        )
-    )
-
-    user_allocations = AllocationUser.objects.filter(status__name="Active", allocation__status__name="Active")
-
-    active_users_by_fos = Counter(
-        list(user_allocations.values_list("allocation__project__field_of_science__description", flat=True))
-    )
-    total_allocations_users = user_allocations.values("user").distinct().count()
+    statistics = get_statistics("allocations_by_fos", "active_users_by_fos", "active_users", "active_pis")
 
-    active_pi_count = (
-        Project.objects.filter(status__name__in=["Active", "New"])
-        .values_list("pi__username", flat=True)
-        .distinct()
-        .count()
-    )
     context = {}
-    context["allocations_by_fos"] = dict(allocations_by_fos)
-    context["active_users_by_fos"] = dict(active_users_by_fos)
-    context["total_allocations_users"] = total_allocations_users
-    context["active_pi_count"] = active_pi_count
+    context["allocations_by_fos"] = {fos: int(total) for fos, total in statistics["allocations_by_fos"].items()}
+    context["active_users_by_fos"] = {fos: int(total) for fos, total in statistics["active_users_by_fos"].items()}
+    context["total_allocations_users"] = int(statistics["active_users"].get("", 0))
+    context["active_pi_count"] = int(statistics["active_pis"].get("", 0))
     return render(request, "portal/allocation_by_fos.html", context)
 
 
-@cache_page(60 * 15)
 def allocation_summary(request):
-    allocation_resources = []
-    for allocation in Allocation.objects.filter(status__name="Active"):
-        parent_resource = allocation.get_parent_resource
-        allocation_resources.append(
-            parent_resource.parent_resource if parent_resource.parent_resource else parent_resource
-        )
-
-    allocations_count_by_resource = dict(Counter(allocation_resources))
+    allocations_by_resource = get_statistics("allocations_by_resource")["allocations_by_resource"]
+    resources = Resource.objects.select_related("resource_type").in_bulk([int(pk) for pk in allocations_by_resource])
 
     context = {}
-    context["allocations_count_by_resource"] = allocations_count_by_resource
+    context["allocations_count_by_resource"] = {
+        resources[int(pk)]: int(total) for pk, total in allocations_by_resource.items() if int(pk) in resources
+    }
 
     return render(request, "portal/allocation_summary.html", context)
 
 
 def allocation_by_status(request):
+    allocations_by_status = get_statistics("allocations_by_status")["allocations_by_status"]
     data = [
-        {"name": "Active", "total": Allocation.objects.filter(status__name="Active").count()},
-        {"name": "New", "total": Allocation.objects.filter(status__name="New").count()},
-        {"name": "Renewal Requested", "total": Allocation.objects.filter(status__name="Renewal Requested").count()},
+        {"name": status, "total": int(allocations_by_status.get(status, 0))} for status in ALLOCATION_SUMMARY_STATUSES
     ]
 
-    now = datetime.datetime.now()
-    start_time = datetime.date(now.year - 1, 1, 1)
-    data.append(
-        {
-            "name": "Expired",
-            "total": Allocation.objects.filter(status__name="Expired", end_date__gte=start_time).count(),
-        }
-    )
-
     return JsonResponse({"data": data})
 
 
 def resource_by_type(request):
-    allocation_resources = []
-    for allocation in Allocation.objects.filter(status__name="Active"):
-        parent_resource = allocation.get_parent_resource
-        allocation_resources.append(
-            parent_resource.parent_resource if parent_resource.parent_resource else parent_resource
-        )
-
-    allocation_count_by_resource_type = dict(Counter([ele.resource_type.name for ele in allocation_resources]))
+    allocations_by_resource_type = get_statistics("allocations_by_resource_type")["allocations_by_resource_type"]
 
     data = []
     for rtype in ["Cluster", "Cloud", "Server", "Storage"]:
-        data.append({"name": rtype, "total": allocation_count_by_resource_type.get(rtype, 0)})
+        data.append({"name": rtype, "total": int(allocations_by_resource_type.get(rtype, 0))})
 
     return JsonResponse({"data": data})
@@ -18,6 +18,7 @@ from coldfront.core.field_of_science.models import FieldOfScience
 from coldfront.core.project.signals import project_activate_user, project_archive, project_remove_user
 from coldfront.core.utils.common import import_from_settings
 from coldfront.core.utils.mail import send_email_template
+from coldfront.core.utils.permissions import cached_permissions
 from coldfront.core.utils.validate import AttributeValidator
 
 PROJECT_ENABLE_PROJECT_REVIEW = import_from_settings("PROJECT_ENABLE_PROJECT_REVIEW", False)
@@ -211,16 +212,23 @@ We do not have information about your research. Please provide a detailed descri
         if user.is_superuser:
             return list(ProjectPermission)
 
-        user_conditions = models.Q(status__name__in=("Active", "New")) & models.Q(user=user)
-        if not self.projectuser_set.filter(user_conditions).exists():
+        return cached_permissions(("project", self.pk, user.pk), lambda: self._user_permissions(user))
+
+    def _user_permissions(self, user):
+        roles = set(
+            self.projectuser_set.filter(user=user, status__name__in=("Active", "New")).values_list(
+                "role__name", flat=True
+            )
+        )
+        if not roles:
             return []
 
         permissions = [ProjectPermission.USER]
 
-        if self.projectuser_set.filter(user_conditions & models.Q(role__name="Manager")).exists():
+        if "Manager" in roles:
             permissions.append(ProjectPermission.MANAGER)
 
-        if self.projectuser_set.filter(user_conditions & models.Q(project__pi_id=user.id)).exists():
+        if self.pi_id == user.id:
             permissions.append(ProjectPermission.PI)
 
         if ProjectPermission.MANAGER in permissions or ProjectPermission.MANAGER in permissions:
@@ -4,6 +4,7 @@
 
 import logging
 
+from django.core.cache import cache
 from django.test import TestCase
 
 from coldfront.core.project.models import ProjectUserStatusChoice
@@ -263,6 +264,10 @@ class ProjectListViewTest(ProjectViewTestBase):
         cls.additional_projects = additional_projects
         cls.url = "/project/"
 
+    def setUp(self):
+        # counts cached by other tests may have been rolled back
+        cache.clear()
+
     ### ProjectListView access tests ###
 
     def test_project_list_access(self):
@@ -315,6 +320,23 @@ class ProjectListViewTest(ProjectViewTestBase):
         response = utils.login_and_get_page(self.client, self.admin_user, url)
         self.assertIn(self.project, response.context["object_list"])
 
+    ### ProjectListView pagination tests ###
+
+    def test_project_list_keyset_pagination(self):
+        """Following the Next cursors visits every project in sort order"""
+        sort_parameters = "show_all_projects=on&order_by=pi__username&direction=asc"
+        response = utils.login_and_get_page(self.client, self.admin_user, f"{self.url}?{sort_parameters}")
+        projects = list(response.context["object_list"])
+        while response.context["page_obj"].has_next():
+            page = response.context["page_obj"]
+            response = self.client.get(
+                f"{self.url}?page={page.next_page_number()}&after={page.next_cursor}&{sort_parameters}"
+            )
+            projects.extend(response.context["object_list"])
+
+        self.assertEqual(len(projects), response.context["projects_count"])
+        self.assertEqual(projects, sorted(projects, key=lambda project: (project.pi.username, project.pk)))
+
 
 class ProjectRemoveUsersViewTest(ProjectViewTestBase):
     """Tests for ProjectRemoveUsersView"""
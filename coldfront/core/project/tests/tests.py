@@ -7,26 +7,36 @@ import sys
 from unittest.mock import patch
 
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
+from coldfront.core.allocation.models import AllocationPermission
 from coldfront.core.project.models import (
     Project,
     ProjectAttribute,
     ProjectAttributeType,
+    ProjectPermission,
 )
 from coldfront.core.project.utils import (
     determine_automated_institution_choice,
     generate_project_code,
 )
 from coldfront.core.test_helpers.factories import (
+    AllocationFactory,
+    AllocationUserFactory,
     FieldOfScienceFactory,
     PAttributeTypeFactory,
     ProjectAttributeFactory,
     ProjectAttributeTypeFactory,
     ProjectFactory,
     ProjectStatusChoiceFactory,
+    ProjectUserFactory,
+    ProjectUserRoleChoiceFactory,
+    ProjectUserStatusChoiceFactory,
     UserFactory,
 )
+from coldfront.core.utils.permissions import permission_cache
 
 logging.disable(logging.CRITICAL)
 
@@ -175,6 +185,55 @@ class TestProject(TestCase):
         self.assertEqual(0, len(Project.objects.all()))
 
 
+class TestProjectUserPermissions(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = ProjectFactory()
+        ProjectUserFactory(project=cls.project, user=cls.project.pi, role=ProjectUserRoleChoiceFactory(name="Manager"))
+        cls.manager = ProjectUserFactory(project=cls.project, role=ProjectUserRoleChoiceFactory(name="Manager")).user
+        cls.project_user = ProjectUserFactory(project=cls.project)
+        cls.removed = ProjectUserFactory(
+            project=cls.project, status=ProjectUserStatusChoiceFactory(name="Removed")
+        ).user
+        cls.allocation = AllocationFactory(project=cls.project)
+        AllocationUserFactory(allocation=cls.allocation, user=cls.project_user.user)
+
+    def test_user_permissions(self):
+        self.assertEqual(
+            self.project.user_permissions(self.project.pi),
+            [ProjectPermission.USER, ProjectPermission.MANAGER, ProjectPermission.PI, ProjectPermission.UPDATE],
+        )
+        self.assertEqual(
+            self.project.user_permissions(self.manager),
+            [ProjectPermission.USER, ProjectPermission.MANAGER, ProjectPermission.UPDATE],
+        )
+        self.assertEqual(self.project.user_permissions(self.project_user.user), [ProjectPermission.USER])
+        self.assertEqual(self.project.user_permissions(self.removed), [])
+        self.assertEqual(self.project.user_permissions(UserFactory()), [])
+
+    def test_user_permissions_cached(self):
+        """Permissions are only queried once within a permission cache"""
+        user = self.project_user.user
+        with permission_cache():
+            self.assertTrue(self.allocation.has_perm(user, AllocationPermission.USER))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertTrue(self.allocation.has_perm(user, AllocationPermission.USER))
+                self.assertFalse(self.allocation.has_perm(user, AllocationPermission.MANAGER))
+                self.assertFalse(self.project.has_perm(user, ProjectPermission.MANAGER))
+
+        self.assertEqual(len(queries), 0)
+
+    def test_user_permissions_invalidated(self):
+        """Saving a project user drops the cached permissions"""
+        with permission_cache():
+            self.assertFalse(self.project.has_perm(self.project_user.user, ProjectPermission.MANAGER))
+
+            self.project_user.role = ProjectUserRoleChoiceFactory(name="Manager")
+            self.project_user.save()
+
+            self.assertTrue(self.project.has_perm(self.project_user.user, ProjectPermission.MANAGER))
+
+
 class TestProjectAttribute(TestCase):
     @classmethod
     def setUpTestData(cls):
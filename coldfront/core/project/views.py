@@ -61,6 +61,7 @@ from coldfront.core.user.forms import UserSearchForm
 from coldfront.core.user.utils import CombinedUserSearch
 from coldfront.core.utils.common import get_domain_url, import_from_settings
 from coldfront.core.utils.mail import send_email, send_email_template
+from coldfront.core.utils.mixins.views import KeysetPaginationMixin
 
 ALLOCATION_ENABLE_ALLOCATION_RENEWAL = import_from_settings("ALLOCATION_ENABLE_ALLOCATION_RENEWAL", True)
 ALLOCATION_DEFAULT_ALLOCATION_LENGTH = import_from_settings("ALLOCATION_DEFAULT_ALLOCATION_LENGTH", 365)
@@ -220,7 +221,7 @@ class ProjectDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         return context
 
 
-class ProjectListView(LoginRequiredMixin, ListView):
+class ProjectListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Project
     template_name = "project/project_list.html"
     prefetch_related = [
@@ -230,6 +231,7 @@ class ProjectListView(LoginRequiredMixin, ListView):
     ]
     context_object_name = "project_list"
     paginate_by = 25
+    keyset_fields = ("id", "pi__username")
 
     def get_queryset(self):
         order_by = self.request.GET.get("order_by", "id")
@@ -328,8 +330,8 @@ class ProjectListView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        projects_count = self.get_queryset().count()
-        context["projects_count"] = projects_count
+        # The paginator has already counted the projects
+        context["projects_count"] = context["paginator"].count
 
         project_search_form = ProjectSearchForm(self.request.GET)
         if project_search_form.is_valid():
@@ -361,18 +363,6 @@ class ProjectListView(LoginRequiredMixin, ListView):
         context["filter_parameters"] = filter_parameters
         context["filter_parameters_with_order_by"] = filter_parameters_with_order_by
 
-        project_list = context.get("project_list")
-        paginator = Paginator(project_list, self.paginate_by)
-
-        page = self.request.GET.get("page")
-
-        try:
-            project_list = paginator.page(page)
-        except PageNotAnInteger:
-            project_list = paginator.page(1)
-        except EmptyPage:
-            project_list = paginator.page(paginator.num_pages)
-
         return context
 
 
@@ -2,4 +2,14 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-# Register your models here.
+from django.contrib import admin
+
+from coldfront.core.utils.models import QueuedEmail
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "status", "attempts", "created", "modified")
+    list_filter = ("status",)
+    search_fields = ("subject",)
+    readonly_fields = ("created", "modified", "batch")
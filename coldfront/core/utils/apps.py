@@ -2,9 +2,15 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import importlib
+
 from django.apps import AppConfig
 
 
 class UtilsConfig(AppConfig):
     name = "coldfront.core.utils"
     verbose_name = "Coldfront Utils"
+
+    def ready(self):
+        importlib.import_module("coldfront.core.utils.mail")
+        importlib.import_module("coldfront.core.utils.pagination")
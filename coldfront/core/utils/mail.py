@@ -3,17 +3,33 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import logging
-from smtplib import SMTPException
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPResponseException, SMTPServerDisconnected
 
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.core.signals import request_finished
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import timezone
+from django_q.signals import post_execute_in_worker
+from django_q.tasks import async_task
 
 from coldfront.core.utils.common import import_from_settings
+from coldfront.core.utils.models import QueuedEmail
 
 logger = logging.getLogger(__name__)
 EMAIL_ENABLED = import_from_settings("EMAIL_ENABLED", False)
+EMAIL_QUEUE_ENABLED = import_from_settings("EMAIL_QUEUE_ENABLED", False)
+EMAIL_QUEUE_BATCH_SIZE = import_from_settings("EMAIL_QUEUE_BATCH_SIZE", 100)
+EMAIL_QUEUE_RETRIES = import_from_settings("EMAIL_QUEUE_RETRIES", 3)
+EMAIL_QUEUE_RETRY_BACKOFF = import_from_settings("EMAIL_QUEUE_RETRY_BACKOFF", 1)
+EMAIL_QUEUE_RETENTION_DAYS = import_from_settings("EMAIL_QUEUE_RETENTION_DAYS", 30)
 EMAIL_SUBJECT_PREFIX = import_from_settings("EMAIL_SUBJECT_PREFIX")
 EMAIL_DEVELOPMENT_EMAIL_LIST = import_from_settings("EMAIL_DEVELOPMENT_EMAIL_LIST")
 EMAIL_SENDER = import_from_settings("EMAIL_SENDER")
@@ -23,6 +39,18 @@ EMAIL_SIGNATURE = import_from_settings("EMAIL_SIGNATURE")
 EMAIL_CENTER_NAME = import_from_settings("CENTER_NAME")
 CENTER_BASE_URL = import_from_settings("CENTER_BASE_URL")
 
+# seconds without progress after which emails claimed by a send_queued_emails run that never finished can be
+# claimed again. The run renews its claim before each send attempt
+EMAIL_QUEUE_CLAIM_TIMEOUT = 600
+EMAIL_TEMPLATE_CACHE_SIZE = 128
+
+_UNCACHEABLE = object()
+_rendered_templates = OrderedDict()
+_rendered_templates_lock = threading.Lock()
+
+# whether this thread queued emails since it last started a send_queued_emails task
+_queued = threading.local()
+
 
 def send_email(subject, body, sender, receiver_list, cc=None):
     """Helper function for sending emails"""
@@ -47,6 +75,10 @@ def send_email(subject, body, sender, receiver_list, cc=None):
     if cc and settings.DEBUG:
         cc = EMAIL_DEVELOPMENT_EMAIL_LIST
 
+    if EMAIL_QUEUE_ENABLED:
+        queue_email(subject, body, sender, receiver_list, cc=cc)
+        return
+
     try:
         email = EmailMessage(subject, body, sender, receiver_list, cc=cc)
         email.send(fail_silently=False)
@@ -68,11 +100,207 @@ def send_email_template(subject, template_name, template_context, receiver_list,
     ctx = email_template_context()
     ctx.update(template_context)
 
-    body = render_to_string(template_name, ctx)
+    body = render_email_template(template_name, ctx)
 
     return send_email(subject, body, sender, receiver_list, cc=cc)
 
 
+def _context_key(value):
+    """Hashable key for a template context made of plain values, _UNCACHEABLE if it contains anything
+    else, such as a model instance, which could render differently next time"""
+    if isinstance(value, dict):
+        items = []
+        for k, v in value.items():
+            key = _context_key(v)
+            if key is _UNCACHEABLE:
+                return _UNCACHEABLE
+            items.append((k, key))
+        return (dict, tuple(items))
+    if isinstance(value, (list, tuple)):
+        keys = tuple(_context_key(v) for v in value)
+        if _UNCACHEABLE in keys:
+            return _UNCACHEABLE
+        return (type(value), keys)
+    if value is None or isinstance(value, (str, int, float)):
+        return (type(value), value)
+    return _UNCACHEABLE
+
+
+def render_email_template(template_name, template_context):
+    """Render an email template, reusing the body rendered last time for the same template and context.
+    Only contexts made of plain values (strings, numbers and lists and dicts of them) are cached.
+
+    Returns:
+        str: the rendered body
+    """
+    key = _context_key(template_context)
+    if key is _UNCACHEABLE:
+        return render_to_string(template_name, template_context)
+
+    key = (template_name, key)
+    with _rendered_templates_lock:
+        if key in _rendered_templates:
+            _rendered_templates.move_to_end(key)
+            return _rendered_templates[key]
+
+    body = render_to_string(template_name, template_context)
+    with _rendered_templates_lock:
+        _rendered_templates[key] = body
+        if len(_rendered_templates) > EMAIL_TEMPLATE_CACHE_SIZE:
+            _rendered_templates.popitem(last=False)
+    return body
+
+
+def queue_email(subject, body, sender, receiver_list, cc=None):
+    """Add an email to the mail queue. Once the current request or django-q task finishes, one django-q task
+    is started to send all the emails it queued, so the caller doesn't wait for the SMTP server. Emails
+    queued elsewhere, e.g. by a management command, are sent by the scheduled send_queued_emails run."""
+    if isinstance(cc, str):
+        cc = [cc]
+
+    QueuedEmail.objects.create(
+        subject=subject, body=body, sender=sender, receivers=list(receiver_list), cc=list(cc or [])
+    )
+    _queued.pending = True
+
+
+def start_send_queued_emails(sender, **kwargs):
+    """Start a task sending the emails queued by this thread, at the end of each request and django-q task"""
+    if getattr(_queued, "pending", False):
+        _queued.pending = False
+        async_task("coldfront.core.utils.mail.send_queued_emails")
+
+
+def _is_transient(error):
+    """Whether sending an email that failed with error is worth retrying"""
+    if isinstance(error, SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, msg in error.recipients.values())
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, SMTPServerDisconnected):
+        return True
+    if isinstance(error, SMTPException):
+        return False
+    # socket errors, e.g. connection refused or timed out
+    return isinstance(error, OSError)
+
+
+def _close_connection(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug("Error closing SMTP connection: %s", e)
+
+
+def _claim_queued_emails(batch_size):
+    """Claim up to batch_size pending emails for this run, so that runs happening at the same time don't
+    send the same email"""
+    batch = uuid.uuid4()
+    now = timezone.now()
+    claimable = Q(batch__isnull=True) | Q(modified__lt=now - timedelta(seconds=EMAIL_QUEUE_CLAIM_TIMEOUT))
+    pks = list(
+        QueuedEmail.objects.filter(claimable, status=QueuedEmail.PENDING).values_list("pk", flat=True)[:batch_size]
+    )
+    QueuedEmail.objects.filter(claimable, pk__in=pks, status=QueuedEmail.PENDING).update(batch=batch, modified=now)
+    return list(QueuedEmail.objects.filter(batch=batch))
+
+
+def _renew_claim(batch):
+    """Keep the emails claimed by a run that is still sending from being claimed again by another run"""
+    QueuedEmail.objects.filter(batch=batch, status=QueuedEmail.PENDING).update(modified=timezone.now())
+
+
+def send_queued_emails(batch_size=None, retries=None, backoff=None, connection=None):
+    """Send the pending emails in the mail queue, run as a django-q task.
+
+    The emails are claimed in batches of batch_size, and each batch is sent over one SMTP connection. An email
+    that fails with a transient error, such as a lost connection or a 4xx reply, is retried with an exponential
+    backoff after reconnecting. If it still fails the run stops, and the email and the rest of its batch stay
+    pending for the next run. Emails that fail with a permanent error are marked Failed.
+
+    Params:
+        batch_size (int): number of emails claimed and sent over a connection at a time
+        retries (int): number of times an email is retried after a transient error
+        backoff (float): seconds to wait before the first retry, doubled for each retry after
+        connection: Django email backend to send with, a new connection to the configured backend by default
+
+    Returns:
+        int: number of emails sent
+    """
+    batch_size = batch_size or EMAIL_QUEUE_BATCH_SIZE
+    retries = EMAIL_QUEUE_RETRIES if retries is None else retries
+    backoff = EMAIL_QUEUE_RETRY_BACKOFF if backoff is None else backoff
+    connection = connection or get_connection()
+
+    sent = 0
+    stopped = False
+    while not stopped:
+        emails = _claim_queued_emails(batch_size)
+        if not emails:
+            break
+
+        try:
+            for email in emails:
+                message = EmailMessage(
+                    email.subject, email.body, email.sender, email.receivers, cc=email.cc or None, connection=connection
+                )
+                for attempt in range(retries + 1):
+                    _renew_claim(email.batch)
+                    try:
+                        connection.open()
+                        connection.send_messages([message])
+                    except Exception as e:
+                        email.attempts += 1
+                        email.error = str(e)
+                        if not _is_transient(e):
+                            email.status = QueuedEmail.FAILED
+                            logger.error("Failed to send email %s to %s: %s", email.subject, email.receivers, e)
+                            break
+                        _close_connection(connection)
+                        if attempt == retries:
+                            logger.error("Failed to send email, leaving %s emails queued: %s", len(emails), e)
+                            stopped = True
+                            break
+                        delay = backoff * 2**attempt
+                        logger.warning("Failed to send email, retrying in %ss: %s", delay, e)
+                        time.sleep(delay)
+                    else:
+                        email.status = QueuedEmail.SENT
+                        email.error = ""
+                        sent += 1
+                        break
+                if stopped:
+                    break
+        finally:
+            _close_connection(connection)
+            now = timezone.now()
+            for email in emails:
+                email.batch = None
+                email.modified = now
+            QueuedEmail.objects.bulk_update(emails, ["status", "attempts", "error", "batch", "modified"])
+
+    logger.info("Sent %s queued emails", sent)
+    return sent
+
+
+def purge_queued_emails(days=None):
+    """Delete the emails that were sent or failed more than days ago from the mail queue, run as a django-q
+    scheduled task.
+
+    Params:
+        days (int): number of days sent and failed emails are kept, EMAIL_QUEUE_RETENTION_DAYS by default
+
+    Returns:
+        int: number of emails deleted
+    """
+    days = EMAIL_QUEUE_RETENTION_DAYS if days is None else days
+    deleted, _ = QueuedEmail.objects.filter(
+        status__in=[QueuedEmail.SENT, QueuedEmail.FAILED], modified__lt=timezone.now() - timedelta(days=days)
+    ).delete()
+    logger.info("Purged %s queued emails", deleted)
+    return deleted
+
+
 def email_template_context():
     """Basic email template context used as base for all templates"""
     return {
@@ -168,3 +396,7 @@ def send_allocation_eula_customer_email(
                 email_cc_list.append(manager.user.email)
 
     send_email_template(subject, template_name, ctx, email_receiver_list, cc=email_cc_list)
+
+
+request_finished.connect(start_send_queued_emails, dispatch_uid="start_send_queued_emails_request")
+post_execute_in_worker.connect(start_send_queued_emails, dispatch_uid="start_send_queued_emails_task")
@@ -10,7 +10,7 @@ from django.utils import timezone
 from django_q.models import Schedule
 from django_q.tasks import schedule
 
-from coldfront.config.email import EMAIL_ALLOCATION_EULA_REMINDERS
+from coldfront.config.email import EMAIL_ALLOCATION_EULA_REMINDERS, EMAIL_QUEUE_ENABLED
 from coldfront.core.utils.common import import_from_settings
 
 ALLOCATION_EULA_ENABLE = import_from_settings("ALLOCATION_EULA_ENABLE", False)
@@ -29,3 +29,12 @@ class Command(BaseCommand):
             schedule(
                 "coldfront.core.allocation.tasks.send_eula_reminders", schedule_type=Schedule.WEEKLY, next_run=date
             )
+
+        # signals mark the center summary statistics out of date, this catches changes made without sending them
+        schedule("coldfront.core.portal.utils.refresh_statistics", schedule_type=Schedule.HOURLY)
+
+        if EMAIL_QUEUE_ENABLED:
+            # emails are sent as they are queued, this picks up any left queued after an SMTP failure or queued
+            # outside of a request or task
+            schedule("coldfront.core.utils.mail.send_queued_emails", schedule_type=Schedule.MINUTES, minutes=10)
+            schedule("coldfront.core.utils.mail.purge_queued_emails", schedule_type=Schedule.DAILY, next_run=date)
@@ -0,0 +1,28 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from coldfront.core.attribute_expansion import expansion_context
+from coldfront.core.utils.permissions import permission_cache
+
+
+class AttributeExpansionMiddleware:
+    """Cache attribute expansion lookups for the duration of each request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with expansion_context():
+            return self.get_response(request)
+
+
+class PermissionCacheMiddleware:
+    """Remember Project and Allocation user permissions for the duration of each request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with permission_cache():
+            return self.get_response(request)
@@ -11,6 +11,15 @@ from django.shortcuts import get_object_or_404
 from django.urls import reverse
 
 from coldfront.core.project.models import Project
+from coldfront.core.utils.pagination import (
+    CachedCountPaginator,
+    KeysetPage,
+    cached_count,
+    decode_cursor,
+    encode_cursor,
+    get_sort_value,
+    seek,
+)
 
 
 class SnakeCaseTemplateNameMixin:
@@ -71,3 +80,98 @@ class UserActiveManagerOrHigherMixin(LoginRequiredMixin, UserPassesTestMixin):
             user=self.request.user, role__name="Manager", status__name="Active"
         ).exists():
             return True
+
+
+class KeysetPaginationMixin:
+    # paging a large list with OFFSET gets slower the deeper the page, and counting the whole list
+    # on every page load adds up, so:
+    #
+    # when the list is sorted on one of keyset_fields, the Previous/Next links carry a cursor with the
+    # sort key of the first/last object on the page, and the neighbouring page is found by seeking
+    # past it instead of by OFFSET.  keyset_fields must not be nullable and must be unique together
+    # with the primary key, which is always used as the tiebreaker.
+    #
+    # the total count is cached by the normalized filter parameters until the listed models change
+
+    keyset_fields = ("id",)
+    pagination_params = ("page", "after", "before", "order_by", "direction")
+
+    def get_count_params(self):
+        params = tuple(
+            sorted(
+                (key, tuple(sorted(values)))
+                for key, values in self.request.GET.lists()
+                if key not in self.pagination_params and any(values)
+            )
+        )
+        return (type(self).__name__, self.request.user.pk, params)
+
+    def get_keyset_ordering(self, queryset):
+        ordering = queryset.query.order_by
+        if len(ordering) != 1 or not isinstance(ordering[0], str):
+            return None
+
+        field = ordering[0].lstrip("-")
+        if field not in self.keyset_fields:
+            return None
+        return field, ordering[0].startswith("-")
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CachedCountPaginator(
+            queryset,
+            per_page,
+            count=cached_count(queryset, self.get_count_params()),
+            orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page,
+            **kwargs,
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        keyset = self.get_keyset_ordering(queryset)
+        if keyset is None:
+            return super().paginate_queryset(queryset, page_size)
+
+        field, descending = keyset
+        if field not in ("id", "pk"):
+            prefix = "-" if descending else ""
+            queryset = queryset.order_by(f"{prefix}{field}", f"{prefix}pk")
+
+        after = decode_cursor(self.request.GET.get("after", ""))
+        before = None if after else decode_cursor(self.request.GET.get("before", ""))
+
+        if after or before:
+            try:
+                number = max(int(self.request.GET.get("page")), 1)
+            except (TypeError, ValueError):
+                number = 1
+
+            paginator = self.get_paginator(queryset, page_size, allow_empty_first_page=self.get_allow_empty())
+            object_list = list(seek(queryset, field, descending, after or before, forward=bool(after))[: page_size + 1])
+            # if the objects past the cursor are gone, fall back to the page number below
+            if object_list:
+                more = len(object_list) > page_size
+                object_list = object_list[:page_size]
+                if after:
+                    page = KeysetPage(object_list, number, paginator, has_previous=True, has_next=more)
+                else:
+                    object_list.reverse()
+                    page = KeysetPage(object_list, number if more else 1, paginator, has_previous=more, has_next=True)
+                self._set_cursors(page, field)
+                return (paginator, page, page.object_list, True)
+
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        self._set_cursors(page, field)
+        return (paginator, page, object_list, is_paginated)
+
+    def _set_cursors(self, page, field):
+        page.previous_cursor = page.next_cursor = None
+        if not page.object_list:
+            return
+
+        first, last = page.object_list[0], page.object_list[len(page.object_list) - 1]
+        if field in ("id", "pk"):
+            page.previous_cursor = encode_cursor(first.pk, first.pk)
+            page.next_cursor = encode_cursor(last.pk, last.pk)
+        else:
+            page.previous_cursor = encode_cursor(get_sort_value(first, field), first.pk)
+            page.next_cursor = encode_cursor(get_sort_value(last, field), last.pk)
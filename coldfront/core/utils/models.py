@@ -2,4 +2,60 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-# Create your models here.
+from django.db import models
+from model_utils.models import TimeStampedModel
+
+
+class QueuedEmail(TimeStampedModel):
+    """An outgoing email waiting in the mail queue, see coldfront.core.utils.mail.send_queued_emails.
+
+    Attributes:
+        subject (str): subject of the email, including EMAIL_SUBJECT_PREFIX
+        body (str): rendered body of the email
+        sender (str): address the email is sent from
+        receivers (list[str]): addresses the email is sent to
+        cc (list[str]): addresses the email is copied to
+        status (str): Pending until the email has been handed to the SMTP server, then Sent, or Failed
+        attempts (int): number of times sending the email failed
+        error (str): error from the last failed attempt, if any
+        batch (UUID): identifies the send_queued_emails run sending the email, None when not claimed
+    """
+
+    PENDING = "Pending"
+    SENT = "Sent"
+    FAILED = "Failed"
+
+    class Meta:
+        ordering = [
+            "pk",
+        ]
+        indexes = [
+            models.Index(fields=["status", "batch"]),
+        ]
+
+    subject = models.TextField()
+    body = models.TextField()
+    sender = models.CharField(max_length=254)
+    receivers = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    status = models.CharField(
+        max_length=16, choices=[(PENDING, PENDING), (SENT, SENT), (FAILED, FAILED)], default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    batch = models.UUIDField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s to %s" % (self.subject, ", ".join(self.receivers))
+
+
+class CountGeneration(models.Model):
+    """The generation of the cached project and allocation list counts, see
+    coldfront.core.utils.pagination.cached_count. Kept in the database rather than the cache, so a change made
+    by any process invalidates the counts cached by every other process.
+
+    Attributes:
+        value (int): bumped whenever the objects counted by the list views change
+    """
+
+    value = models.PositiveBigIntegerField(default=0)
@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import base64
+import binascii
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.functional import cached_property
+
+from coldfront.core.allocation.signals import allocation_disable_batch
+from coldfront.core.utils.common import import_from_settings
+from coldfront.core.utils.models import CountGeneration
+
+LIST_VIEW_COUNT_CACHE_TIMEOUT = import_from_settings("LIST_VIEW_COUNT_CACHE_TIMEOUT", 300)
+
+# pk of the CountGeneration row
+COUNT_GENERATION = 1
+
+
+def get_count_generation():
+    return CountGeneration.objects.filter(pk=COUNT_GENERATION).values_list("value", flat=True).first() or 0
+
+
+def _bump_count_generation():
+    generation = CountGeneration.objects.filter(pk=COUNT_GENERATION)
+    if not generation.update(value=F("value") + 1):
+        CountGeneration.objects.get_or_create(pk=COUNT_GENERATION)
+        generation.update(value=F("value") + 1)
+
+
+def bump_count_generation(sender, **kwargs):
+    """Invalidate every cached list view count, once the change is committed so it is counted"""
+    transaction.on_commit(_bump_count_generation)
+
+
+def cached_count(queryset, params):
+    """
+    Params:
+        queryset (QuerySet): the objects to count
+        params (tuple): the normalized parameters that produced the queryset
+
+    Returns:
+        int: the number of objects, from the cache if these parameters were counted recently
+    """
+    if not LIST_VIEW_COUNT_CACHE_TIMEOUT:
+        return queryset.count()
+
+    digest = hashlib.sha256(repr((get_count_generation(), params)).encode()).hexdigest()
+    key = f"coldfront.list_view_count.{digest}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, LIST_VIEW_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator that uses a count computed ahead of time instead of counting the object list"""
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        if self._count is not None:
+            return self._count
+        return super().count
+
+
+class KeysetPage(Page):
+    """A page found by seeking past the sort key of a neighbouring page rather than by OFFSET.
+
+    The page number is carried along for display only, so it may drift from the true position if
+    objects are added or removed while paging.
+    """
+
+    def __init__(self, object_list, number, paginator, has_previous, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+    def next_page_number(self):
+        return self.number + 1
+
+
+def encode_cursor(value, pk):
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: the sort value and primary key in the cursor, or None if the cursor is not valid
+    """
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        return None
+
+    if not isinstance(pk, int) or not isinstance(value, (str, int)):
+        return None
+    return value, pk
+
+
+def get_sort_value(obj, field):
+    """Follow a related field lookup such as project__pi__username from obj"""
+    for name in field.split("__"):
+        obj = getattr(obj, name)
+    return obj
+
+
+def seek(queryset, field, descending, cursor, forward=True):
+    """
+    Params:
+        queryset (QuerySet): the objects to page through
+        field (str): the sort field, which must not be nullable
+        descending (bool): whether the list is sorted in descending order
+        cursor (tuple): the sort value and primary key to seek past
+        forward (bool): seek to the objects after the cursor, or before it if False
+
+    Returns:
+        QuerySet: the objects past the cursor, ordered moving away from it
+    """
+    value, pk = cursor
+    reverse = descending == forward
+    lookup = "lt" if reverse else "gt"
+    prefix = "-" if reverse else ""
+
+    if field in ("id", "pk"):
+        return queryset.filter(**{f"pk__{lookup}": pk}).order_by(f"{prefix}pk")
+
+    return queryset.filter(Q(**{f"{field}__{lookup}": value}) | Q(**{field: value, f"pk__{lookup}": pk})).order_by(
+        f"{prefix}{field}", f"{prefix}pk"
+    )
+
+
+for model in (
+    "allocation.Allocation",
+    "allocation.AllocationAttribute",
+    "allocation.AllocationUser",
+    "project.Project",
+    "project.ProjectUser",
+):
+    post_save.connect(bump_count_generation, sender=model, dispatch_uid=f"bump_count_generation_save_{model}")
+    post_delete.connect(bump_count_generation, sender=model, dispatch_uid=f"bump_count_generation_delete_{model}")
+m2m_changed.connect(
+    bump_count_generation, sender="allocation.Allocation_resources", dispatch_uid="bump_count_generation_resources"
+)
+# bulk updates don't send post_save
+allocation_disable_batch.connect(bump_count_generation, dispatch_uid="bump_count_generation_disable_batch")
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save
+
+_permission_cache = ContextVar("permission_cache", default=None)
+
+
+@contextmanager
+def permission_cache():
+    """Remember the Project and Allocation user permissions computed within the with block.
+
+    If a cache is already active it is reused, so nested blocks share the same cache.
+    """
+    if _permission_cache.get() is not None:
+        yield
+        return
+
+    token = _permission_cache.set({})
+    try:
+        yield
+    finally:
+        _permission_cache.reset(token)
+
+
+def cached_permissions(key, get_permissions):
+    """
+    Params:
+        key (tuple): identifies the object and user the permissions are for
+        get_permissions (callable): computes the list of permissions
+
+    Returns:
+        list: the permissions from the active cache, computed with get_permissions if not cached yet
+    """
+    cache = _permission_cache.get()
+    if cache is None:
+        return get_permissions()
+
+    if key not in cache:
+        cache[key] = get_permissions()
+    return list(cache[key])
+
+
+def clear_permission_cache(sender, **kwargs):
+    cache = _permission_cache.get()
+    if cache is not None:
+        cache.clear()
+
+
+for model in ("project.Project", "project.ProjectUser", "allocation.AllocationUser"):
+    post_save.connect(clear_permission_cache, sender=model, dispatch_uid=f"clear_permission_cache_save_{model}")
+    post_delete.connect(clear_permission_cache, sender=model, dispatch_uid=f"clear_permission_cache_delete_{model}")
@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from datetime import timedelta
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import TestCase
+from django.utils import timezone
+
+from coldfront.core.utils import mail as mail_utils
+from coldfront.core.utils.models import QueuedEmail
+
+
+class FlakyBackend(EmailBackend):
+    """locmem backend where sending to a refused address fails permanently, and the first `failures` sends
+    lose the connection"""
+
+    def __init__(self, failures=0, refused=(), **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.refused = set(refused)
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+
+    def send_messages(self, messages):
+        if self.failures > 0:
+            self.failures -= 1
+            raise SMTPServerDisconnected("Connection unexpectedly closed")
+        for message in messages:
+            if self.refused.intersection(message.to):
+                raise SMTPRecipientsRefused({address: (550, b"No such user") for address in message.to})
+        return super().send_messages(messages)
+
+
+class MailQueueTest(TestCase):
+    def setUp(self):
+        for name, value in [("EMAIL_ENABLED", True), ("EMAIL_QUEUE_ENABLED", True), ("EMAIL_SUBJECT_PREFIX", "")]:
+            patcher = patch.object(mail_utils, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # don't start a task for the emails queued here at the end of another test's request
+        self.addCleanup(setattr, mail_utils._queued, "pending", False)
+
+    def queue(self, count, **kwargs):
+        for i in range(count):
+            mail_utils.queue_email(f"Email {i}", "body", "coldfront@example.com", [f"user{i}@example.com"], **kwargs)
+
+    def test_send_email_queues(self):
+        """Emails queued while handling a request are sent by one task started once the request finishes"""
+        with patch.object(mail_utils, "async_task") as async_task:
+            mail_utils.send_email("Hello", "body", "coldfront@example.com", ["jane@example.com"])
+            mail_utils.send_email("Again", "body", "coldfront@example.com", ["jane@example.com"], cc="a@b.org")
+            async_task.assert_not_called()
+
+            mail_utils.start_send_queued_emails(sender=None)
+            mail_utils.start_send_queued_emails(sender=None)
+
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(
+            list(QueuedEmail.objects.values_list("subject", "receivers", "cc", "status")),
+            [
+                ("Hello", ["jane@example.com"], [], QueuedEmail.PENDING),
+                ("Again", ["jane@example.com"], ["a@b.org"], QueuedEmail.PENDING),
+            ],
+        )
+        async_task.assert_called_once_with("coldfront.core.utils.mail.send_queued_emails")
+
+    def test_send_queued_emails(self):
+        self.queue(5, cc=["manager@example.com"])
+        connection = FlakyBackend()
+
+        self.assertEqual(mail_utils.send_queued_emails(batch_size=2, connection=connection), 5)
+
+        self.assertEqual([message.subject for message in mail.outbox], [f"Email {i}" for i in range(5)])
+        self.assertEqual(mail.outbox[0].cc, ["manager@example.com"])
+        self.assertEqual(set(QueuedEmail.objects.values_list("status", "batch")), {(QueuedEmail.SENT, None)})
+        self.assertEqual(mail_utils.send_queued_emails(connection=connection), 0)
+
+    def test_retry(self):
+        self.queue(3)
+
+        sent = mail_utils.send_queued_emails(connection=FlakyBackend(failures=2), retries=2, backoff=0)
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(QueuedEmail.objects.get(subject="Email 0").attempts, 2)
+
+    def test_transient_failure_left_queued(self):
+        self.queue(3)
+
+        sent = mail_utils.send_queued_emails(connection=FlakyBackend(failures=10), retries=1, backoff=0)
+
+        self.assertEqual(sent, 0)
+        self.assertEqual(set(QueuedEmail.objects.values_list("status", "batch")), {(QueuedEmail.PENDING, None)})
+        self.assertEqual(QueuedEmail.objects.get(subject="Email 0").error, "Connection unexpectedly closed")
+
+        self.assertEqual(mail_utils.send_queued_emails(connection=FlakyBackend()), 3)
+
+    def test_permanent_failure(self):
+        self.queue(3)
+
+        sent = mail_utils.send_queued_emails(connection=FlakyBackend(refused=["user1@example.com"]))
+
+        self.assertEqual(sent, 2)
+        self.assertEqual(
+            dict(QueuedEmail.objects.values_list("subject", "status")),
+            {"Email 0": QueuedEmail.SENT, "Email 1": QueuedEmail.FAILED, "Email 2": QueuedEmail.SENT},
+        )
+
+    def test_claimed_emails_skipped(self):
+        """Emails claimed by another run aren't sent again"""
+        self.queue(2)
+        QueuedEmail.objects.filter(subject="Email 0").update(batch="00000000-0000-0000-0000-000000000001")
+
+        mail_utils.send_queued_emails(connection=FlakyBackend())
+
+        self.assertEqual([message.subject for message in mail.outbox], ["Email 1"])
+
+    def test_claim_in_progress_not_reclaimed(self):
+        """Emails claimed by a run that is still sending aren't claimed again, however long the run takes"""
+        self.queue(3)
+        clock = [timezone.now()]
+        concurrent = FlakyBackend()
+
+        class SlowBackend(FlakyBackend):
+            def send_messages(self, messages):
+                # each email takes most of the claim timeout to send
+                clock[0] += timedelta(seconds=mail_utils.EMAIL_QUEUE_CLAIM_TIMEOUT - 1)
+                if messages[0].subject == "Email 2":
+                    mail_utils.send_queued_emails(connection=concurrent)
+                return super().send_messages(messages)
+
+        with patch.object(mail_utils.timezone, "now", lambda: clock[0]):
+            sent = mail_utils.send_queued_emails(connection=SlowBackend())
+
+        self.assertEqual(sent, 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(concurrent.opened, 0)
+
+    def test_purge_queued_emails(self):
+        self.queue(3)
+        mail_utils.send_queued_emails(connection=FlakyBackend(refused=["user1@example.com"]))
+        QueuedEmail.objects.filter(subject="Email 2").update(status=QueuedEmail.PENDING)
+        QueuedEmail.objects.update(modified=timezone.now() - timedelta(days=31))
+
+        self.assertEqual(mail_utils.purge_queued_emails(), 2)
+        self.assertEqual(list(QueuedEmail.objects.values_list("subject", flat=True)), ["Email 2"])
+        self.assertEqual(mail_utils.purge_queued_emails(days=40), 0)
+
+
+class RenderEmailTemplateTest(TestCase):
+    def test_render_once_per_context(self):
+        context = {"center_name": "HPC", "project_dict": {"Physics": ("https://example.com/project/1/", "jane")}}
+
+        with patch.object(mail_utils, "render_to_string", return_value="body") as render_to_string:
+            mail_utils.render_email_template("email/allocation_expired.txt", context)
+            mail_utils.render_email_template("email/allocation_expired.txt", dict(context))
+            mail_utils.render_email_template("email/allocation_expired.txt", {**context, "center_name": "Cloud"})
+            mail_utils.render_email_template("email/allocation_expired.txt", {**context, "user": object()})
+            mail_utils.render_email_template("email/allocation_expired.txt", {**context, "user": object()})
+
+        self.assertEqual(render_to_string.call_count, 4)
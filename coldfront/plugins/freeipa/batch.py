@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.utils import timezone
+
+from coldfront.core.utils.common import import_from_settings
+from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+FREEIPA_BATCH_SIZE = import_from_settings("FREEIPA_BATCH_SIZE", 100)
+FREEIPA_BATCH_WORKERS = import_from_settings("FREEIPA_BATCH_WORKERS", 4)
+FREEIPA_BATCH_RETRIES = import_from_settings("FREEIPA_BATCH_RETRIES", 3)
+FREEIPA_BATCH_RETRY_BACKOFF = import_from_settings("FREEIPA_BATCH_RETRY_BACKOFF", 1)
+
+logger = logging.getLogger(__name__)
+
+
+class IPABatchExecutor:
+    """Runs journaled FreeIPA group operations with the FreeIPA batch command.
+
+    The operations are split into batches of batch_size, which are sent from a pool of worker threads.
+    The status of each operation is saved as soon as its batch returns, so if the run is interrupted the
+    operations that are still Pending can be run again later. A batch that raises an error, such as a
+    connection error, is retried with an exponential backoff; if every attempt fails its operations are
+    left Pending. Operations that FreeIPA reports an error for are marked Failed.
+    """
+
+    def __init__(
+        self,
+        batch,
+        connect=None,
+        batch_size=None,
+        workers=None,
+        retries=None,
+        backoff=None,
+    ):
+        """
+        Params:
+            batch (callable): runs a list of FreeIPA batch arguments and returns the batch result,
+                normally ipalib's api.Command.batch
+            connect (callable): called once in each worker thread before it sends a batch
+            batch_size (int): number of operations sent in each batch
+            workers (int): number of batches sent at the same time
+            retries (int): number of times a batch is retried if it raises an error
+            backoff (float): seconds to wait before the first retry, doubled for each retry after
+        """
+        self.batch = batch
+        self.connect = connect
+        self.batch_size = batch_size or FREEIPA_BATCH_SIZE
+        self.workers = workers or FREEIPA_BATCH_WORKERS
+        self.retries = FREEIPA_BATCH_RETRIES if retries is None else retries
+        self.backoff = FREEIPA_BATCH_RETRY_BACKOFF if backoff is None else backoff
+
+    def _chunks(self, operations):
+        for i in range(0, len(operations), self.batch_size):
+            yield operations[i : i + self.batch_size]
+
+    def _send(self, operations):
+        """Send a batch, retrying on errors. Runs in a worker thread so must not use the database.
+
+        Returns:
+            list[dict]: the result of each operation in the batch
+        """
+        args = [op.batch_arg() for op in operations]
+        for attempt in range(self.retries + 1):
+            try:
+                result = self.batch(args)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2**attempt
+                logger.warning("FreeIPA batch failed, retrying in %ss: %s", delay, e)
+                time.sleep(delay)
+
+        if result["count"] != len(args):
+            logger.error("Result count %d does not match batch size %d", result["count"], len(args))
+        return result["results"]
+
+    def _record(self, operations, results):
+        for op, res in zip(operations, results):
+            if res.get("error") is None:
+                op.status = FreeIPAGroupOperation.APPLIED
+                op.error = ""
+                logger.info("Success %s for user %s to group %s", op.method, op.username, op.group)
+            else:
+                op.status = FreeIPAGroupOperation.FAILED
+                op.error = str(res["error"])
+                logger.error("Failed %s for user %s to group %s: %s", op.method, op.username, op.group, op.error)
+
+        # Operations without a result are left Pending
+        for op in operations[len(results) :]:
+            op.error = "Missing FreeIPA result"
+
+    def run(self, operations):
+        """Run operations and save the outcome of each to the journal.
+
+        Params:
+            operations (list[FreeIPAGroupOperation]): saved operations to run
+
+        Returns:
+            list[FreeIPAGroupOperation]: the operations, with their new status
+        """
+        operations = list(operations)
+        if not operations:
+            return operations
+
+        with ThreadPoolExecutor(max_workers=self.workers, initializer=self.connect) as executor:
+            futures = {executor.submit(self._send, chunk): chunk for chunk in self._chunks(operations)}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    self._record(chunk, future.result())
+                except Exception as e:
+                    logger.error("FreeIPA batch of %s operations failed, leaving them pending: %s", len(chunk), e)
+                    for op in chunk:
+                        op.error = str(e)
+
+                now = timezone.now()
+                for op in chunk:
+                    op.modified = now
+                FreeIPAGroupOperation.objects.bulk_update(chunk, ["status", "error", "modified"])
+
+        return operations
+
+
+def write_report(operations, fh):
+    """Write the outcome of each operation as a line of JSON"""
+    for op in operations:
+        fh.write(
+            json.dumps(
+                {
+                    "method": op.method,
+                    "group": op.group,
+                    "username": op.username,
+                    "status": op.status,
+                    "error": op.error or None,
+                    "modified": op.modified.isoformat(),
+                }
+            )
+            + "\n"
+        )
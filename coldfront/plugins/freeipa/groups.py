@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from django.db.models import BooleanField, Exists, ExpressionWrapper, F, OuterRef, Q
+
+from coldfront.core.allocation.models import AllocationAttribute
+from coldfront.core.resource.models import Resource
+from coldfront.core.utils.common import import_from_settings
+
+UNIX_GROUP_ATTRIBUTE_NAME = import_from_settings("FREEIPA_GROUP_ATTRIBUTE_NAME", "freeipa_group")
+
+# allocation statuses where users should be considered active, as in AllocationUser.is_active()
+ACTIVE_ALLOCATION_STATUSES = ["Active", "Renewal Requested"]
+
+logger = logging.getLogger(__name__)
+
+
+def get_desired_groups(username=None, group=None):
+    """Work out which FreeIPA groups every active user should and should not be a member of.
+
+    A user should be a member of the groups of each allocation they are active on, unless all of the
+    allocation's resources are unavailable. A user should not be a member of the groups of the
+    allocations they are no longer active on, unless they are also active on another allocation
+    with the same group.
+
+    Params:
+        username (str): only work out the groups of this user, if given
+        group (str): only consider this group, if given
+
+    Returns:
+        dict: username -> (set of groups to be a member of, set of groups not to be a member of)
+    """
+    # the allocation user conditions must all be in one filter() so they apply to the same allocation user
+    user_filter = Q(allocation__allocationuser__user__is_active=True)
+    if username:
+        user_filter &= Q(allocation__allocationuser__user__username=username)
+
+    attributes = (
+        AllocationAttribute.objects.filter(user_filter, allocation_attribute_type__name=UNIX_GROUP_ATTRIBUTE_NAME)
+        .select_related("allocation_attribute_type__attribute_type", "allocation")
+        .annotate(
+            username=F("allocation__allocationuser__user__username"),
+            user_active=ExpressionWrapper(
+                Q(allocation__allocationuser__status__name="Active")
+                & Q(allocation__status__name__in=ACTIVE_ALLOCATION_STATUSES),
+                output_field=BooleanField(),
+            ),
+            resources_available=Exists(Resource.objects.filter(allocation=OuterRef("allocation"), is_available=True)),
+        )
+        .order_by()
+    )
+
+    active = {}
+    removed = {}
+    for attribute in attributes.iterator(chunk_size=2000):
+        name = attribute.expanded_value()
+        if group and name != group:
+            continue
+
+        if not attribute.user_active:
+            removed.setdefault(attribute.username, set()).add(name)
+        elif attribute.resources_available:
+            active.setdefault(attribute.username, set()).add(name)
+        else:
+            logger.debug(
+                "Skipping allocation %s for user %s due to all resources being inactive",
+                attribute.allocation_id,
+                attribute.username,
+            )
+
+    return {
+        user: (active.get(user, set()), removed.get(user, set()) - active.get(user, set()))
+        for user in active.keys() | removed.keys()
+    }
@@ -13,12 +13,16 @@ from ipalib import api
 
 from coldfront.core.allocation.models import AllocationUser, AllocationUserStatusChoice
 from coldfront.core.project.models import ProjectUser, ProjectUserStatusChoice
+from coldfront.plugins.freeipa.batch import IPABatchExecutor, write_report
+from coldfront.plugins.freeipa.groups import get_desired_groups
+from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
 from coldfront.plugins.freeipa.search import LDAPUserSearch
+from coldfront.plugins.freeipa.snapshot import FreeIPASnapshot
 from coldfront.plugins.freeipa.utils import (
     CLIENT_KTNAME,
     FREEIPA_NOOP,
-    UNIX_GROUP_ATTRIBUTE_NAME,
     ipa_bootstrap,
+    ipa_connect,
 )
 
 logger = logging.getLogger(__name__)
@@ -39,6 +43,21 @@ class Command(BaseCommand):
         )
         parser.add_argument("-n", "--noop", help="Print commands only. Do not run any commands.", action="store_true")
         parser.add_argument("-x", "--header", help="Include header in output", action="store_true")
+        parser.add_argument(
+            "-b", "--batch-size", type=int, help="Number of FreeIPA changes sent in each batch when syncing"
+        )
+        parser.add_argument("-w", "--workers", type=int, help="Number of FreeIPA batches sent at the same time")
+        parser.add_argument(
+            "--resume",
+            help="Finish the changes of the last sync that are not yet applied, without checking again",
+            action="store_true",
+        )
+        parser.add_argument("--report", help="Write the outcome of each FreeIPA change to this file as JSON lines")
+        parser.add_argument(
+            "--snapshot",
+            help="Read group membership and status of all users from FreeIPA LDAP up front instead of per user",
+            action="store_true",
+        )
 
     def writerow(self, row):
         try:
@@ -53,7 +72,9 @@ class Command(BaseCommand):
             raise ValueError("Missing FreeIPA result")
 
     def add_group(self, user, group, status):
-        self.ipa_batch_args.append({"method": "group_add_member", "params": [[group], {"user": [user.username]}]})
+        self.ipa_operations.append(
+            FreeIPAGroupOperation(method=FreeIPAGroupOperation.ADD_MEMBER, group=group, username=user.username)
+        )
 
         row = [
             "Add",
@@ -65,7 +86,9 @@ class Command(BaseCommand):
         self.writerow(row)
 
     def remove_group(self, user, group, status):
-        self.ipa_batch_args.append({"method": "group_remove_member", "params": [[group], {"user": [user.username]}]})
+        self.ipa_operations.append(
+            FreeIPAGroupOperation(method=FreeIPAGroupOperation.REMOVE_MEMBER, group=group, username=user.username)
+        )
 
         row = [
             "Remove",
@@ -129,6 +152,20 @@ class Command(BaseCommand):
             "Checking FreeIPA user=%s active_groups=%s removed_groups=%s", user.username, active_groups, removed_groups
         )
 
+        if self.snapshot is not None:
+            freeipa_status = self.snapshot.status(user.username)
+            if freeipa_status == FreeIPASnapshot.NOT_FOUND:
+                logger.info("Skipping user %s not found in FreeIPA", user.username)
+                return
+            freeipa_groups = self.snapshot.user_groups(user.username)
+        else:
+            freeipa_groups, freeipa_status = self.get_user_freeipa(user)
+            if freeipa_groups is None:
+                return
+
+        self.sync_user_freeipa(user, freeipa_groups, freeipa_status, active_groups, removed_groups)
+
+    def get_user_freeipa(self, user):
         freeipa_groups = []
         freeipa_status = "Unknown"
         try:
@@ -147,8 +184,11 @@ class Command(BaseCommand):
                 freeipa_status = "NotFound"
             else:
                 logger.error("dbus error failed to find user %s in FreeIPA: %s", user.username, e)
-            return
+            return None, freeipa_status
 
+        return freeipa_groups, freeipa_status
+
+    def sync_user_freeipa(self, user, freeipa_groups, freeipa_status, active_groups, removed_groups):
         if freeipa_status == "Disabled" and user.is_active:
             logger.warning("User is active in coldfront but disabled in FreeIPA: %s", user.username)
             self.sync_user_status(user, active=False)
@@ -166,91 +206,38 @@ class Command(BaseCommand):
                 logger.info("User %s should be removed from freeipa group: %s", user.username, g)
                 self.remove_group(user, g, freeipa_status)
 
-    def exec_batch(self):
+    def exec_batch(self, resume=False):
         ipa_bootstrap()
         self._set_logging()
-        batch_args = []
-
-        for ci, arg in enumerate(self.ipa_batch_args):
-            if len(batch_args) < self.ipa_batch_size:
-                batch_args.append(arg)
-
-            if len(batch_args) < self.ipa_batch_size and ci < len(self.ipa_batch_args) - 1:
-                continue
-
-            result = api.Command.batch(batch_args)
-
-            if len(batch_args) != result["count"]:
-                logger.error("Result count %d does not match batch size %d", result["count"], len(batch_args))
-            if result["count"] > 0:
-                for ri, res in enumerate(result["results"]):
-                    _res = res.get("result", None)
-                    if "error" not in res or res["error"] is None:
-                        logger.info(
-                            "Success %s for user %s to group %s",
-                            batch_args[ri]["method"],
-                            batch_args[ri]["params"][1]["user"][0],
-                            batch_args[ri]["params"][0][0],
-                        )
-                    else:
-                        logger.error(
-                            "Failed %s for user %s to group %s: %s",
-                            batch_args[ri]["method"],
-                            batch_args[ri]["params"][1]["user"][0],
-                            batch_args[ri]["params"][0][0],
-                            res["error"],
-                        )
-            del batch_args[:]
 
-    def process_user(self, user):
-        if self.filter_user and self.filter_user != user.username:
-            return
-
-        user_allocations = AllocationUser.objects.filter(
-            user=user, allocation__allocationattribute__allocation_attribute_type__name=UNIX_GROUP_ATTRIBUTE_NAME
+        if resume:
+            operations = FreeIPAGroupOperation.objects.exclude(status=FreeIPAGroupOperation.APPLIED)
+            logger.info("Resuming %s FreeIPA operations", len(operations))
+        else:
+            # start a new journal for this sync
+            FreeIPAGroupOperation.objects.all().delete()
+            FreeIPAGroupOperation.objects.bulk_create(self.ipa_operations)
+            operations = FreeIPAGroupOperation.objects.all()
+
+        executor = IPABatchExecutor(
+            api.Command.batch,
+            connect=ipa_connect,
+            batch_size=self.ipa_batch_size,
+            workers=self.ipa_workers,
         )
+        operations = executor.run(operations)
 
-        active_groups = []
-        for ua in user_allocations:
-            if not ua.is_active():
-                continue
-
-            all_resources_inactive = True
-            for r in ua.allocation.resources.all():
-                if r.is_available:
-                    all_resources_inactive = False
-
-            if all_resources_inactive:
-                logger.debug(
-                    "Skipping allocation to %s for user %s due to all resources being inactive",
-                    ua.allocation.get_resources_as_string,
-                    user.username,
-                )
-                continue
-
-            for g in ua.allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME):
-                if g not in active_groups:
-                    active_groups.append(g)
-
-        removed_groups = []
-        for ua in user_allocations:
-            if ua.is_active():
-                continue
-
-            for g in ua.allocation.get_attribute_list(UNIX_GROUP_ATTRIBUTE_NAME):
-                if g not in removed_groups and g not in active_groups:
-                    removed_groups.append(g)
+        if self.report:
+            with open(self.report, "w") as fh:
+                write_report(operations, fh)
 
-        if self.filter_group:
-            if self.filter_group in active_groups:
-                active_groups = [self.filter_group]
-            else:
-                active_groups = []
+    def process_user(self, user):
+        if self.filter_user and self.filter_user != user.username:
+            return
 
-            if self.filter_group in removed_groups:
-                removed_groups = [self.filter_group]
-            else:
-                removed_groups = []
+        active_groups, removed_groups = self.desired_groups.get(user.username, (set(), set()))
+        active_groups = sorted(active_groups)
+        removed_groups = sorted(removed_groups)
 
         if len(active_groups) == 0 and len(removed_groups) == 0:
             return
@@ -274,8 +261,10 @@ class Command(BaseCommand):
         self.verbosity = int(options["verbosity"])
         self._set_logging()
 
-        self.ipa_batch_args = []
-        self.ipa_batch_size = 100
+        self.ipa_operations = []
+        self.ipa_batch_size = options["batch_size"]
+        self.ipa_workers = options["workers"]
+        self.report = options["report"]
         self.noop = FREEIPA_NOOP
         if options["noop"]:
             self.noop = True
@@ -291,6 +280,13 @@ class Command(BaseCommand):
             self.disable = True
             logger.warning("Disabling users in ColdFront that are disabled in FreeIPA")
 
+        if options["resume"]:
+            if self.noop:
+                logger.warning("NOOP enabled, not resuming the last sync")
+            else:
+                self.exec_batch(resume=True)
+            return
+
         header = [
             "action",
             "username",
@@ -301,14 +297,6 @@ class Command(BaseCommand):
         if options["header"]:
             self.writerow(header)
 
-        self.ipa_ldap = LDAPUserSearch("", "")
-        bus = dbus.SystemBus()
-        infopipe_obj = bus.get_object("org.freedesktop.sssd.infopipe", "/org/freedesktop/sssd/infopipe")
-        self.ifp = dbus.Interface(infopipe_obj, dbus_interface="org.freedesktop.sssd.infopipe")
-
-        users = User.objects.filter(is_active=True)
-        logger.info("Processing %s active users", len(users))
-
         self.filter_user = ""
         self.filter_group = ""
         if options["username"]:
@@ -318,6 +306,21 @@ class Command(BaseCommand):
             logger.info("Filtering output by group: %s", options["group"])
             self.filter_group = options["group"]
 
+        self.ipa_ldap = LDAPUserSearch("", "")
+        self.snapshot = None
+        if options["snapshot"]:
+            self.snapshot = FreeIPASnapshot(self.ipa_ldap.conn, self.ipa_ldap.FREEIPA_USER_SEARCH_BASE).load(
+                username=self.filter_user or None
+            )
+        else:
+            bus = dbus.SystemBus()
+            infopipe_obj = bus.get_object("org.freedesktop.sssd.infopipe", "/org/freedesktop/sssd/infopipe")
+            self.ifp = dbus.Interface(infopipe_obj, dbus_interface="org.freedesktop.sssd.infopipe")
+
+        users = User.objects.filter(is_active=True)
+        logger.info("Processing %s active users", len(users))
+
+        self.desired_groups = get_desired_groups(username=self.filter_user, group=self.filter_group)
         for user in users:
             self.process_user(user)
 
@@ -329,6 +332,13 @@ class Command(BaseCommand):
                 if self.filter_user and self.filter_user != user.username:
                     continue
 
+                if self.snapshot is not None:
+                    freeipa_status = self.snapshot.status(user.username)
+                    if freeipa_status != FreeIPASnapshot.ENABLED:
+                        logger.info("User is %s in FreeIPA so disable in ColdFront: %s", freeipa_status, user.username)
+                        self.disable_user_in_coldfront(user, freeipa_status)
+                    continue
+
                 try:
                     result = self.ifp.GetUserAttr(user.username, ["nsaccountlock"])
                     if "nsAccountLock" in result and str(result["nsAccountLock"][0]) == "TRUE":
@@ -0,0 +1,57 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# Generated by Django 5.2.18 on 2026-10-17 18:18
+
+import django.utils.timezone
+import model_utils.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="FreeIPAGroupOperation",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "created",
+                    model_utils.fields.AutoCreatedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="created"
+                    ),
+                ),
+                (
+                    "modified",
+                    model_utils.fields.AutoLastModifiedField(
+                        default=django.utils.timezone.now, editable=False, verbose_name="modified"
+                    ),
+                ),
+                (
+                    "method",
+                    models.CharField(
+                        choices=[("group_add_member", "Add member"), ("group_remove_member", "Remove member")],
+                        max_length=32,
+                    ),
+                ),
+                ("group", models.CharField(max_length=255)),
+                ("username", models.CharField(max_length=150)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("Pending", "Pending"), ("Applied", "Applied"), ("Failed", "Failed")],
+                        default="Pending",
+                        max_length=16,
+                    ),
+                ),
+                ("error", models.TextField(blank=True)),
+            ],
+            options={
+                "ordering": ["pk"],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.db import models
+from model_utils.models import TimeStampedModel
+
+
+class FreeIPAGroupOperation(TimeStampedModel):
+    """A FreeIPA group membership change queued by freeipa_check --sync. The operations of the last sync are
+    kept as a journal, so a sync that was interrupted can be finished with freeipa_check --resume.
+
+    Attributes:
+        method (str): FreeIPA API method, group_add_member or group_remove_member
+        group (str): name of the FreeIPA group
+        username (str): username of the FreeIPA user
+        status (str): Pending until the operation has been run, then Applied or Failed
+        error (str): error returned by FreeIPA for the last attempt, if any
+    """
+
+    ADD_MEMBER = "group_add_member"
+    REMOVE_MEMBER = "group_remove_member"
+
+    PENDING = "Pending"
+    APPLIED = "Applied"
+    FAILED = "Failed"
+
+    class Meta:
+        ordering = [
+            "pk",
+        ]
+
+    method = models.CharField(max_length=32, choices=[(ADD_MEMBER, "Add member"), (REMOVE_MEMBER, "Remove member")])
+    group = models.CharField(max_length=255)
+    username = models.CharField(max_length=150)
+    status = models.CharField(
+        max_length=16, choices=[(PENDING, PENDING), (APPLIED, APPLIED), (FAILED, FAILED)], default=PENDING
+    )
+    error = models.TextField(blank=True)
+
+    def batch_arg(self):
+        """
+        Returns:
+            dict: the operation as an argument to the FreeIPA batch command
+        """
+        return {"method": self.method, "params": [[self.group], {"user": [self.username]}]}
+
+    def __str__(self):
+        return "%s %s/%s" % (self.method, self.group, self.username)
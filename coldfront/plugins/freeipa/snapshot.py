@@ -0,0 +1,98 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from ldap3.core.exceptions import LDAPInvalidDnError
+from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import parse_dn
+
+from coldfront.core.utils.common import import_from_settings
+
+FREEIPA_SNAPSHOT_PAGE_SIZE = import_from_settings("FREEIPA_SNAPSHOT_PAGE_SIZE", 1000)
+
+logger = logging.getLogger(__name__)
+
+
+class FreeIPASnapshot:
+    """Group membership and account status of every FreeIPA user, read in one paged LDAP search.
+
+    FreeIPA keeps the memberOf attribute of each user up to date with all of the groups they belong
+    to, including through nested groups, which is the same list SSSD returns for GetUserGroups.
+    """
+
+    ENABLED = "Enabled"
+    DISABLED = "Disabled"
+    NOT_FOUND = "NotFound"
+
+    def __init__(self, conn, user_search_base, page_size=None):
+        self.conn = conn
+        self.user_search_base = user_search_base
+        self.page_size = page_size or FREEIPA_SNAPSHOT_PAGE_SIZE
+        self.locked = {}
+        self.groups = {}
+
+    def load(self, username=None):
+        """
+        Params:
+            username (str): only load this user, if given
+
+        Returns:
+            FreeIPASnapshot: self, for chaining
+        """
+        search_filter = "(objectClass=posixaccount)"
+        if username:
+            search_filter = "(&{}(uid={}))".format(search_filter, escape_filter_chars(username))
+
+        entries = self.conn.extend.standard.paged_search(
+            self.user_search_base,
+            search_filter,
+            attributes=["uid", "nsAccountLock", "memberOf"],
+            paged_size=self.page_size,
+            generator=True,
+        )
+        for entry in entries:
+            if entry.get("type") != "searchResEntry":
+                continue
+
+            attributes = entry["attributes"]
+            uid = self._first(attributes.get("uid"))
+            if not uid:
+                continue
+
+            self.locked[uid] = str(self._first(attributes.get("nsAccountLock")) or "").upper() == "TRUE"
+            self.groups[uid] = {cn for cn in map(self.group_name, attributes.get("memberOf") or []) if cn}
+
+        logger.info("Loaded FreeIPA snapshot of %s users", len(self.locked))
+        return self
+
+    def status(self, username):
+        if username not in self.locked:
+            return self.NOT_FOUND
+        return self.DISABLED if self.locked[username] else self.ENABLED
+
+    def user_groups(self, username):
+        return self.groups.get(username, set())
+
+    @staticmethod
+    def group_name(dn):
+        """
+        Returns:
+            str: the cn of a group under cn=groups, or None for anything else such as roles or HBAC rules
+        """
+        try:
+            rdns = parse_dn(dn)
+        except LDAPInvalidDnError:
+            logger.warning("Skipping invalid memberOf dn: %s", dn)
+            return None
+
+        if len(rdns) < 2 or rdns[0][0].lower() != "cn" or rdns[1][0].lower() != "cn" or rdns[1][1].lower() != "groups":
+            return None
+        return rdns[0][1]
+
+    @staticmethod
+    def _first(values):
+        if isinstance(values, list):
+            return values[0] if values else None
+        return values
@@ -0,0 +1,131 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import threading
+import unittest
+from io import StringIO
+
+from django.test import TestCase
+
+from coldfront.config.env import ENV
+
+
+class FakeBatch:
+    """Stand-in for ipalib's api.Command.batch. Operations on groups in errors fail, and the first
+    `failures` calls raise a connection error."""
+
+    def __init__(self, errors=(), failures=0):
+        self.errors = set(errors)
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, args):
+        with self.lock:
+            self.calls.append(args)
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("connection refused")
+
+        results = []
+        for arg in args:
+            group = arg["params"][0][0]
+            error = f"group {group} not found" if group in self.errors else None
+            results.append({"result": {"cn": [group]}, "error": error})
+        return {"count": len(results), "results": results}
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_FREEIPA", default=False), "Only run FreeIPA tests if enabled")
+class IPABatchExecutorTest(TestCase):
+    def setUp(self):
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        FreeIPAGroupOperation.objects.bulk_create(
+            FreeIPAGroupOperation(
+                method=FreeIPAGroupOperation.ADD_MEMBER if i % 2 else FreeIPAGroupOperation.REMOVE_MEMBER,
+                group="missing" if i == 3 else f"group{i}",
+                username=f"user{i}",
+            )
+            for i in range(10)
+        )
+
+    def statuses(self):
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        return dict(FreeIPAGroupOperation.objects.values_list("username", "status"))
+
+    def test_run(self):
+        from coldfront.plugins.freeipa.batch import IPABatchExecutor
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        batch = FakeBatch(errors=["missing"])
+        connected = []
+        executor = IPABatchExecutor(batch, connect=lambda: connected.append(1), batch_size=3, workers=2)
+        operations = executor.run(FreeIPAGroupOperation.objects.all())
+
+        self.assertEqual(sorted(len(call) for call in batch.calls), [1, 3, 3, 3])
+        self.assertIn(
+            {"method": "group_remove_member", "params": [["group0"], {"user": ["user0"]}]},
+            [arg for call in batch.calls for arg in call],
+        )
+        self.assertLessEqual(len(connected), 2)
+
+        statuses = self.statuses()
+        self.assertEqual(statuses.pop("user3"), FreeIPAGroupOperation.FAILED)
+        self.assertEqual(set(statuses.values()), {FreeIPAGroupOperation.APPLIED})
+        self.assertEqual(FreeIPAGroupOperation.objects.get(username="user3").error, "group missing not found")
+        self.assertEqual([op.username for op in operations], [f"user{i}" for i in range(10)])
+
+    def test_retry(self):
+        from coldfront.plugins.freeipa.batch import IPABatchExecutor
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        batch = FakeBatch(failures=2)
+        IPABatchExecutor(batch, batch_size=10, workers=1, retries=2, backoff=0).run(FreeIPAGroupOperation.objects.all())
+
+        self.assertEqual(len(batch.calls), 3)
+        self.assertEqual(set(self.statuses().values()), {FreeIPAGroupOperation.APPLIED})
+
+    def test_resume(self):
+        """Batches that still fail after retrying are left pending, and are the only ones run again"""
+        from coldfront.plugins.freeipa.batch import IPABatchExecutor
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        batch = FakeBatch(failures=2)
+        IPABatchExecutor(batch, batch_size=5, workers=1, retries=1, backoff=0).run(FreeIPAGroupOperation.objects.all())
+
+        pending = FreeIPAGroupOperation.objects.filter(status=FreeIPAGroupOperation.PENDING)
+        self.assertEqual(len(pending), 5)
+        self.assertEqual(pending[0].error, "connection refused")
+
+        batch = FakeBatch()
+        IPABatchExecutor(batch, batch_size=5, workers=1).run(
+            FreeIPAGroupOperation.objects.exclude(status=FreeIPAGroupOperation.APPLIED)
+        )
+        self.assertEqual(len(batch.calls), 1)
+        self.assertEqual(set(self.statuses().values()), {FreeIPAGroupOperation.APPLIED})
+
+    def test_report(self):
+        from coldfront.plugins.freeipa.batch import IPABatchExecutor, write_report
+        from coldfront.plugins.freeipa.models import FreeIPAGroupOperation
+
+        IPABatchExecutor(FakeBatch(errors=["missing"]), workers=1).run(FreeIPAGroupOperation.objects.all())
+
+        out = StringIO()
+        write_report(FreeIPAGroupOperation.objects.all(), out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(
+            {key: rows[3][key] for key in ("method", "group", "username", "status", "error")},
+            {
+                "method": "group_add_member",
+                "group": "missing",
+                "username": "user3",
+                "status": "Failed",
+                "error": "group missing not found",
+            },
+        )
+        self.assertIsNone(rows[0]["error"])
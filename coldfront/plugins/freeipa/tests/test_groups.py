@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import unittest
+
+from django.test import TestCase
+
+from coldfront.config.env import ENV
+from coldfront.core.test_helpers.factories import (
+    AAttributeTypeFactory,
+    AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationFactory,
+    AllocationStatusChoiceFactory,
+    AllocationUserFactory,
+    AllocationUserStatusChoiceFactory,
+    ResourceFactory,
+    UserFactory,
+)
+from coldfront.plugins.freeipa.groups import get_desired_groups
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_FREEIPA", default=False), "Only run FreeIPA tests if enabled")
+class DesiredGroupsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        text = AAttributeTypeFactory(name="Text")
+        group_type = AllocationAttributeTypeFactory(name="freeipa_group", attribute_type=text)
+        other_type = AllocationAttributeTypeFactory(name="slurm_account_name", attribute_type=text)
+        available = ResourceFactory(name="cluster", is_available=True)
+        retired = ResourceFactory(name="retired", is_available=False)
+        removed = AllocationUserStatusChoiceFactory(name="Removed")
+
+        cls.jane = UserFactory(username="jane")
+        cls.john = UserFactory(username="john")
+        cls.gone = UserFactory(username="gone", is_active=False)
+
+        def allocation(groups, resources, status="Active"):
+            allocation = AllocationFactory(status=AllocationStatusChoiceFactory(name=status))
+            allocation.resources.add(*resources)
+            for group in groups:
+                AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=group_type, value=group)
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=other_type, value="account")
+            return allocation
+
+        physics = allocation(["physics", "physics-data"], [available, retired])
+        chem = allocation(["chem"], [available])
+        old = allocation(["old"], [retired])
+        expired = allocation(["bio", "physics"], [available], status="Expired")
+        allocation(["unused"], [available])
+
+        for user in (cls.jane, cls.gone):
+            AllocationUserFactory(allocation=physics, user=user)
+            AllocationUserFactory(allocation=chem, user=user, status=removed)
+            AllocationUserFactory(allocation=old, user=user)
+            AllocationUserFactory(allocation=expired, user=user)
+        AllocationUserFactory(allocation=chem, user=cls.john)
+
+    def test_desired_groups(self):
+        with self.assertNumQueries(1):
+            groups = get_desired_groups()
+
+        self.assertEqual(
+            groups,
+            {
+                # old is skipped as all its resources are unavailable, and the user is still active on physics
+                "jane": ({"physics", "physics-data"}, {"chem", "bio"}),
+                "john": ({"chem"}, set()),
+            },
+        )
+
+    def test_filters(self):
+        self.assertEqual(get_desired_groups(username="john"), {"john": ({"chem"}, set())})
+        self.assertEqual(get_desired_groups(group="chem"), {"jane": (set(), {"chem"}), "john": ({"chem"}, set())})
+        self.assertEqual(get_desired_groups(username="gone"), {})
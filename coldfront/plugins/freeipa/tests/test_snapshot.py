@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import unittest
+
+from django.test import SimpleTestCase
+from ldap3 import MOCK_SYNC, NONE, Connection, Server
+
+from coldfront.config.env import ENV
+from coldfront.plugins.freeipa.snapshot import FreeIPASnapshot
+
+BASE = "cn=accounts,dc=example,dc=edu"
+USER_SEARCH_BASE = f"cn=users,{BASE}"
+
+
+def group_dn(name):
+    return f"cn={name},cn=groups,{BASE}"
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_FREEIPA", default=False), "Only run FreeIPA tests if enabled")
+class FreeIPASnapshotTest(SimpleTestCase):
+    def setUp(self):
+        # in-memory stand-in for the FreeIPA directory
+        self.conn = Connection(Server("freeipa", get_info=NONE), client_strategy=MOCK_SYNC)
+        self.add_user("jane", "FALSE", [group_dn("physics"), group_dn("ipausers"), f"cn=admins,cn=roles,{BASE}"])
+        self.add_user("john", "TRUE", [group_dn("physics")])
+        self.add_user("jim", None, [f"cn=allow_ssh,cn=hbac,{BASE}", f"ipaUniqueID=1234,cn=sudorules,cn=sudo,{BASE}"])
+        for i in range(5):
+            self.add_user(f"user{i}", "FALSE", [group_dn(f"group{i}")])
+        self.conn.strategy.add_entry(group_dn("physics"), {"objectClass": ["groupofnames"], "cn": "physics"})
+        self.conn.bind()
+
+    def add_user(self, uid, locked, member_of):
+        attributes = {"objectClass": ["person", "posixaccount"], "uid": uid, "memberOf": member_of}
+        if locked is not None:
+            attributes["nsAccountLock"] = locked
+        self.conn.strategy.add_entry(f"uid={uid},{USER_SEARCH_BASE}", attributes)
+
+    def test_load(self):
+        snapshot = FreeIPASnapshot(self.conn, USER_SEARCH_BASE, page_size=2).load()
+
+        self.assertEqual(len(snapshot.groups), 8)
+        self.assertEqual(snapshot.user_groups("jane"), {"physics", "ipausers"})
+        self.assertEqual(snapshot.user_groups("user3"), {"group3"})
+        # roles, hbac and sudo rules are not groups
+        self.assertEqual(snapshot.user_groups("jim"), set())
+        self.assertEqual(snapshot.user_groups("nobody"), set())
+
+    def test_status(self):
+        snapshot = FreeIPASnapshot(self.conn, USER_SEARCH_BASE).load()
+
+        self.assertEqual(snapshot.status("jane"), FreeIPASnapshot.ENABLED)
+        self.assertEqual(snapshot.status("jim"), FreeIPASnapshot.ENABLED)
+        self.assertEqual(snapshot.status("john"), FreeIPASnapshot.DISABLED)
+        self.assertEqual(snapshot.status("nobody"), FreeIPASnapshot.NOT_FOUND)
+
+    def test_load_username(self):
+        snapshot = FreeIPASnapshot(self.conn, USER_SEARCH_BASE).load(username="john")
+
+        self.assertEqual(list(snapshot.groups), ["john"])
+        self.assertEqual(snapshot.status("jane"), FreeIPASnapshot.NOT_FOUND)
+
+    def test_load_username_escaped(self):
+        snapshot = FreeIPASnapshot(self.conn, USER_SEARCH_BASE).load(username="*")
+
+        self.assertEqual(snapshot.groups, {})
+
+    def test_group_name(self):
+        self.assertEqual(FreeIPASnapshot.group_name(group_dn("physics")), "physics")
+        self.assertEqual(FreeIPASnapshot.group_name("CN=Chem,CN=Groups,cn=accounts"), "Chem")
+        self.assertIsNone(FreeIPASnapshot.group_name(f"cn=admins,cn=roles,{BASE}"))
+        self.assertIsNone(FreeIPASnapshot.group_name("not a dn"))
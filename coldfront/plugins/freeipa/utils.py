@@ -40,6 +40,12 @@ def ipa_bootstrap():
         raise ImproperlyConfigured("Failed to initialze FreeIPA: {0}".format(e))
 
 
+def ipa_connect():
+    """Connect the current thread to FreeIPA, after ipa_bootstrap has been called"""
+    if not api.Backend.rpcclient.isconnected():
+        api.Backend.rpcclient.connect()
+
+
 def check_ipa_group_error(res):
     if not res:
         raise ValueError("Missing FreeIPA response")
@@ -5,8 +5,12 @@
 """Coldfront project_openldap plugin - django management command -  project_openldap_sync.py"""
 
 import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
 from coldfront.core.project.models import (
     Project,
@@ -26,6 +30,7 @@ from coldfront.plugins.project_openldap.utils import (
     add_per_project_ou_to_openldap,
     add_posixgroup_to_openldap,
     allocate_project_openldap_gid,
+    connection_pool,
     construct_dn_archived_str,
     construct_dn_str,
     construct_ou_archived_dn_str,
@@ -36,7 +41,9 @@ from coldfront.plugins.project_openldap.utils import (
     ldapsearch_check_project_dn,
     ldapsearch_get_description,
     ldapsearch_get_posixgroup_memberuids,
+    ldapsearch_get_posixgroups,
     move_dn_in_openldap,
+    normalize_dn,
     remove_members_from_openldap_posixgroup,
     update_posixgroup_description_in_openldap,
 )
@@ -60,6 +67,37 @@ logger = logging.getLogger(__name__)
 # where DNs are passed to functions it is often to self.stdout.write before an action
 
 
+class ProjectSyncResult:
+    """Output and outcome of checking one project in a worker thread
+
+    Attributes:
+        project_code (str): project group/code that was checked
+        lines (list[str]): lines written while checking the project
+        error (Exception): error that stopped the check, if any
+    """
+
+    def __init__(self, project_code):
+        self.project_code = project_code
+        self.lines = []
+        self.error = None
+
+
+class ProjectSyncOutput:
+    """Stands in for the command's stdout while projects are checked in worker threads. Lines written by a
+    thread that is checking a project are kept in that project's result, to be written out in order later."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def write(self, msg="", style_func=None, ending=None):
+        result = getattr(self.local, "result", None)
+        if result is None:
+            self.stdout.write(msg, style_func, ending)
+        else:
+            result.lines.append(msg)
+
+
 # --------------------------------------------------------------------------------------------------------
 class Command(BaseCommand):
     help = "Sync projects and memberUids in OpenLDAP (from Coldfront)"
@@ -101,8 +139,55 @@ class Command(BaseCommand):
             help="Skip projects with New or Active status in Coldfront",
             action="store_true",
         )
+        parser.add_argument(
+            "--snapshot",
+            help="Read all project posixGroups from OpenLDAP and all projects from Coldfront up front, instead of searching for each project",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            help="Number of threads checking projects with --all, more than 1 implies --snapshot",
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            "--chunk-size",
+            help="Number of projects given to a worker thread at a time",
+            type=int,
+            default=100,
+        )
+
+    def load_snapshot(self):
+        """Read every project posixGroup in the project and archive OUs with one paged search each, and every
+        project with its active members from Coldfront, for the local_ lookups to use instead of searching"""
+        self.snapshot = {}
+        for ou in (PROJECT_OPENLDAP_OU, PROJECT_OPENLDAP_ARCHIVE_OU):
+            if not ou:
+                continue
+            posixgroups = ldapsearch_get_posixgroups(ou)
+            if posixgroups is None:
+                raise CommandError(f"Could not read the project posixGroups in {ou} from OpenLDAP")
+            self.snapshot.update(posixgroups)
+
+        projects = Project.objects.filter(status__name__in=["New", "Active", "Archived"]).select_related("status", "pi")
+        self.snapshot_projects = {project.project_code.lower(): project for project in projects if project.project_code}
+
+        self.snapshot_members = defaultdict(list)
+        for project_pk, username in ProjectUser.objects.filter(
+            project__status__name__in=["New", "Active", "Archived"], status__name="Active"
+        ).values_list("project_id", "user__username"):
+            self.snapshot_members[project_pk].append(username)
+
+        logger.info(
+            "Loaded snapshot of %s OpenLDAP project posixGroups and %s Coldfront projects",
+            len(self.snapshot),
+            len(self.snapshot_projects),
+        )
 
     def local_get_project_by_code(self, project_group):
+        if self.snapshot is not None and project_group.lower() in self.snapshot_projects:
+            return self.snapshot_projects[project_group.lower()]
         try:
             return Project.objects.get(project_code__iexact=project_group)
         except Project.DoesNotExist:
@@ -233,7 +318,7 @@ class Command(BaseCommand):
 
         if project.status.name in ["New", "Active"]:
             # fetch current description from project_dn
-            fetched_description = ldapsearch_get_description(project_dn)
+            fetched_description = self.local_get_description(project_dn)
             if new_description == fetched_description:
                 self.stdout.write("Description is up-to-date.")
             if new_description != fetched_description:
@@ -248,7 +333,7 @@ class Command(BaseCommand):
 
         if project.status.name in ["Archived"]:
             # fetch current description from archive DN
-            fetched_description = ldapsearch_get_description(archive_dn)
+            fetched_description = self.local_get_description(archive_dn)
             if new_description == fetched_description:
                 self.stdout.write("Description is up-to-date.")
             if new_description != fetched_description:
@@ -268,13 +353,29 @@ class Command(BaseCommand):
 
     # get active users from the coldfront django project
     def local_get_cf_django_members(self, project_pk):
-        queryset = ProjectUser.objects.filter(project_id=project_pk, status__name="Active")
-        usernames = [
-            user.user.username for user in queryset if user.user.username not in PROJECT_OPENLDAP_EXCLUDE_USERS
-        ]
-        return tuple(usernames)
+        if self.snapshot is not None:
+            usernames = self.snapshot_members.get(project_pk, [])
+        else:
+            queryset = ProjectUser.objects.filter(project_id=project_pk, status__name="Active")
+            usernames = [user.user.username for user in queryset]
+        return tuple(username for username in usernames if username not in PROJECT_OPENLDAP_EXCLUDE_USERS)
+
+    def local_check_project_dn(self, dn):
+        if self.snapshot is not None:
+            return normalize_dn(dn) in self.snapshot
+        return ldapsearch_check_project_dn(dn)
+
+    def local_get_description(self, dn):
+        if self.snapshot is not None:
+            return self.snapshot.get(normalize_dn(dn), ((), None))[1]
+        return ldapsearch_get_description(dn)
 
     def local_get_openldap_members(self, dn):
+        if self.snapshot is not None:
+            if normalize_dn(dn) not in self.snapshot:
+                return
+            return self.snapshot[normalize_dn(dn)][0]
+
         entries = ldapsearch_get_posixgroup_memberuids(dn)
 
         if entries is None:
@@ -431,11 +532,11 @@ class Command(BaseCommand):
         self.stdout.write("")
 
         # does project exist in project OU
-        ldapsearch_project_result = ldapsearch_check_project_dn(project_dn)
+        ldapsearch_project_result = self.local_check_project_dn(project_dn)
         self.stdout.write(f"search project OU result: {ldapsearch_project_result}")
         # does project exist in archive OU
         if PROJECT_OPENLDAP_ARCHIVE_OU:
-            ldapsearch_project_result_archive = ldapsearch_check_project_dn(project_archive_dn)
+            ldapsearch_project_result_archive = self.local_check_project_dn(project_archive_dn)
             self.stdout.write(f"search project archive OU result: {ldapsearch_project_result_archive}")
         else:
             self.stdout.write("search project archive OU result: N/A - PROJECT_OPENLDAP_ARCHIVE_OU is not set")
@@ -554,6 +655,69 @@ class Command(BaseCommand):
             )
         # 5) -- END ---
 
+    def local_write_no_project_code(self, project):
+        # won't continue to process so self.stdout.write seperator here
+        self.stdout.write("--------------------")
+        self.stdout.write(f"Project with pk in Coldfront django {project.pk} - has no project_code")
+        self.stdout.write("NOT PROCESSING!")
+
+    def local_check_project_chunk(self, project_codes, *check_args):
+        """Check a chunk of projects in a worker thread, the output of each is kept in its result
+
+        Returns:
+            list[ProjectSyncResult]: the result of each project, in the order of project_codes
+        """
+        results = []
+        try:
+            for project_code in project_codes:
+                result = ProjectSyncResult(project_code)
+                self.stdout.local.result = result
+                try:
+                    self.sync_check_project(project_code, *check_args)
+                except Exception as e:
+                    result.error = e
+                    logger.error("Error checking project %s: %s", project_code, repr(e))
+                finally:
+                    self.stdout.local.result = None
+                results.append(result)
+        finally:
+            # the worker threads should only use the snapshot, close any database connection opened regardless
+            connections.close_all()
+        return results
+
+    def loop_all_projects_parallel(self, projects, *check_args):
+        """Check projects in chunks of chunk_size on workers threads, each borrowing its own OpenLDAP
+        connection from the pool. The output of each project is written in the same order as a serial run.
+        An error in one project doesn't stop the others being checked, the command fails after all are done."""
+        project_codes = []
+        for project in projects:
+            if project.project_code:
+                project_codes.append(project.project_code)
+            else:
+                self.local_write_no_project_code(project)
+
+        chunks = [project_codes[i : i + self.chunk_size] for i in range(0, len(project_codes), self.chunk_size)]
+
+        stdout = self.stdout
+        self.stdout = ProjectSyncOutput(stdout)
+        failed = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for results in executor.map(lambda chunk: self.local_check_project_chunk(chunk, *check_args), chunks):
+                    for result in results:
+                        for line in result.lines:
+                            stdout.write(line)
+                        if result.error is not None:
+                            stdout.write(f"ERROR checking project {result.project_code}: {result.error!r}")
+                            failed.append(result.project_code)
+        finally:
+            self.stdout = stdout
+
+        logger.info("Checked %s projects in %s chunks with %s workers", len(project_codes), len(chunks), self.workers)
+        if failed:
+            raise CommandError(f"Errors checking {len(failed)} projects: {', '.join(failed)}")
+        return True
+
     """ Main loop to loop every Coldfront django project pk """
 
     def loop_all_projects(
@@ -570,6 +734,16 @@ class Command(BaseCommand):
             self.stdout.write("No projects found by loop_all_projects - EXITING")
             return
 
+        if self.workers > 1:
+            return self.loop_all_projects_parallel(
+                projects,
+                sync,
+                write_to_archive,
+                update_description,
+                skip_archived,
+                skip_newactive,
+            )
+
         for project in projects:
             if hasattr(project, "project_code") and project.project_code:
                 project_code = project.project_code
@@ -582,10 +756,7 @@ class Command(BaseCommand):
                     skip_newactive,
                 )
             else:
-                # won't continue to process so self.stdout.write seperator here
-                self.stdout.write("--------------------")
-                self.stdout.write(f"Project with pk in Coldfront django {project.pk} - has no project_code")
-                self.stdout.write("NOT PROCESSING!")
+                self.local_write_no_project_code(project)
 
         return True
 
@@ -634,28 +805,48 @@ class Command(BaseCommand):
             self.all = True
             logger.warning("Syncing ALL OpenLDAP groups with ColdFront")
 
-        if self.filter_group:
-            self.sync_check_project(
-                self.filter_group,
-                self.sync,
-                self.write_archive,
-                self.update_description,
-                self.skip_archived,
-                self.skip_newactive,
-            )
+        self.workers = options["workers"]
+        self.chunk_size = options["chunk_size"]
+        if self.workers < 1 or self.chunk_size < 1:
+            raise CommandError("--workers and --chunk-size must be at least 1")
+        # keep a connection open for each worker
+        pool_size = connection_pool.size
+        connection_pool.size = max(pool_size, self.workers)
 
-        if self.all:
-            self.loop_all_projects(
-                self.sync,
-                self.write_archive,
-                self.update_description,
-                self.skip_archived,
-                self.skip_newactive,
-            )
+        try:
+            connection_pool.reset_stats()
 
-        if not self.filter_group and not self.all:
-            self.stdout.write("")
-            self.stdout.write(
-                "No action taken - no option was supplied for a specific project_group in OpenLDAP (-p) or to check all groups in OpenLDAP (-a)"
-            )
-            self.stdout.write("")
+            self.snapshot = None
+            if options["snapshot"] or self.workers > 1:
+                self.load_snapshot()
+
+            if self.filter_group:
+                self.sync_check_project(
+                    self.filter_group,
+                    self.sync,
+                    self.write_archive,
+                    self.update_description,
+                    self.skip_archived,
+                    self.skip_newactive,
+                )
+
+            if self.all:
+                self.loop_all_projects(
+                    self.sync,
+                    self.write_archive,
+                    self.update_description,
+                    self.skip_archived,
+                    self.skip_newactive,
+                )
+
+            if not self.filter_group and not self.all:
+                self.stdout.write("")
+                self.stdout.write(
+                    "No action taken - no option was supplied for a specific project_group in OpenLDAP (-p) or to check all groups in OpenLDAP (-a)"
+                )
+                self.stdout.write("")
+        finally:
+            stats = connection_pool.stats()
+            logger.info("OpenLDAP binds: %s operations: %s", stats["binds"], stats["operations"])
+            connection_pool.close()
+            connection_pool.size = pool_size
@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""In-memory stand-in for the OpenLDAP server used by the project_openldap plugin tests.
+
+Every connection made by OpenLDAPStub.connect shares the directory held by its ldap3 mock Server.
+"""
+
+from ldap3 import MOCK_SYNC, NONE, Connection, Server
+
+BIND_USER = "cn=admin,dc=example,dc=org"
+BIND_PASSWORD = "secret"
+PROJECT_OU = "ou=projects,dc=example,dc=org"
+ARCHIVE_OU = "ou=archive_projects,dc=example,dc=org"
+
+
+class OpenLDAPStub:
+    def __init__(self):
+        self.server = Server("openldap", get_info=NONE)
+        self.connections = []
+        conn = Connection(self.server, client_strategy=MOCK_SYNC)
+        conn.strategy.add_entry(BIND_USER, {"objectClass": ["person"], "cn": "admin", "userPassword": BIND_PASSWORD})
+        for ou in (PROJECT_OU, ARCHIVE_OU):
+            conn.strategy.add_entry(ou, {"objectClass": ["top", "organizationalUnit"], "ou": ou[3:].split(",")[0]})
+        conn.bind()
+        self.conn = conn
+
+    def connect(self):
+        conn = Connection(self.server, BIND_USER, BIND_PASSWORD, client_strategy=MOCK_SYNC, collect_usage=True)
+        conn.bind()
+        self.connections.append(conn)
+        return conn
+
+    def add_project(self, code, members=(), description="", gid=8000, ou=PROJECT_OU):
+        ou_dn = f"ou={code},{ou}"
+        self.conn.strategy.add_entry(
+            ou_dn, {"objectClass": ["top", "organizationalUnit"], "ou": code, "description": f"OU for project {code}"}
+        )
+        attributes = {"objectClass": ["posixGroup"], "cn": code, "gidNumber": gid, "description": description}
+        if members:
+            attributes["memberUid"] = list(members)
+        self.conn.strategy.add_entry(f"cn={code},{ou_dn}", attributes)
+
+    def entry(self, dn):
+        """
+        Returns:
+            dict: the attributes of the entry, or None if there is no entry with this dn
+        """
+        self.conn.search(dn, "(objectClass=*)", search_scope="BASE", attributes=["*"])
+        if not self.conn.entries:
+            return None
+        return self.conn.entries[0].entry_attributes_as_dict
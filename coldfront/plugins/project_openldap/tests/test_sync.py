@@ -0,0 +1,176 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import importlib
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from coldfront.config.env import ENV
+from coldfront.core.test_helpers.factories import (
+    ProjectFactory,
+    ProjectStatusChoiceFactory,
+    ProjectUserFactory,
+    ProjectUserStatusChoiceFactory,
+    UserFactory,
+)
+from coldfront.plugins.project_openldap.tests.openldap_stub import ARCHIVE_OU, PROJECT_OU, OpenLDAPStub
+
+PLUGIN_MODULE = "coldfront.plugins.project_openldap"
+
+SETTINGS = {
+    "PROJECT_OPENLDAP_OU": PROJECT_OU,
+    "PROJECT_OPENLDAP_ARCHIVE_OU": ARCHIVE_OU,
+    "PROJECT_OPENLDAP_REMOVE_PROJECT": True,
+    "PROJECT_OPENLDAP_GID_START": 8000,
+    "PROJECT_OPENLDAP_EXCLUDE_USERS": ("coldfront",),
+}
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_PROJECT_OPENLDAP", default=False), "Only run project_openldap tests if enabled")
+class ProjectOpenLDAPSyncTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        active = ProjectStatusChoiceFactory(name="Active")
+        archived = ProjectStatusChoiceFactory(name="Archived")
+        removed = ProjectUserStatusChoiceFactory(name="Removed")
+        jane = UserFactory(username="jane")
+
+        cls.projects = {}
+        for code, status in [
+            ("cds0001", active),
+            ("cds0002", active),
+            ("cds0003", archived),
+            ("cds0004", archived),
+        ]:
+            cls.projects[code] = ProjectFactory(project_code=code, status=status, pi=jane, title=f"Title {code}")
+            ProjectUserFactory(project=cls.projects[code], user=jane)
+
+        ProjectUserFactory(project=cls.projects["cds0001"], user=UserFactory(username="john"))
+        ProjectUserFactory(project=cls.projects["cds0001"], user=UserFactory(username="jim"), status=removed)
+        ProjectUserFactory(project=cls.projects["cds0001"], user=UserFactory(username="coldfront"))
+
+    def setUp(self):
+        from coldfront.plugins.project_openldap.utils import (
+            OpenLDAPConnectionPool,
+            construct_project_posixgroup_description,
+        )
+
+        for module in ("utils", "tasks", "management.commands.project_openldap_sync"):
+            module = importlib.import_module(f"{PLUGIN_MODULE}.{module}")
+            for name, value in SETTINGS.items():
+                if hasattr(module, name):
+                    patcher = patch.object(module, name, value)
+                    patcher.start()
+                    self.addCleanup(patcher.stop)
+
+        self.ldap = OpenLDAPStub()
+        self.pool = OpenLDAPConnectionPool(connect=self.ldap.connect)
+        patcher = patch(f"{PLUGIN_MODULE}.utils.connection_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(f"{PLUGIN_MODULE}.management.commands.project_openldap_sync.connection_pool", self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.ldap.add_project("cds0001", ["jane", "jim"], "out of date", gid=8001)
+        self.ldap.add_project(
+            "cds0003", ["jane"], construct_project_posixgroup_description(self.projects["cds0003"]), gid=8003
+        )
+        self.ldap.add_project(
+            "CDS0004", ["jane"], construct_project_posixgroup_description(self.projects["cds0004"]), ou=ARCHIVE_OU
+        )
+
+    def _sync(self, **options):
+        out = StringIO()
+        call_command("project_openldap_sync", all=True, stdout=out, **options)
+        return out.getvalue().splitlines()
+
+    def test_snapshot_matches_per_project(self):
+        """The snapshot reports the same differences as searching for each project, in fewer operations"""
+        lines = self._sync(updatedescription=True)
+        per_project = self.pool.stats()
+
+        self.assertEqual(self._sync(updatedescription=True, snapshot=True), lines)
+        self.assertLess(self.pool.stats()["operations"], per_project["operations"])
+
+        self.assertIn(
+            "Project DN for cds0002 is MISSING from OpenLDAP - SYNC is False - WILL NOT WRITE TO OpenLDAP", lines
+        )
+        self.assertIn(
+            f"ou=cds0003,{PROJECT_OU} <<< WARNING WE EXPECTED THIS TO BE ARCHIVED IN OPENLDAP - PROJECT_OPENLDAP_ARCHIVE_OU is set",
+            lines,
+        )
+        self.assertIn(" ('jim',)", lines)
+        self.assertIn(" ('john',)", lines)
+        self.assertIn("OLD openldap_description is      out of date", lines)
+        self.assertIn(f"Project cds0004 is an archived project - found cn=cds0004,ou=cds0004,{ARCHIVE_OU}", lines)
+
+    def test_snapshot_sync(self):
+        from coldfront.plugins.project_openldap.utils import construct_project_posixgroup_description
+
+        self._sync(sync=True, updatedescription=True, snapshot=True)
+
+        project_dn = f"cn=cds0001,ou=cds0001,{PROJECT_OU}"
+        self.assertEqual(sorted(self.ldap.entry(project_dn)["memberUid"]), ["jane", "john"])
+        self.assertEqual(
+            self.ldap.entry(project_dn)["description"],
+            [construct_project_posixgroup_description(self.projects["cds0001"])],
+        )
+        self.assertEqual(self.ldap.entry(f"cn=cds0002,ou=cds0002,{PROJECT_OU}")["memberUid"], ["jane"])
+
+        # only the snapshot searches are made
+        self.pool.reset_stats()
+        lines = self._sync(updatedescription=True, snapshot=True)
+        self.assertEqual(self.pool.stats()["operations"], 2)
+        self.assertNotIn("SYNC required to update OpenLDAP description", lines)
+
+    def test_snapshot_unreachable(self):
+        from django.core.management.base import CommandError
+
+        from coldfront.plugins.project_openldap.utils import OpenLDAPConnectionPool
+
+        with patch(f"{PLUGIN_MODULE}.utils.connection_pool", OpenLDAPConnectionPool(connect=lambda: None)):
+            with self.assertRaises(CommandError):
+                self._sync(snapshot=True)
+
+    def test_workers_match_serial(self):
+        """Checking projects in worker threads writes the same output, in the same order, as a serial run"""
+        lines = self._sync(updatedescription=True, snapshot=True)
+
+        self.assertEqual(self._sync(updatedescription=True, workers=3, chunk_size=1), lines)
+        self.assertEqual(self._sync(updatedescription=True, workers=2, chunk_size=3), lines)
+        self.assertLessEqual(len(self.ldap.connections), 3)
+
+    def test_workers_sync(self):
+        self._sync(sync=True, updatedescription=True, workers=2, chunk_size=1)
+
+        self.assertEqual(sorted(self.ldap.entry(f"cn=cds0001,ou=cds0001,{PROJECT_OU}")["memberUid"]), ["jane", "john"])
+        self.assertEqual(self.ldap.entry(f"cn=cds0002,ou=cds0002,{PROJECT_OU}")["memberUid"], ["jane"])
+        self.assertEqual(self.pool.size, 4)
+
+    def test_workers_error(self):
+        """An error checking one project doesn't stop the others"""
+        from django.core.management.base import CommandError
+
+        from coldfront.plugins.project_openldap.management.commands.project_openldap_sync import Command
+
+        sync_check_project = Command.sync_check_project
+
+        def fail_cds0002(command, project_group, *args):
+            if project_group == "cds0002":
+                raise CommandError
+            return sync_check_project(command, project_group, *args)
+
+        out = StringIO()
+        with patch.object(Command, "sync_check_project", fail_cds0002):
+            with self.assertRaisesMessage(CommandError, "Errors checking 1 projects: cds0002"):
+                call_command("project_openldap_sync", all=True, workers=2, chunk_size=1, stdout=out)
+
+        lines = out.getvalue().splitlines()
+        self.assertIn("ERROR checking project cds0002: CommandError()", lines)
+        self.assertIn(f"Project cds0004 is an archived project - found cn=cds0004,ou=cds0004,{ARCHIVE_OU}", lines)
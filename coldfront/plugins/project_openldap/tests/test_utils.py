@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase
+from ldap3.core.exceptions import LDAPSocketSendError
+
+from coldfront.config.env import ENV
+from coldfront.plugins.project_openldap.tests.openldap_stub import PROJECT_OU, OpenLDAPStub
+
+UTILS_MODULE = "coldfront.plugins.project_openldap.utils"
+
+PROJECT_DN = f"cn=cds0001,ou=cds0001,{PROJECT_OU}"
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_PROJECT_OPENLDAP", default=False), "Only run project_openldap tests if enabled")
+class OpenLDAPConnectionPoolTest(SimpleTestCase):
+    def setUp(self):
+        self.ldap = OpenLDAPStub()
+        self.ldap.add_project("cds0001", ["jane"], "PI: jane | TITLE: physics")
+
+    def pool(self, **kwargs):
+        from coldfront.plugins.project_openldap.utils import OpenLDAPConnectionPool
+
+        pool = OpenLDAPConnectionPool(connect=self.ldap.connect, **kwargs)
+        patcher = patch(f"{UTILS_MODULE}.connection_pool", pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return pool
+
+    def test_helpers_share_connection(self):
+        from coldfront.plugins.project_openldap import utils
+
+        pool = self.pool()
+        utils.add_members_to_openldap_posixgroup(PROJECT_DN, ["john", "jim"])
+        utils.remove_members_from_openldap_posixgroup(PROJECT_DN, ["jane"])
+        utils.update_posixgroup_description_in_openldap(PROJECT_DN, "PI: jane | TITLE: chemistry")
+        self.assertTrue(utils.ldapsearch_check_project_dn(PROJECT_DN))
+        entries = utils.ldapsearch_get_posixgroup_memberuids(PROJECT_DN)
+        description = utils.ldapsearch_get_description(PROJECT_DN)
+
+        self.assertEqual(entries[0].memberUid.values, ["john", "jim"])
+        self.assertEqual(description, "PI: jane | TITLE: chemistry")
+        self.assertEqual(len(self.ldap.connections), 1)
+        self.assertEqual(pool.stats(), {"binds": 1, "operations": 7})
+
+        pool.reset_stats()
+        utils.ldapsearch_check_ou(PROJECT_OU)
+        self.assertEqual(pool.stats(), {"binds": 0, "operations": 1})
+
+        pool.close()
+        self.assertTrue(self.ldap.connections[0].closed)
+        self.assertEqual(pool.stats(), {"binds": 0, "operations": 1})
+
+    def test_no_write(self):
+        from coldfront.plugins.project_openldap import utils
+
+        pool = self.pool()
+        utils.add_members_to_openldap_posixgroup(PROJECT_DN, ["john"], write=False)
+
+        self.assertEqual(self.ldap.entry(PROJECT_DN)["memberUid"], ["jane"])
+        self.assertEqual(pool.stats(), {"binds": 0, "operations": 0})
+
+    def test_lifetime(self):
+        from coldfront.plugins.project_openldap import utils
+
+        pool = self.pool(lifetime=0)
+        utils.ldapsearch_check_project_dn(PROJECT_DN)
+        utils.ldapsearch_check_project_dn(PROJECT_DN)
+
+        self.assertEqual(len(self.ldap.connections), 2)
+        self.assertTrue(self.ldap.connections[0].closed)
+        self.assertEqual(pool.stats(), {"binds": 2, "operations": 2})
+
+    def test_closed_connection_replaced(self):
+        pool = self.pool()
+        with pool.connection() as conn:
+            conn.unbind()
+        with pool.connection() as conn:
+            self.assertFalse(conn.closed)
+
+        self.assertEqual(len(self.ldap.connections), 2)
+
+    def test_dropped_connection_retried(self):
+        """A write on a connection the server dropped while it was idle is made again on a new connection"""
+        from coldfront.plugins.project_openldap import utils
+
+        pool = self.pool()
+        utils.ldapsearch_check_project_dn(PROJECT_DN)
+        dropped = self.ldap.connections[0]
+        dropped.modify = Mock(side_effect=LDAPSocketSendError("socket sending error[Errno 32] Broken pipe"))
+
+        utils.add_members_to_openldap_posixgroup(PROJECT_DN, ["john"])
+
+        self.assertEqual(self.ldap.entry(PROJECT_DN)["memberUid"], ["jane", "john"])
+        self.assertEqual(len(self.ldap.connections), 2)
+        self.assertEqual(pool.idle, [self.ldap.connections[1]])
+
+    def test_threads(self):
+        pool = self.pool(size=2)
+        barrier = threading.Barrier(4)
+
+        def borrow():
+            with pool.connection() as conn:
+                barrier.wait()
+                conn.search(PROJECT_DN, "(objectclass=posixGroup)")
+
+        threads = [threading.Thread(target=borrow) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.ldap.connections), 4)
+        self.assertEqual(len(pool.idle), 2)
+        self.assertEqual(pool.stats(), {"binds": 4, "operations": 4})
+
+    def test_unreachable(self):
+        from coldfront.plugins.project_openldap import utils
+        from coldfront.plugins.project_openldap.utils import OpenLDAPConnectionPool
+
+        with patch(f"{UTILS_MODULE}.connection_pool", OpenLDAPConnectionPool(connect=lambda: None)):
+            self.assertIsNone(utils.ldapsearch_check_project_dn(PROJECT_DN))
@@ -6,8 +6,14 @@
 
 import logging
 import textwrap
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 
 from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE, Connection, Server, Tls
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPInvalidDnError
+from ldap3.utils.dn import parse_dn
 
 from coldfront.core.utils.common import import_from_settings
 
@@ -27,6 +33,10 @@ PROJECT_OPENLDAP_ARCHIVE_OU = import_from_settings("PROJECT_OPENLDAP_ARCHIVE_OU"
 
 PROJECT_OPENLDAP_DESCRIPTION_TITLE_LENGTH = import_from_settings("PROJECT_OPENLDAP_DESCRIPTION_TITLE_LENGTH")
 
+PROJECT_OPENLDAP_POOL_SIZE = import_from_settings("PROJECT_OPENLDAP_POOL_SIZE", 4)
+PROJECT_OPENLDAP_POOL_LIFETIME = import_from_settings("PROJECT_OPENLDAP_POOL_LIFETIME", 300)
+PROJECT_OPENLDAP_PAGE_SIZE = import_from_settings("PROJECT_OPENLDAP_PAGE_SIZE", 1000)
+
 # provide a sensible default locally to stop the openldap description being too long
 MAX_OPENLDAP_DESCRIPTION_LENGTH = 250
 
@@ -53,62 +63,189 @@ logger = logging.getLogger(__name__)
 def openldap_connection(server_opt, bind_user, bind_password):
     """Open connection to OpenLDAP"""
     try:
-        connection = Connection(server_opt, bind_user, bind_password, auto_bind=True)
+        connection = Connection(server_opt, bind_user, bind_password, auto_bind=True, collect_usage=True)
         return connection
     except Exception as e:
         logger.error("Could not connect to OpenLDAP server: %s", e)
         return None
 
 
+class OpenLDAPConnectionPool:
+    """Bound OpenLDAP connections shared by the helpers in this module, so that the sync command and the
+    tasks reuse a connection instead of binding for every operation.
+
+    Up to size idle connections are kept, and a connection is bound again once it is older than lifetime
+    seconds or has been closed, e.g. after an error. run() also replaces a connection the server dropped. The
+    pool is thread safe, each thread borrows its own connection. The binds and operations made through the
+    pool are counted from the ldap3 usage statistics of its connections, see stats().
+    """
+
+    def __init__(self, connect=None, size=None, lifetime=None):
+        """
+        Params:
+            connect (callable): returns a new bound connection, or None if it could not connect
+            size (int): number of idle connections to keep
+            lifetime (float): seconds a connection is reused for before it is bound again
+        """
+        self.connect = connect or (
+            lambda: openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
+        )
+        self.size = size or PROJECT_OPENLDAP_POOL_SIZE
+        self.lifetime = PROJECT_OPENLDAP_POOL_LIFETIME if lifetime is None else lifetime
+        self.lock = threading.Lock()
+        self.idle = []
+        self.opened = {}
+        self.closed_usage = Counter()
+        self.baseline = Counter()
+
+    @staticmethod
+    def _usage(conn):
+        usage = getattr(conn, "usage", None)
+        if usage is None:
+            return Counter()
+        return Counter(
+            binds=usage.bind_operations,
+            operations=usage.operations - usage.bind_operations - usage.unbind_operations,
+        )
+
+    def _discard(self, conn):
+        self.closed_usage.update(self._usage(conn))
+        self.opened.pop(conn, None)
+        try:
+            if not conn.closed:
+                conn.unbind()
+        except Exception as exc_log:
+            logger.info(exc_log)
+
+    def _acquire(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if not conn.closed and time.monotonic() - self.opened[conn] < self.lifetime:
+                    return conn
+                self._discard(conn)
+
+        conn = self.connect()
+        if conn is not None:
+            with self.lock:
+                self.opened[conn] = time.monotonic()
+        return conn
+
+    def _release(self, conn):
+        with self.lock:
+            if conn.closed or len(self.idle) >= self.size:
+                self._discard(conn)
+            else:
+                self.idle.append(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a bound connection, None if the OpenLDAP server could not be reached"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                self._release(conn)
+
+    def run(self, operation):
+        """Call operation with a borrowed connection. A connection the server dropped while it was idle, e.g.
+        after its idletimeout, still looks open until it is used, so if the operation fails with a socket or
+        session error the connection is discarded and the operation is run again, once, on a new connection.
+
+        Params:
+            operation (callable): called with a bound connection
+
+        Returns:
+            the result of the operation, None if the OpenLDAP server could not be reached
+        """
+        for retry in (True, False):
+            conn = self._acquire()
+            if conn is None:
+                return None
+
+            try:
+                result = operation(conn)
+            except LDAPCommunicationError as exc_log:
+                with self.lock:
+                    self._discard(conn)
+                if not retry:
+                    raise
+                logger.info("Lost the OpenLDAP connection, retrying on a new one: %s", exc_log)
+                continue
+            except Exception:
+                self._release(conn)
+                raise
+
+            self._release(conn)
+            return result
+
+    def close(self):
+        """Unbind the idle connections"""
+        with self.lock:
+            while self.idle:
+                self._discard(self.idle.pop())
+
+    def _totals(self):
+        totals = Counter(self.closed_usage)
+        for conn in self.opened:
+            totals.update(self._usage(conn))
+        return totals
+
+    def reset_stats(self):
+        with self.lock:
+            self.baseline = self._totals()
+
+    def stats(self):
+        """
+        Returns:
+            dict: number of binds and of other operations made through the pool since reset_stats()
+        """
+        with self.lock:
+            totals = self._totals()
+            totals.subtract(self.baseline)
+        return {"binds": totals["binds"], "operations": totals["operations"]}
+
+
+connection_pool = OpenLDAPConnectionPool()
+
+
 def add_members_to_openldap_posixgroup(dn, list_memberuids, write=True):
     """Add members to a posixgroup in OpenLDAP"""
     member_uid = tuple(list_memberuids)
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
-    try:
+    def add_members(conn):
         for user in member_uid:
             add_username = user
             conn.modify(dn, {"memberUid": [(MODIFY_ADD, [add_username])]})
+
+    try:
+        connection_pool.run(add_members)
     except Exception as exc_log:
         logger.info(exc_log)
-    finally:
-        conn.unbind()
 
 
 def remove_members_from_openldap_posixgroup(dn, list_memberuids, write=True):
     """Remove members from a posixgroup in OpenLDAP"""
     member_uids_tuple = tuple(list_memberuids)
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
-    try:
+    def remove_members(conn):
         for user in member_uids_tuple:
             remove_username = user
             conn.modify(dn, {"memberUid": [(MODIFY_DELETE, [remove_username])]})
+
+    try:
+        connection_pool.run(remove_members)
     except Exception as exc_log:
         logger.info(exc_log)
-    finally:
-        conn.unbind()
 
 
 def add_per_project_ou_to_openldap(project_obj, dn, openldap_ou_description, write=True):
     """Add a per project OU to OpenLDAP - write an OU for a project"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
@@ -116,10 +253,12 @@ def add_per_project_ou_to_openldap(project_obj, dn, openldap_ou_description, wri
     try:
         project_code_str = project_obj.project_code
         ou = f"{project_code_str}"
-        conn.add(
-            dn,
-            ["top", "organizationalUnit"],
-            {"ou": ou, "description": openldap_ou_description},
+        connection_pool.run(
+            lambda conn: conn.add(
+                dn,
+                ["top", "organizationalUnit"],
+                {"ou": ou, "description": openldap_ou_description},
+            )
         )
     except Exception as exc_log:
         logger.error("Project OU: DN to write...")
@@ -127,25 +266,20 @@ def add_per_project_ou_to_openldap(project_obj, dn, openldap_ou_description, wri
         logger.error("Attributes to write...")
         logger.error(f"OU description - {openldap_ou_description}")
         logger.error(exc_log)
-    finally:
-        conn.unbind()
 
 
 def add_posixgroup_to_openldap(dn, openldap_description, gid_int, write=True):
     """Add a posixGroup to OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
     try:
-        conn.add(
-            dn,
-            "posixGroup",
-            {"description": openldap_description, "gidNumber": gid_int},
+        connection_pool.run(
+            lambda conn: conn.add(
+                dn,
+                "posixGroup",
+                {"description": openldap_description, "gidNumber": gid_int},
+            )
         )
     except Exception as exc_log:
         logger.error("Project posixgroup: DN to write...")
@@ -153,138 +287,140 @@ def add_posixgroup_to_openldap(dn, openldap_description, gid_int, write=True):
         logger.error("Attributes to write...")
         logger.error(f"posixGroup description - {openldap_description} gidNumber - {gid_int}")
         logger.error(exc_log)
-    finally:
-        conn.unbind()
 
 
 # Remove a DN - e.g. DELETE a project OU or posixgroup in OpenLDAP
 def remove_dn_from_openldap(dn, write=True):
     """Remove a DN from OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
     try:
-        conn.delete(dn)
+        connection_pool.run(lambda conn: conn.delete(dn))
     except Exception as exc_log:
         logger.info(exc_log)
-    finally:
-        conn.unbind()
 
 
 # Update the project title in OpenLDAP
 def update_posixgroup_description_in_openldap(dn, openldap_description, write=True):
     """Update the description of a posixGroup in OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
     try:
-        conn.modify(dn, {"description": [(MODIFY_REPLACE, [openldap_description])]})
+        connection_pool.run(lambda conn: conn.modify(dn, {"description": [(MODIFY_REPLACE, [openldap_description])]}))
     except Exception as exc_log:
         logger.info(exc_log)
-    finally:
-        conn.unbind()
 
 
 # MOVE the project to an archive OU - defined as env var
 def move_dn_in_openldap(current_dn, relative_dn, destination_ou, write=True):
     """Move a DN to another OU in OpenLDAP"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     if not write:
         return None
 
     try:
-        conn.modify_dn(current_dn, relative_dn, new_superior=destination_ou)
+        connection_pool.run(lambda conn: conn.modify_dn(current_dn, relative_dn, new_superior=destination_ou))
     except Exception as exc_log:
         logger.info(exc_log)
-    finally:
-        conn.unbind()
 
 
 def ldapsearch_check_project_dn(dn):
     """Check a distinguished name exists and represents a project (posixGroup)"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     try:
-        ldapsearch_check_project_dn_result = conn.search(dn, "(objectclass=posixGroup)")
+        ldapsearch_check_project_dn_result = connection_pool.run(
+            lambda conn: conn.search(dn, "(objectclass=posixGroup)")
+        )
         return ldapsearch_check_project_dn_result
     except Exception as exc_log:
         logger.info(exc_log)
         return None
-    finally:
-        conn.unbind()
 
 
 # check bind user can see the Project OU or Archive OU - is also used in system setup check script
 def ldapsearch_check_ou(OU):
     """Test that ldapsearch can see an OU"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
-
     try:
-        ldapsearch_check_project_ou_result = conn.search(OU, "(objectclass=organizationalUnit)")
+        ldapsearch_check_project_ou_result = connection_pool.run(
+            lambda conn: conn.search(OU, "(objectclass=organizationalUnit)")
+        )
         return ldapsearch_check_project_ou_result
     except Exception as exc_log:
         logger.info(exc_log)
         return None
-    finally:
-        conn.unbind()
 
 
 def ldapsearch_get_posixgroup_memberuids(dn):
     """Get memberUids from a posixGroup"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
 
-    try:
+    def get_memberuids(conn):
         conn.search(dn, "(objectclass=posixGroup)", attributes=["memberUid"])
         ldapsearch_project_memberuids_entries = conn.entries
         return ldapsearch_project_memberuids_entries
+
+    try:
+        return connection_pool.run(get_memberuids)
     except Exception as exc_log:
         logger.info(exc_log)
         return None
-    finally:
-        conn.unbind()
 
 
 def ldapsearch_get_description(dn):
     """Get description from an openldap entry"""
-    conn = openldap_connection(server, PROJECT_OPENLDAP_BIND_USER, PROJECT_OPENLDAP_BIND_PASSWORD)
-
-    if not conn:
-        return
 
-    try:
+    def get_description(conn):
         conn.search(dn, "(objectclass=posixGroup)", attributes=["description"])
         ldapsearch_project_description_entries = conn.entries
         # list with single entry, get description
         ldapsearch_project_description = ldapsearch_project_description_entries[0].description
         return ldapsearch_project_description
+
+    try:
+        return connection_pool.run(get_description)
     except Exception as exc_log:
         logger.info(exc_log)
         return None
-    finally:
-        conn.unbind()
+
+
+def ldapsearch_get_posixgroups(OU):
+    """Get the memberUids and description of every posixGroup under an OU, with a paged subtree search
+
+    Returns:
+        dict: normalized dn -> (tuple of memberUids, description), or None if the search failed
+    """
+
+    def get_posixgroups(conn):
+        entries = conn.extend.standard.paged_search(
+            OU,
+            "(objectclass=posixGroup)",
+            attributes=["memberUid", "description"],
+            paged_size=PROJECT_OPENLDAP_PAGE_SIZE,
+            generator=True,
+        )
+        posixgroups = {}
+        for entry in entries:
+            if entry.get("type") != "searchResEntry":
+                continue
+            attributes = entry["attributes"]
+            description = attributes.get("description") or None
+            if isinstance(description, list):
+                description = description[0] if description else None
+            posixgroups[normalize_dn(entry["dn"])] = (tuple(attributes.get("memberUid") or ()), description)
+        return posixgroups
+
+    try:
+        return connection_pool.run(get_posixgroups)
+    except Exception as exc_log:
+        logger.error(exc_log)
+        return None
+
+
+def normalize_dn(dn):
+    """Normalize a dn so it can be compared to one written differently, e.g. with other case or spacing"""
+    try:
+        return ",".join(f"{attr.strip().lower()}={value.strip().lower()}" for attr, value, _ in parse_dn(dn))
+    except LDAPInvalidDnError:
+        return dn.lower()
 
 
 """
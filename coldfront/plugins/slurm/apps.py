@@ -2,8 +2,18 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
+import importlib
+
 from django.apps import AppConfig
 
+from coldfront.core.utils.common import import_from_settings
+
+SLURM_ENABLE_SIGNALS = import_from_settings("SLURM_ENABLE_SIGNALS", False)
+
 
 class SlurmConfig(AppConfig):
     name = "coldfront.plugins.slurm"
+
+    def ready(self):
+        if SLURM_ENABLE_SIGNALS:
+            importlib.import_module("coldfront.plugins.slurm.signals")
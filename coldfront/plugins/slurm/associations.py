@@ -6,13 +6,14 @@ from __future__ import annotations
 import datetime
 import logging
 import os
-import re
 import sys
+from collections import deque
 from typing import Optional
 
+from django.db.models import Prefetch
 from django.db.models.query import QuerySet
 
-from coldfront.core.allocation.models import Allocation
+from coldfront.core.allocation.models import Allocation, AllocationAttribute, AllocationUser
 from coldfront.core.resource.models import Resource
 from coldfront.plugins.slurm.utils import (
     SLURM_ACCOUNT_ATTRIBUTE_NAME,
@@ -26,36 +27,134 @@ from coldfront.plugins.slurm.utils import (
 
 logger = logging.getLogger(__name__)
 
+SLURM_ALLOCATION_STATUSES = ["Active", "Renewal Requested"]
+SLURM_ALLOCATION_ATTRIBUTE_NAMES = [
+    SLURM_ACCOUNT_ATTRIBUTE_NAME,
+    SLURM_PARENT_ATTRIBUTE_NAME,
+    SLURM_SPECS_ATTRIBUTE_NAME,
+    SLURM_USER_SPECS_ATTRIBUTE_NAME,
+]
+
+
+def get_slurm_allocations(resources) -> dict[int, list[Allocation]]:
+    """Fetch the active allocations for a set of resources in bulk.
+
+    Each allocation is returned with its slurm attributes, active users and
+    resources prefetched so building the association tree does not issue any
+    per-allocation queries. The number of queries is fixed regardless of the
+    number of resources, allocations or users.
+
+    Returns:
+        dict: mapping of resource id to its allocations, ordered as in resource.allocation_set
+    """
+    resource_ids = [r.pk for r in resources]
+
+    links = Allocation.resources.through.objects.filter(
+        resource_id__in=resource_ids, allocation__status__name__in=SLURM_ALLOCATION_STATUSES
+    ).values_list("allocation_id", "resource_id")
+    allocation_resources = {}
+    for allocation_id, resource_id in links:
+        allocation_resources.setdefault(allocation_id, []).append(resource_id)
+
+    allocations = (
+        Allocation.objects.filter(resources__in=resource_ids, status__name__in=SLURM_ALLOCATION_STATUSES)
+        .distinct()
+        .order_by("end_date", "pk")
+        .prefetch_related(
+            "resources",
+            Prefetch(
+                "allocationattribute_set",
+                queryset=AllocationAttribute.objects.filter(
+                    allocation_attribute_type__name__in=SLURM_ALLOCATION_ATTRIBUTE_NAMES
+                )
+                .select_related("allocation_attribute_type__attribute_type")
+                .order_by("pk"),
+                to_attr="slurm_attributes",
+            ),
+            Prefetch(
+                "allocationuser_set",
+                queryset=AllocationUser.objects.filter(status__name="Active").select_related("user").order_by("pk"),
+                to_attr="slurm_active_users",
+            ),
+        )
+    )
+
+    allocations_by_resource = {resource_id: [] for resource_id in resource_ids}
+    for allocation in allocations:
+        for resource_id in allocation_resources.get(allocation.pk, []):
+            allocations_by_resource[resource_id].append(allocation)
+
+    return allocations_by_resource
+
+
+def _get_allocation_attribute_list(allocation: Allocation, name: str) -> list:
+    """Same as Allocation.get_attribute_list but uses the attributes prefetched by get_slurm_allocations"""
+    attributes = getattr(allocation, "slurm_attributes", None)
+    if attributes is None:
+        return allocation.get_attribute_list(name)
+    return [a.expanded_value() for a in attributes if a.allocation_attribute_type.name == name]
+
+
+def _get_allocation_attribute(allocation: Allocation, name: str):
+    """Same as Allocation.get_attribute but uses the attributes prefetched by get_slurm_allocations"""
+    attributes = getattr(allocation, "slurm_attributes", None)
+    if attributes is None:
+        return allocation.get_attribute(name)
+    for a in attributes:
+        if a.allocation_attribute_type.name == name:
+            return a.expanded_value()
+    return None
+
+
+def _get_active_allocation_users(allocation: Allocation) -> list[AllocationUser]:
+    """Active users of an allocation, using the users prefetched by get_slurm_allocations"""
+    allocation_users = getattr(allocation, "slurm_active_users", None)
+    if allocation_users is None:
+        return allocation.allocationuser_set.filter(status__name="Active").select_related("user")
+    return allocation_users
+
 
 class SlurmParserError(SlurmError):
     pass
 
 
+def _parse_sacctmgr_line(line, record_type):
+    """Split a line from sacctmgr dump into the record name and its list of specs. For example:
+    "User - 'jane':DefaultAccount='physics':Fairshare=Parent" -> ("jane", ["DefaultAccount='physics'", "Fairshare=Parent"])
+    """
+    parts = line.split(":")
+    name = parts[0][len(record_type) + 3 :].strip("\n'")
+    return name, parts[1:]
+
+
+def _is_sacctmgr_record(line, record_type):
+    """Check if a line from sacctmgr dump is a record of the given type with a quoted name, e.g. "Account - 'physics'" """
+    prefix = record_type + " - '"
+    return line.startswith(prefix) and line.find("'", len(prefix)) > len(prefix)
+
+
 class SlurmBase:
     def __init__(self, name, specs=None):
-        if specs is None:
-            specs = []
-
         self.name = name
-        self.specs = specs
+        # Ordered set of individual specs. Spec strings repeat across thousands of associations so they are interned.
+        self.specs: dict[str, None] = {}
+        if specs:
+            self.add_specs(specs)
+
+    def add_specs(self, specs):
+        """Add Slurm Specs. Each item can hold several colon separated specs"""
+        for s in specs:
+            for i in s.split(":"):
+                if i:
+                    self.specs[sys.intern(i)] = None
 
     def spec_list(self):
         """Return unique list of Slurm Specs"""
-        items = []
-        for s in self.specs:
-            for i in s.split(":"):
-                items.append(i)
-
-        return list(set(items))
+        return list(self.specs)
 
     def format_specs(self):
         """Format unique list of Slurm Specs"""
-        items = []
-        for s in self.specs:
-            for i in s.split(":"):
-                items.append(i)
-
-        return ":".join([x for x in self.spec_list()])
+        return ":".join(self.specs)
 
     def _write(self, out, data):
         try:
@@ -70,6 +169,8 @@ class SlurmCluster(SlurmBase):
     def __init__(self, name, specs=None):
         super().__init__(name, specs=specs)
         self.accounts: dict[str, SlurmAccount] = {}
+        # Index of every account in the tree by name, see get_account
+        self.account_index: dict[str, SlurmAccount] = {}
 
     @staticmethod
     def new_from_stream(stream):
@@ -80,16 +181,14 @@ class SlurmCluster(SlurmBase):
         no_cluster_error = SlurmParserError("Failed to parse Slurm cluster name. Is this in sacctmgr dump file format?")
         for line in stream:
             line = line.strip()
-            if re.match("^#", line):
+            if not line or line.startswith("#"):
                 continue
-            elif re.match("^Cluster - '[^']+'", line):
-                parts = line.split(":")
-                name = re.sub(r"^Cluster - ", "", parts[0]).strip("\n'")
+            elif _is_sacctmgr_record(line, "Cluster"):
+                name, specs = _parse_sacctmgr_line(line, "Cluster")
                 if len(name) == 0:
                     raise SlurmParserError(f"Cluster name not found for line: {line}")
-                cluster = SlurmCluster(name)
-                cluster.specs += parts[1:]
-            elif re.match("^Account - '[^']+'", line):
+                cluster = SlurmCluster(name, specs)
+            elif _is_sacctmgr_record(line, "Account"):
                 if not cluster or not cluster.name:
                     raise no_cluster_error
                 account = SlurmAccount.new_from_sacctmgr(line)
@@ -97,16 +196,20 @@ class SlurmCluster(SlurmBase):
                     cluster.accounts[account.name] = account
                 elif parent_account:
                     parent_account.add_account(account)
-            elif re.match("^Parent - '[^']+'", line):
+                else:
+                    continue
+                cluster.account_index.setdefault(account.name, account)
+            elif _is_sacctmgr_record(line, "Parent"):
                 if not cluster or not cluster.name:
                     raise no_cluster_error
-                parent = re.sub(r"^Parent - ", "", line).strip("\n'")
+                parent, _ = _parse_sacctmgr_line(line, "Parent")
                 if parent == "root":
                     cluster.accounts["root"] = SlurmAccount("root")
+                    cluster.account_index["root"] = cluster.accounts["root"]
                 if not parent:
                     raise SlurmParserError(f"Parent name not found for line: {line}")
                 parent_account = cluster.get_account(parent)
-            elif re.match("^User - '[^']+'", line):
+            elif _is_sacctmgr_record(line, "User"):
                 if not cluster or not cluster.name:
                     raise no_cluster_error
                 user = SlurmUser.new_from_sacctmgr(line)
@@ -120,8 +223,35 @@ class SlurmCluster(SlurmBase):
         return cluster
 
     @staticmethod
-    def new_from_resource(resource):
-        """Create a new SlurmCluster from a ColdFront Resource model."""
+    def new_from_resources(resources):
+        """Create a SlurmCluster for each of several ColdFront Resource models. The allocations of all the
+        resources and their partitions are fetched together with get_slurm_allocations.
+
+        Returns:
+            list[SlurmCluster]: clusters in the same order as resources
+        """
+        resources = list(resources)
+        children = {r.pk: [] for r in resources}
+        for child in Resource.objects.filter(parent_resource__in=resources, resource_type__name="Cluster Partition"):
+            children[child.parent_resource_id].append(child)
+
+        allocations_by_resource = get_slurm_allocations(resources + [c for cs in children.values() for c in cs])
+
+        return [
+            SlurmCluster.new_from_resource(r, children=children[r.pk], allocations_by_resource=allocations_by_resource)
+            for r in resources
+        ]
+
+    @staticmethod
+    def new_from_resource(resource, children=None, allocations_by_resource=None):
+        """Create a new SlurmCluster from a ColdFront Resource model.
+
+        Params:
+            resource (Resource): the cluster resource
+            children (list[Resource]): the "Cluster Partition" child resources, fetched if not given
+            allocations_by_resource (dict): allocations from get_slurm_allocations for the resource and its
+                children, fetched if not given
+        """
         name = resource.get_attribute(SLURM_CLUSTER_ATTRIBUTE_NAME)
         specs = resource.get_attribute_list(SLURM_SPECS_ATTRIBUTE_NAME)
         user_specs = resource.get_attribute_list(SLURM_USER_SPECS_ATTRIBUTE_NAME)
@@ -130,8 +260,15 @@ class SlurmCluster(SlurmBase):
 
         cluster = SlurmCluster(name, specs)
 
+        if children is None:
+            children = list(
+                Resource.objects.filter(parent_resource_id=resource.id, resource_type__name="Cluster Partition")
+            )
+        if allocations_by_resource is None:
+            allocations_by_resource = get_slurm_allocations([resource] + children)
+
         # Process allocations
-        allocations = resource.allocation_set.filter(status__name__in=["Active", "Renewal Requested"])
+        allocations = allocations_by_resource[resource.pk]
         for allocation in allocations:
             cluster.add_allocation(allocation, allocations, user_specs=user_specs)
         # assign child accounts to parents
@@ -153,11 +290,10 @@ class SlurmCluster(SlurmBase):
             del cluster.accounts[account_name]
 
         # Process child resources
-        children = Resource.objects.filter(parent_resource_id=resource.id, resource_type__name="Cluster Partition")
         for r in children:
             partition_specs = r.get_attribute_list(SLURM_SPECS_ATTRIBUTE_NAME)
             partition_user_specs = r.get_attribute_list(SLURM_USER_SPECS_ATTRIBUTE_NAME)
-            allocations = r.allocation_set.filter(status__name__in=["Active", "Renewal Requested"])
+            allocations = allocations_by_resource[r.pk]
             for allocation in allocations:
                 cluster.add_allocation(allocation, allocations, specs=partition_specs, user_specs=partition_user_specs)
             # remove child accounts cluster accounts
@@ -167,6 +303,8 @@ class SlurmCluster(SlurmBase):
             for account_name in child_accounts:
                 del cluster.accounts[account_name]
 
+        cluster.index_accounts()
+
         return cluster
 
     def add_allocation(self, allocation, res_allocations, specs=None, user_specs=None):
@@ -174,17 +312,31 @@ class SlurmCluster(SlurmBase):
             specs = []
 
         """Add accounts from a ColdFront Allocation model to SlurmCluster"""
-        name = allocation.get_attribute(SLURM_ACCOUNT_ATTRIBUTE_NAME)
+        name = _get_allocation_attribute(allocation, SLURM_ACCOUNT_ATTRIBUTE_NAME)
         if not name:
             name = "root"
 
         logger.debug("Adding allocation name=%s specs=%s user_specs=%s", name, specs, user_specs)
         account = self.accounts.get(name, SlurmAccount(name))
         account.add_allocation(allocation, res_allocations, user_specs=user_specs)
-        account.specs += specs
+        account.add_specs(specs)
         self.accounts[name] = account
 
+    def index_accounts(self):
+        """Rebuild the index of accounts by name from the account tree"""
+        self.account_index = {}
+        accounts = deque(self.accounts.values())
+        while accounts:
+            account = accounts.popleft()
+            self.account_index.setdefault(account.name, account)
+            accounts.extend(account.accounts.values())
+
     def get_account(self, account_name):
+        """Gets an account by name from anywhere in the account tree"""
+        account = self.account_index.get(account_name)
+        if account:
+            return account
+        # Fall back to walking the tree for accounts added after the index was built
         if account_name in self.accounts.keys():
             return self.accounts[account_name]
         for account in self.accounts.values():
@@ -236,22 +388,23 @@ class SlurmAccount(SlurmBase):
     def new_from_sacctmgr(line):
         """Create a new SlurmAccount by parsing a line from sacctmgr dump. For
         example: Account - 'physics':Description='physics group':Organization='cas':Fairshare=100"""
-        if not re.match("^Account - '[^']+'", line):
+        if not _is_sacctmgr_record(line, "Account"):
             raise SlurmParserError(f'Invalid format. Must start with "Account" for line: {line}')
 
-        parts = line.split(":")
-        name = re.sub(r"^Account - ", "", parts[0]).strip("\n'")
+        name, specs = _parse_sacctmgr_line(line, "Account")
         if len(name) == 0:
             raise SlurmParserError(f"Cluster name not found for line: {line}")
 
-        return SlurmAccount(name, specs=parts[1:])
+        return SlurmAccount(name, specs=specs)
 
-    def add_allocation(self, allocation: Allocation, res_allocations: QuerySet[Allocation], user_specs=None):
+    def add_allocation(
+        self, allocation: Allocation, res_allocations: QuerySet[Allocation] | list[Allocation], user_specs=None
+    ):
         """Add users from a ColdFront Allocation model to SlurmAccount"""
         if user_specs is None:
             user_specs = []
 
-        name = allocation.get_attribute(SLURM_ACCOUNT_ATTRIBUTE_NAME)
+        name = _get_allocation_attribute(allocation, SLURM_ACCOUNT_ATTRIBUTE_NAME)
         if not name:
             name = "root"
 
@@ -260,28 +413,28 @@ class SlurmAccount(SlurmBase):
                 f"Allocation {allocation} {SLURM_ACCOUNT_ATTRIBUTE_NAME} {name} does not match {self.name}"
             )
 
-        self.specs += allocation.get_attribute_list(SLURM_SPECS_ATTRIBUTE_NAME)
+        self.add_specs(_get_allocation_attribute_list(allocation, SLURM_SPECS_ATTRIBUTE_NAME))
 
-        self.parent_account_name = allocation.get_attribute(SLURM_PARENT_ATTRIBUTE_NAME)
+        self.parent_account_name = _get_allocation_attribute(allocation, SLURM_PARENT_ATTRIBUTE_NAME)
 
-        allocation_user_specs = allocation.get_attribute_list(SLURM_USER_SPECS_ATTRIBUTE_NAME)
-        for u in allocation.allocationuser_set.filter(status__name="Active"):
+        allocation_user_specs = _get_allocation_attribute_list(allocation, SLURM_USER_SPECS_ATTRIBUTE_NAME)
+        for u in _get_active_allocation_users(allocation):
             user = SlurmUser(u.user.username)
-            user.specs += allocation_user_specs
-            user.specs += user_specs
+            user.add_specs(allocation_user_specs)
+            user.add_specs(user_specs)
             self.add_user(user)
 
     def add_account(self, account: SlurmAccount) -> None:
         if account.name not in self.accounts:
             self.accounts[account.name] = account
             return
-        self.accounts[account.name].specs += account.specs
+        self.accounts[account.name].add_specs(account.specs)
 
     def add_user(self, user: SlurmUser) -> None:
         if user.name not in self.users:
             self.users[user.name] = user
             return
-        self.users[user.name].specs += user.specs
+        self.users[user.name].add_specs(user.specs)
 
     def get_account(self, account_name: str) -> Optional[SlurmAccount]:
         """Gets an account, traversing through child accounts"""
@@ -359,15 +512,14 @@ class SlurmUser(SlurmBase):
     def new_from_sacctmgr(line):
         """Create a new SlurmUser by parsing a line from sacctmgr dump. For
         example: User - 'jane':DefaultAccount='physics':Fairshare=Parent:QOS='general-compute'"""
-        if not re.match("^User - '[^']+'", line):
+        if not _is_sacctmgr_record(line, "User"):
             raise SlurmParserError(f'Invalid format. Must start with "User" for line: {line}')
 
-        parts = line.split(":")
-        name = re.sub(r"^User - ", "", parts[0]).strip("\n'")
+        name, specs = _parse_sacctmgr_line(line, "User")
         if len(name) == 0:
             raise SlurmParserError("User name not found for line: {line}")
 
-        return SlurmUser(name, specs=parts[1:])
+        return SlurmUser(name, specs=specs)
 
     def write(self, out):
         self._write(out, f"User - '{self.name}':{self.format_specs()}\n")
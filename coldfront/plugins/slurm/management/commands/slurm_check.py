@@ -4,28 +4,31 @@
 
 import logging
 import os
+import shlex
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management.base import BaseCommand
 
+from coldfront.core.attribute_expansion import expansion_context
 from coldfront.core.resource.models import ResourceAttribute
 from coldfront.core.utils.common import import_from_settings
 from coldfront.plugins.slurm.associations import SlurmCluster
+from coldfront.plugins.slurm.models import SlurmAssociationChange
 from coldfront.plugins.slurm.utils import (
     SLURM_CLUSTER_ATTRIBUTE_NAME,
+    SlurmBatch,
     SlurmError,
     parse_qos,
     slurm_dump_cluster,
-    slurm_remove_account,
-    slurm_remove_assoc,
-    slurm_remove_qos,
 )
 
 SLURM_IGNORE_USERS = import_from_settings("SLURM_IGNORE_USERS", [])
 SLURM_IGNORE_ACCOUNTS = import_from_settings("SLURM_IGNORE_ACCOUNTS", [])
 SLURM_IGNORE_CLUSTERS = import_from_settings("SLURM_IGNORE_CLUSTERS", [])
 SLURM_NOOP = import_from_settings("SLURM_NOOP", False)
+SLURM_DUMP_WORKERS = 4
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +46,23 @@ class Command(BaseCommand):
         parser.add_argument("-u", "--username", help="Check specific username")
         parser.add_argument("-a", "--account", help="Check specific account")
         parser.add_argument("-x", "--header", help="Include header in output", action="store_true")
+        parser.add_argument(
+            "--incremental",
+            help="Only check associations queued by allocation signals instead of the whole cluster",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--all-clusters",
+            help="Run sacctmgr dump for every Slurm cluster resource in ColdFront and check them all",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            help=f"Number of sacctmgr dump commands to run at once with --all-clusters. Defaults to {SLURM_DUMP_WORKERS}",
+            type=int,
+            default=SLURM_DUMP_WORKERS,
+        )
 
     def write(self, data):
         try:
@@ -82,18 +102,29 @@ class Command(BaseCommand):
 
         return False
 
+    def _queue(self, operation, row, failed_message, done_message, log=logger.error):
+        """Keep track of a Slurm operation queued in the batch. Its outcome is logged and its row written
+        once the batch has run."""
+        self.pending.append((operation, row, failed_message, done_message, log))
+        return operation
+
+    def run_batch(self):
+        """Run the queued Slurm operations and report the outcome of each one"""
+        self.batch.run()
+        for operation, row, failed_message, done_message, log in self.pending:
+            if operation.error:
+                logger.error(f"{failed_message}: {operation.error}")
+            else:
+                log(done_message)
+
+            self.write("\t".join(row))
+
+        self.pending = []
+
     def remove_user(self, user, account, cluster):
         if self._skip_user(user, account):
             return
 
-        if self.sync:
-            try:
-                slurm_remove_assoc(user, cluster, account, noop=self.noop)
-            except SlurmError as e:
-                logger.error(f"Failed removing Slurm association user {user} account {account} cluster {cluster}: {e}")
-            else:
-                logger.error(f"Removed Slurm association user {user} account {account} cluster {cluster} successfully")
-
         row = [
             user,
             account,
@@ -101,20 +132,21 @@ class Command(BaseCommand):
             "Remove",
         ]
 
-        self.write("\t".join(row))
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        return self._queue(
+            self.batch.remove_assoc(user, cluster, account),
+            row,
+            f"Failed removing Slurm association user {user} account {account} cluster {cluster}",
+            f"Removed Slurm association user {user} account {account} cluster {cluster} successfully",
+        )
 
     def remove_account(self, account, cluster):
         if self._skip_account(account):
             return
 
-        if self.sync:
-            try:
-                slurm_remove_account(cluster, account, noop=self.noop)
-            except SlurmError as e:
-                logger.error(f"Failed removing Slurm account {account} cluster {cluster}: {e}")
-            else:
-                logger.error(f"Removed Slurm account {account} cluster {cluster} successfully")
-
         row = [
             "",
             account,
@@ -122,28 +154,119 @@ class Command(BaseCommand):
             "Remove",
         ]
 
-        self.write("\t".join(row))
+        if not self.sync:
+            self.write("\t".join(row))
+            return
 
-    def remove_qos(self, user, account, cluster, qos):
+        return self._queue(
+            self.batch.remove_account(cluster, account),
+            row,
+            f"Failed removing Slurm account {account} cluster {cluster}",
+            f"Removed Slurm account {account} cluster {cluster} successfully",
+        )
+
+    def add_user(self, user, account, cluster, specs=None):
         if self._skip_user(user, account):
             return
 
-        if self.sync:
-            try:
-                slurm_remove_qos(user, cluster, account, qos, noop=self.noop)
-                pass
-            except SlurmError as e:
-                logger.error(
-                    f"Failed removing Slurm qos {qos} for user {user} account {account} cluster {cluster}: {e}"
-                )
-            else:
-                logger.error(
-                    f"Removed Slurm qos {qos} for user {user} account {account} cluster {cluster} successfully"
-                )
+        row = [
+            user,
+            account,
+            cluster,
+            "Add",
+        ]
+
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        return self._queue(
+            self.batch.add_assoc(user, cluster, account, specs=specs),
+            row,
+            f"Failed adding Slurm association user {user} account {account} cluster {cluster}",
+            f"Added Slurm association user {user} account {account} cluster {cluster} successfully",
+            log=logger.info,
+        )
+
+    def add_account(self, account, cluster, parent=None, specs=None):
+        if self._skip_account(account):
+            return
+
+        row = [
+            "",
+            account,
+            cluster,
+            "Add",
+        ]
+
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        specs = list(specs or [])
+        if parent:
+            specs.append(f"parent={shlex.quote(parent)}")
+
+        return self._queue(
+            self.batch.add_account(cluster, account, specs=specs),
+            row,
+            f"Failed adding Slurm account {account} cluster {cluster}",
+            f"Added Slurm account {account} cluster {cluster} successfully",
+            log=logger.info,
+        )
+
+    def modify_user(self, user, account, cluster, specs):
+        if self._skip_user(user, account):
+            return
+
+        row = [user, account, cluster, "Modify", " ".join(specs)]
+
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        return self._queue(
+            self.batch.modify_assoc(user, cluster, account, specs),
+            row,
+            f"Failed setting Slurm specs for user {user} account {account} cluster {cluster}",
+            f"Set Slurm specs for user {user} account {account} cluster {cluster} successfully",
+            log=logger.info,
+        )
+
+    def modify_account(self, account, cluster, specs):
+        if self._skip_account(account):
+            return
+
+        row = ["", account, cluster, "Modify", " ".join(specs)]
+
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        return self._queue(
+            self.batch.modify_account(cluster, account, specs),
+            row,
+            f"Failed setting Slurm specs for account {account} cluster {cluster}",
+            f"Set Slurm specs for account {account} cluster {cluster} successfully",
+            log=logger.info,
+        )
+
+    def remove_qos(self, user, account, cluster, qos):
+        if self._skip_user(user, account):
+            return
 
         row = [user, account, cluster, "Remove", qos]
 
-        self.write("\t".join(row))
+        if not self.sync:
+            self.write("\t".join(row))
+            return
+
+        return self._queue(
+            self.batch.remove_qos(user, cluster, account, qos),
+            row,
+            f"Failed removing Slurm qos {qos} for user {user} account {account} cluster {cluster}",
+            f"Removed Slurm qos {qos} for user {user} account {account} cluster {cluster} successfully",
+        )
 
     def _diff_qos(self, account_name, cluster_name, user_a, user_b):
         logger.debug(
@@ -189,6 +312,101 @@ class Command(BaseCommand):
             self.remove_user(cluster=slurm_cluster.name, **user_kwargs)
         for account_kwargs in objects_to_remove["accounts"]:
             self.remove_account(cluster=slurm_cluster.name, **account_kwargs)
+        self.run_batch()
+
+    def _coldfront_cluster(self, cluster_name):
+        try:
+            resource = ResourceAttribute.objects.get(
+                resource_attribute_type__name=SLURM_CLUSTER_ATTRIBUTE_NAME, value=cluster_name
+            ).resource
+        except ResourceAttribute.DoesNotExist:
+            logger.error(
+                f"No Slurm '{cluster_name}' cluster resource found in ColdFront using '{SLURM_CLUSTER_ATTRIBUTE_NAME}' attribute"
+            )
+            return None
+
+        with expansion_context():
+            return SlurmCluster.new_from_resource(resource)
+
+    def sync_queued_changes(self):
+        """Check the associations queued by the allocation signals against ColdFront and add, update or
+        remove them in Slurm. Only the queued (cluster, account, user) associations are checked. Associations
+        in ColdFront are added with their specs, and their specs are set again in case they already exist.
+        Changes are removed from the queue once they have been synced, failed changes and changes queued again
+        during the run are retried on the next run, and changes for ignored or unknown clusters are dropped."""
+        changes = SlurmAssociationChange.objects.all()
+        if self.filter_user:
+            changes = changes.filter(user=self.filter_user)
+        if self.filter_account:
+            changes = changes.filter(account=self.filter_account)
+
+        coldfront_clusters = {}
+        for cluster_name in set(changes.values_list("cluster", flat=True)):
+            if cluster_name in SLURM_IGNORE_CLUSTERS:
+                logger.warning(f"Ignoring cluster {cluster_name}")
+                continue
+            coldfront_cluster = self._coldfront_cluster(cluster_name)
+            if coldfront_cluster:
+                coldfront_clusters[cluster_name] = coldfront_cluster
+
+        account_changes = []
+        user_changes = []
+        dropped = []
+        for change in changes:
+            if change.cluster not in coldfront_clusters:
+                dropped.append(change)
+            elif change.user:
+                user_changes.append(change)
+            else:
+                account_changes.append(change)
+
+        def expected_account(change):
+            return coldfront_clusters[change.cluster].get_account(change.account)
+
+        # The batch adds accounts before their users and removes them after their users
+        operations = []
+        for change in account_changes:
+            account = expected_account(change)
+            if account:
+                parent = getattr(account, "parent_account_name", None)
+                specs = account.spec_list()
+                ops = [self.add_account(change.account, change.cluster, parent, specs=specs)]
+                if parent:
+                    specs = specs + [f"parent={shlex.quote(parent)}"]
+                if specs:
+                    ops.append(self.modify_account(change.account, change.cluster, specs))
+            else:
+                ops = [self.remove_account(change.account, change.cluster)]
+            operations.append((change, ops))
+
+        for change in user_changes:
+            account = expected_account(change)
+            if account and change.user in account.users:
+                specs = account.users[change.user].spec_list()
+                ops = [self.add_user(change.user, change.account, change.cluster, specs=specs)]
+                if specs:
+                    ops.append(self.modify_user(change.user, change.account, change.cluster, specs))
+            else:
+                ops = [self.remove_user(change.user, change.account, change.cluster)]
+            operations.append((change, ops))
+
+        self.run_batch()
+
+        if not self.sync or self.noop:
+            return
+
+        for change, ops in operations:
+            if all(operation is None or operation.error is None for operation in ops):
+                self._dequeue(change)
+
+        if dropped:
+            logger.warning(f"Dropping {len(dropped)} queued Slurm changes for ignored or unknown clusters")
+            for change in dropped:
+                self._dequeue(change)
+
+    def _dequeue(self, change):
+        # a change queued again since it was read has a newer modified time, and is left for the next run
+        SlurmAssociationChange.objects.filter(pk=change.pk, modified=change.modified).delete()
 
     def _cluster_from_dump(self, cluster):
         slurm_cluster = None
@@ -203,6 +421,39 @@ class Command(BaseCommand):
 
         return slurm_cluster
 
+    def check_all_clusters(self, workers):
+        """Check every available Slurm cluster resource in ColdFront. The clusters are dumped from Slurm
+        concurrently while the ColdFront side of all the clusters is built from one set of queries."""
+        resources = []
+        cluster_names = []
+        for attr in ResourceAttribute.objects.filter(
+            resource_attribute_type__name=SLURM_CLUSTER_ATTRIBUTE_NAME
+        ).select_related("resource"):
+            if attr.value in SLURM_IGNORE_CLUSTERS:
+                logger.warning(f"Ignoring cluster {attr.value}")
+                continue
+            if not attr.resource.is_available:
+                continue
+            resources.append(attr.resource)
+            cluster_names.append(attr.value)
+
+        if not resources:
+            logger.warning("No Slurm cluster resources found in ColdFront. Nothing to do.")
+            return
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            dumps = executor.map(self._cluster_from_dump, cluster_names)
+            with expansion_context():
+                coldfront_clusters = SlurmCluster.new_from_resources(resources)
+            slurm_clusters = list(dumps)
+
+        for cluster_name, slurm_cluster, coldfront_cluster in zip(cluster_names, slurm_clusters, coldfront_clusters):
+            if not slurm_cluster:
+                logger.error(f"Failed to import existing Slurm associations for cluster {cluster_name}")
+                continue
+
+            self.check_consistency(slurm_cluster, coldfront_cluster)
+
     def handle(self, *args, **options):
         verbosity = int(options["verbosity"])
         root_logger = logging.getLogger("")
@@ -225,6 +476,32 @@ class Command(BaseCommand):
             self.noop = True
             logger.warning("NOOP enabled")
 
+        self.batch = SlurmBatch(noop=self.noop)
+        self.pending = []
+
+        self.filter_user = options["username"]
+        self.filter_account = options["account"]
+
+        header = [
+            "username",
+            "account",
+            "cluster",
+            "slurm_action",
+            "slurm_specs",
+        ]
+
+        if options["incremental"]:
+            if options["header"]:
+                self.write("\t".join(header))
+            self.sync_queued_changes()
+            return
+
+        if options["all_clusters"]:
+            if options["header"]:
+                self.write("\t".join(header))
+            self.check_all_clusters(options["workers"])
+            return
+
         if options["cluster"]:
             slurm_cluster = self._cluster_from_dump(options["cluster"])
         elif options["input"]:
@@ -251,20 +528,10 @@ class Command(BaseCommand):
             )
             sys.exit(1)
 
-        header = [
-            "username",
-            "account",
-            "cluster",
-            "slurm_action",
-            "slurm_specs",
-        ]
-
         if options["header"]:
             self.write("\t".join(header))
 
-        self.filter_user = options["username"]
-        self.filter_account = options["account"]
-
-        coldfront_cluster = SlurmCluster.new_from_resource(resource)
+        with expansion_context():
+            coldfront_cluster = SlurmCluster.new_from_resource(resource)
 
         self.check_consistency(slurm_cluster, coldfront_cluster)
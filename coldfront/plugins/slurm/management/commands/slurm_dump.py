@@ -7,6 +7,7 @@ import os
 
 from django.core.management.base import BaseCommand
 
+from coldfront.core.attribute_expansion import expansion_context
 from coldfront.core.resource.models import ResourceAttribute
 from coldfront.plugins.slurm.associations import SlurmCluster
 from coldfront.plugins.slurm.utils import SLURM_CLUSTER_ATTRIBUTE_NAME
@@ -41,17 +42,18 @@ class Command(BaseCommand):
 
             logger.warning("Writing output to directory: %s", out_dir)
 
-        for attr in ResourceAttribute.objects.filter(resource_attribute_type__name=SLURM_CLUSTER_ATTRIBUTE_NAME):
-            if options["cluster"] and options["cluster"] != attr.value:
-                continue
+        with expansion_context():
+            for attr in ResourceAttribute.objects.filter(resource_attribute_type__name=SLURM_CLUSTER_ATTRIBUTE_NAME):
+                if options["cluster"] and options["cluster"] != attr.value:
+                    continue
 
-            if not attr.resource.is_available:
-                continue
+                if not attr.resource.is_available:
+                    continue
 
-            cluster = SlurmCluster.new_from_resource(attr.resource)
-            if not out_dir:
-                cluster.write(self.stdout)
-                continue
+                cluster = SlurmCluster.new_from_resource(attr.resource)
+                if not out_dir:
+                    cluster.write(self.stdout)
+                    continue
 
-            with open(os.path.join(out_dir, f"{cluster.name}.cfg"), "w") as fh:
-                cluster.write(fh)
+                with open(os.path.join(out_dir, f"{cluster.name}.cfg"), "w") as fh:
+                    cluster.write(fh)
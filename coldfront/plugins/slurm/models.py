@@ -0,0 +1,30 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.db import models
+from model_utils.models import TimeStampedModel
+
+
+class SlurmAssociationChange(TimeStampedModel):
+    """A Slurm association changed in ColdFront and is waiting to be synced to Slurm. Changes are recorded
+    by the allocation signals and replayed with slurm_check --incremental.
+
+    Attributes:
+        cluster (str): name of the Slurm cluster
+        account (str): name of the Slurm account
+        user (str): username of the Slurm user, or empty if the change is for the account itself
+    """
+
+    class Meta:
+        ordering = [
+            "created",
+        ]
+        unique_together = ("cluster", "account", "user")
+
+    cluster = models.CharField(max_length=128)
+    account = models.CharField(max_length=128)
+    user = models.CharField(max_length=150, blank=True)
+
+    def __str__(self):
+        return "%s/%s/%s" % (self.cluster, self.account, self.user)
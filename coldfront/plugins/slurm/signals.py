@@ -0,0 +1,33 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from django.dispatch import receiver
+
+from coldfront.core.allocation.signals import (
+    allocation_activate_user,
+    allocation_attribute_changed,
+    allocation_disable,
+    allocation_disable_batch,
+    allocation_remove_user,
+)
+from coldfront.plugins.slurm.tasks import queue_allocation, queue_allocation_user, queue_allocations
+
+
+@receiver(allocation_activate_user)
+@receiver(allocation_remove_user)
+def allocation_user_changed(sender, **kwargs):
+    allocation_user_pk = kwargs.get("allocation_user_pk")
+    queue_allocation_user(allocation_user_pk)
+
+
+@receiver(allocation_disable)
+@receiver(allocation_attribute_changed)
+def allocation_changed(sender, **kwargs):
+    allocation_pk = kwargs.get("allocation_pk")
+    queue_allocation(allocation_pk)
+
+
+@receiver(allocation_disable_batch)
+def allocations_changed(sender, **kwargs):
+    queue_allocations(kwargs.get("allocation_pks", []))
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+
+from django.db.models import Prefetch
+
+from coldfront.core.allocation.models import Allocation, AllocationAttribute, AllocationUser
+from coldfront.core.resource.models import Resource, ResourceAttribute
+from coldfront.plugins.slurm.models import SlurmAssociationChange
+from coldfront.plugins.slurm.utils import SLURM_ACCOUNT_ATTRIBUTE_NAME, SLURM_CLUSTER_ATTRIBUTE_NAME
+
+logger = logging.getLogger(__name__)
+
+
+def _cluster_name(resource):
+    attributes = getattr(resource, "slurm_cluster_attributes", None)
+    if attributes is None:
+        return resource.get_attribute(SLURM_CLUSTER_ATTRIBUTE_NAME)
+    return attributes[0].expanded_value() if attributes else None
+
+
+def get_allocation_clusters(allocation, resources=None):
+    """Returns the names of the Slurm clusters an allocation maps to. Resources without a slurm_cluster
+    attribute (e.g. partitions) use the cluster of their parent resource.
+
+    Params:
+        allocation (Allocation): allocation to find the clusters of
+        resources (list[Resource]): resources of the allocation, with their parent resource and, as in
+            queue_allocations, their slurm_cluster attributes prefetched. Queried if None
+    """
+    if resources is None:
+        resources = allocation.resources.select_related("parent_resource")
+
+    clusters = set()
+    for resource in resources:
+        for r in [resource, resource.parent_resource]:
+            if r is None:
+                continue
+            name = _cluster_name(r)
+            if name:
+                clusters.add(name)
+                break
+
+    return clusters
+
+
+def _queue_changes(account, clusters, usernames, include_account):
+    users = list(usernames)
+    if include_account:
+        users.append("")
+
+    for cluster in clusters:
+        for user in users:
+            # touches a change that is already queued, so a sync running meanwhile keeps it for its next run
+            SlurmAssociationChange.objects.update_or_create(cluster=cluster, account=account, user=user)
+            logger.info("Queued Slurm association change cluster=%s account=%s user=%s", cluster, account, user)
+
+
+def queue_association_changes(allocation, usernames, include_account=True):
+    """Record the Slurm associations of an allocation that need to be synced to Slurm.
+
+    Params:
+        allocation (Allocation): allocation that changed
+        usernames (list[str]): users of the allocation whose associations changed
+        include_account (bool): whether or not to also record a change for the Slurm account itself
+    """
+    account = allocation.get_attribute(SLURM_ACCOUNT_ATTRIBUTE_NAME)
+    if not account:
+        logger.debug("Allocation %s has no %s. Nothing to queue", allocation.pk, SLURM_ACCOUNT_ATTRIBUTE_NAME)
+        return
+
+    _queue_changes(account, get_allocation_clusters(allocation), usernames, include_account)
+
+
+def queue_allocation_user(allocation_user_pk):
+    allocation_user = AllocationUser.objects.select_related("allocation", "user").get(pk=allocation_user_pk)
+    queue_association_changes(allocation_user.allocation, [allocation_user.user.username])
+
+
+def queue_allocation(allocation_pk):
+    allocation = Allocation.objects.get(pk=allocation_pk)
+    usernames = allocation.allocationuser_set.values_list("user__username", flat=True)
+    queue_association_changes(allocation, usernames)
+
+
+def queue_allocations(allocation_pks):
+    """Record the Slurm associations of many allocations, e.g. a batch expired at once. Their users, Slurm
+    accounts and clusters are found with a fixed number of queries rather than a few per allocation."""
+
+    def cluster_attributes(lookup):
+        return Prefetch(
+            lookup,
+            queryset=ResourceAttribute.objects.filter(resource_attribute_type__name=SLURM_CLUSTER_ATTRIBUTE_NAME)
+            .select_related("resource_attribute_type__attribute_type")
+            .order_by("pk"),
+            to_attr="slurm_cluster_attributes",
+        )
+
+    allocations = Allocation.objects.filter(pk__in=allocation_pks).prefetch_related(
+        "allocationuser_set__user",
+        Prefetch(
+            "allocationattribute_set",
+            queryset=AllocationAttribute.objects.filter(allocation_attribute_type__name=SLURM_ACCOUNT_ATTRIBUTE_NAME)
+            .select_related("allocation_attribute_type__attribute_type")
+            .order_by("pk"),
+            to_attr="slurm_account_attributes",
+        ),
+        Prefetch(
+            "resources",
+            queryset=Resource.objects.select_related("parent_resource").prefetch_related(
+                cluster_attributes("resourceattribute_set"),
+                cluster_attributes("parent_resource__resourceattribute_set"),
+            ),
+        ),
+    )
+    for allocation in allocations:
+        # the first attribute, as returned by Allocation.get_attribute
+        attributes = allocation.slurm_account_attributes
+        account = attributes[0].expanded_value() if attributes else None
+        if not account:
+            logger.debug("Allocation %s has no %s. Nothing to queue", allocation.pk, SLURM_ACCOUNT_ATTRIBUTE_NAME)
+            continue
+
+        usernames = [allocation_user.user.username for allocation_user in allocation.allocationuser_set.all()]
+        clusters = get_allocation_clusters(allocation, resources=allocation.resources.all())
+        _queue_changes(account, clusters, usernames, include_account=True)
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""Stand-in for sacctmgr used by the Slurm plugin tests.
+
+Every invocation is appended as a JSON list of arguments to the file named by FAKE_SACCTMGR_LOG. The Slurm
+state is read from the JSON file named by FAKE_SACCTMGR_STATE:
+
+    {
+        "associations": [["user", "account"], ...],
+        "defaults": {"user": "account"},
+        "fail": ["name of a user or account whose commands fail"]
+    }
+"""
+
+import json
+import os
+import sys
+
+
+def main(argv):
+    with open(os.environ["FAKE_SACCTMGR_LOG"], "a") as fh:
+        fh.write(json.dumps(argv) + "\n")
+
+    with open(os.environ["FAKE_SACCTMGR_STATE"]) as fh:
+        state = json.load(fh)
+
+    args = [a for a in argv if not a.startswith("-")]
+    verb, entity = args[0], args[1]
+    params = {}
+    for arg in args[2:]:
+        key, _, value = arg.partition("=")
+        params[key.lower()] = value
+    names = params.get("user", params.get("name", "")).split(",")
+
+    if verb == "show":
+        for name in names:
+            if name in state["defaults"]:
+                print(f"{name}|{state['defaults'][name]}")
+        return 0
+
+    if verb == "list":
+        for user, account in state["associations"]:
+            if user in names:
+                print(f"{user}|{account}")
+        return 0
+
+    failed = [n for n in names if n in state["fail"]]
+    if failed:
+        print(f" Problem with {','.join(failed)}", file=sys.stderr)
+        return 1
+
+    if verb == "delete" and entity == "user":
+        removed = [[u, a] for u, a in state["associations"] if u in names and a == params.get("account")]
+        if not removed:
+            print(" Nothing deleted")
+            return 1
+        state["associations"] = [assoc for assoc in state["associations"] if assoc not in removed]
+        with open(os.environ["FAKE_SACCTMGR_STATE"], "w") as fh:
+            json.dump(state, fh)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,157 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from coldfront.config.env import ENV
+from coldfront.core.allocation.models import AllocationStatusChoice, AllocationUserStatusChoice
+from coldfront.core.resource.models import ResourceAttribute, ResourceAttributeType, ResourceType
+from coldfront.core.test_helpers.factories import (
+    AAttributeTypeFactory,
+    AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationFactory,
+    AllocationUserFactory,
+    ProjectFactory,
+    ResourceFactory,
+    UserFactory,
+)
+from coldfront.plugins.slurm.associations import SlurmCluster
+from coldfront.plugins.slurm.tests.test_batch import fake_sacctmgr
+from coldfront.plugins.slurm.utils import SlurmError
+
+COMMAND_MODULE = "coldfront.plugins.slurm.management.commands.slurm_check"
+
+SLURM_DUMPS = {
+    "alpha": """Cluster - 'alpha'
+Parent - 'root'
+User - 'root':DefaultAccount='root'
+Account - 'physics'
+Parent - 'physics'
+User - 'jane'
+User - 'bob'
+""",
+    "beta": """Cluster - 'beta'
+Parent - 'root'
+User - 'root':DefaultAccount='root'
+Account - 'chem'
+""",
+}
+
+
+def fake_slurm_dump_cluster(cluster, fname, noop=False):
+    if cluster not in SLURM_DUMPS:
+        raise SlurmError(f"Unknown cluster {cluster}")
+
+    with open(fname, "w") as fh:
+        fh.write(SLURM_DUMPS[cluster])
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_SLURM", default=False), "Only run slurm_check tests if enabled")
+class AllClustersCheckTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        call_command("add_default_project_choices")
+        call_command("add_allocation_defaults")
+        call_command("add_resource_defaults")
+
+        super().setUpClass()
+
+    @classmethod
+    def _cluster_resource(cls, name, **kwargs):
+        resource = ResourceFactory(resource_type=ResourceType.objects.get(name="Cluster"), **kwargs)
+        ResourceAttribute.objects.create(
+            resource=resource,
+            resource_attribute_type=ResourceAttributeType.objects.get(name="slurm_cluster"),
+            value=name,
+        )
+        return resource
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alpha = cls._cluster_resource("alpha")
+        cls.beta = cls._cluster_resource("beta")
+        cls._cluster_resource("retired", is_available=False)
+
+        allocation = AllocationFactory(
+            project=ProjectFactory(), status=AllocationStatusChoice.objects.get(name="Active")
+        )
+        allocation.resources.add(cls.alpha)
+        AllocationAttributeFactory(
+            allocation=allocation,
+            value="physics",
+            allocation_attribute_type=AllocationAttributeTypeFactory(
+                name="slurm_account_name", attribute_type=AAttributeTypeFactory(name="Text")
+            ),
+        )
+        AllocationUserFactory(
+            allocation=allocation,
+            user=UserFactory(username="jane"),
+            status=AllocationUserStatusChoice.objects.get(name="Active"),
+        )
+
+    def _slurm_check(self, **options):
+        out = StringIO()
+        with patch(f"{COMMAND_MODULE}.slurm_dump_cluster", side_effect=fake_slurm_dump_cluster) as dump:
+            call_command("slurm_check", all_clusters=True, stdout=out, **options)
+        return dump, out.getvalue().splitlines()
+
+    def test_all_clusters(self):
+        """Every available cluster is dumped and checked against ColdFront"""
+        dump, rows = self._slurm_check()
+
+        self.assertCountEqual([call.args[0] for call in dump.call_args_list], ["alpha", "beta"])
+        self.assertEqual(rows, ["bob\tphysics\talpha\tRemove", "\tchem\tbeta\tRemove"])
+
+    def test_all_clusters_dump_failure(self):
+        """A cluster that fails to dump does not stop the other clusters from being checked"""
+        self._cluster_resource("gamma")
+
+        _, rows = self._slurm_check(workers=1)
+
+        self.assertEqual(rows, ["bob\tphysics\talpha\tRemove", "\tchem\tbeta\tRemove"])
+
+    def test_new_from_resources(self):
+        """Building several clusters at once matches building them one at a time"""
+        for bulk, resource in zip(SlurmCluster.new_from_resources([self.alpha, self.beta]), [self.alpha, self.beta]):
+            single = SlurmCluster.new_from_resource(resource)
+            bulk_out, single_out = StringIO(), StringIO()
+            bulk.write(bulk_out)
+            single.write(single_out)
+            self.assertEqual(bulk_out.getvalue(), single_out.getvalue())
+
+    def test_all_clusters_sync(self):
+        """Each cluster's changes are run once, not again with the next cluster's"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        log = os.path.join(tmpdir.name, "log")
+        state = os.path.join(tmpdir.name, "state.json")
+        with open(state, "w") as fh:
+            json.dump({"associations": [["bob", "physics"]], "defaults": {}, "fail": []}, fh)
+
+        with (
+            patch.dict(os.environ, {"FAKE_SACCTMGR_LOG": log, "FAKE_SACCTMGR_STATE": state}),
+            fake_sacctmgr(),
+            patch(f"{COMMAND_MODULE}.SLURM_NOOP", False),
+        ):
+            _, rows = self._slurm_check(sync=True, workers=1)
+
+        with open(log) as fh:
+            commands = [json.loads(line) for line in fh]
+        self.assertEqual(rows, ["bob\tphysics\talpha\tRemove", "\tchem\tbeta\tRemove"])
+        self.assertEqual(
+            [command for command in commands if "delete" in command],
+            [
+                ["-Q", "-i", "delete", "user", "where", "name=bob", "cluster=alpha", "account=physics"],
+                ["-Q", "-i", "delete", "account", "where", "name=chem", "cluster=beta"],
+            ],
+        )
@@ -0,0 +1,143 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import os
+import sys
+import tempfile
+from contextlib import ExitStack, contextmanager
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from coldfront.plugins.slurm import utils as slurm_utils
+from coldfront.plugins.slurm.utils import SlurmBatch
+
+FAKE_SACCTMGR = f"{sys.executable} {os.path.join(os.path.dirname(__file__), 'fake_sacctmgr.py')}"
+
+
+@contextmanager
+def fake_sacctmgr():
+    """Run the fake sacctmgr instead of SLURM_SACCTMGR_PATH, by patching the SLURM_CMD_* command templates"""
+    with ExitStack() as stack:
+        for name in dir(slurm_utils):
+            if name.startswith("SLURM_CMD_"):
+                template = getattr(slurm_utils, name).replace(slurm_utils.SLURM_SACCTMGR_PATH, FAKE_SACCTMGR, 1)
+                stack.enter_context(patch.object(slurm_utils, name, template))
+        yield
+
+
+class SlurmBatchTest(SimpleTestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.log = os.path.join(tmpdir.name, "log")
+        self.state = os.path.join(tmpdir.name, "state.json")
+        self.set_state(
+            associations=[["u1", "a1"], ["u2", "a1"], ["u2", "a2"], ["u3", "a1"]],
+            defaults={"u1": "a2", "u2": "a1", "u3": "a2"},
+        )
+        env = patch.dict(os.environ, {"FAKE_SACCTMGR_LOG": self.log, "FAKE_SACCTMGR_STATE": self.state})
+        env.start()
+        self.addCleanup(env.stop)
+        sacctmgr = fake_sacctmgr()
+        sacctmgr.__enter__()
+        self.addCleanup(sacctmgr.__exit__, None, None, None)
+
+    def set_state(self, associations, defaults, fail=None):
+        with open(self.state, "w") as fh:
+            json.dump({"associations": associations, "defaults": defaults, "fail": fail or []}, fh)
+
+    def commands(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_remove_users_in_one_command(self):
+        batch = SlurmBatch()
+        batch.remove_assoc("u1", "c1", "a1")
+        batch.remove_assoc("u3", "c1", "a1")
+        operations = batch.run()
+
+        self.assertEqual([op.error for op in operations], [None, None])
+        self.assertEqual(
+            self.commands(),
+            [
+                ["show", "user", "User=u1,u3", "Cluster=c1", "Format=User,DefaultAccount", "-Pn"],
+                ["-Q", "-i", "delete", "user", "where", "name=u1,u3", "cluster=c1", "account=a1"],
+            ],
+        )
+
+    def test_remove_user_changes_default_account(self):
+        batch = SlurmBatch()
+        batch.remove_assoc("u1", "c1", "a1")
+        batch.remove_assoc("u2", "c1", "a1")
+        batch.run()
+
+        commands = self.commands()
+        self.assertEqual(len(commands), 4)
+        self.assertEqual(commands[1], ["list", "associations", "User=u2", "Cluster=c1", "Format=User,Account", "-Pn"])
+        self.assertEqual(
+            commands[2], ["-Q", "-i", "modify", "user", "User=u2", "where", "Cluster=c1", "set", "DefaultAccount=a2"]
+        )
+        self.assertEqual(commands[3][5], "name=u1,u2")
+
+    def test_failed_batch_reports_each_operation(self):
+        self.set_state(associations=[["u1", "a1"], ["u3", "a1"]], defaults={}, fail=["u3"])
+        batch = SlurmBatch()
+        u1 = batch.remove_assoc("u1", "c1", "a1")
+        u3 = batch.remove_assoc("u3", "c1", "a1")
+        batch.run()
+
+        self.assertIsNone(u1.error)
+        self.assertIn("Problem with u3", str(u3.error))
+        # batched delete, then one delete per user
+        self.assertEqual([c[5] for c in self.commands()[1:]], ["name=u1,u3", "name=u1", "name=u3"])
+
+    def test_nothing_deleted_is_not_an_error(self):
+        batch = SlurmBatch()
+        operation = batch.remove_assoc("u4", "c1", "a1")
+        batch.run()
+        self.assertIsNone(operation.error)
+
+    def test_batch_size_and_order(self):
+        batch = SlurmBatch(batch_size=2)
+        batch.remove_account("c1", "a1")
+        batch.add_assoc("u1", "c1", "a3")
+        batch.add_assoc("u2", "c1", "a3")
+        batch.add_assoc("u3", "c1", "a3")
+        batch.add_account("c1", "a3", specs=["parent=a2"])
+        batch.remove_qos("u2", "c1", "a2", "QOS-=debug")
+        batch.run()
+
+        self.assertEqual(
+            [c[2:4] + c[4:6] for c in self.commands()],
+            [
+                ["create", "account", "name=a3", "cluster=c1"],
+                ["create", "user", "name=u1,u2", "cluster=c1"],
+                ["create", "user", "name=u3", "cluster=c1"],
+                ["modify", "user", "where", "name=u2"],
+                ["delete", "account", "where", "name=a1"],
+            ],
+        )
+        self.assertEqual(self.commands()[0][-1], "parent=a2")
+
+    def test_noop(self):
+        batch = SlurmBatch(noop=True)
+        batch.remove_assoc("u1", "c1", "a1")
+        batch.add_account("c1", "a3")
+        operations = batch.run()
+
+        self.assertEqual(self.commands(), [])
+        self.assertEqual([op.error for op in operations], [None, None])
+
+    def test_run_empties_queue(self):
+        batch = SlurmBatch()
+        batch.add_account("c1", "a3")
+        self.assertEqual(len(batch.run()), 1)
+        batch.add_account("c2", "a4")
+        self.assertEqual([op.cluster for op in batch.run()], ["c2"])
+
+        self.assertEqual([c[4:6] for c in self.commands()], [["name=a3", "cluster=c1"], ["name=a4", "cluster=c2"]])
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import logging
+import time
+from io import StringIO
+
+from django.test import SimpleTestCase
+
+from coldfront.plugins.slurm.associations import SlurmAccount, SlurmCluster, SlurmParserError, SlurmUser
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_dump(num_lines):
+    """Generate a sacctmgr dump with nested accounts of about num_lines lines"""
+    yield "# synthetic sacctmgr dump\n"
+    yield "Cluster - 'bench':Fairshare=1:QOS='normal'\n"
+    yield "Parent - 'root'\n"
+    yield "User - 'root':DefaultAccount='root':AdminLevel='Administrator':Fairshare=1\n"
+    lines = 4
+    num_groups = max(1, num_lines // 1000)
+    for g in range(num_groups):
+        yield f"Account - 'group{g}':Description='group {g}':Organization='bench':Fairshare=100\n"
+        lines += 1
+    g = 0
+    while lines < num_lines:
+        group = f"group{g % num_groups}"
+        account = f"{group}-{g}"
+        yield f"Parent - '{group}'\n"
+        yield f"Account - '{account}':Description='{account}':Organization='bench':Fairshare=100:QOS='debug,normal'\n"
+        yield f"Parent - '{account}'\n"
+        for u in range(20):
+            yield f"User - 'user{u}':DefaultAccount='{group}':Fairshare=parent:QOS='debug,normal'\n"
+        lines += 23
+        g += 1
+
+
+class DumpParserTest(SimpleTestCase):
+    def test_specs_are_ordered_and_unique(self):
+        user = SlurmUser.new_from_sacctmgr("User - 'jane':DefaultAccount='physics':Fairshare=parent")
+        user.add_specs(["Fairshare=parent:QOS+=debug", "DefaultAccount='physics'"])
+        self.assertEqual(user.spec_list(), ["DefaultAccount='physics'", "Fairshare=parent", "QOS+=debug"])
+        self.assertEqual(user.format_specs(), "DefaultAccount='physics':Fairshare=parent:QOS+=debug")
+
+    def test_invalid_record(self):
+        with self.assertRaises(SlurmParserError):
+            SlurmAccount.new_from_sacctmgr("Account - '':Fairshare=1")
+        with self.assertRaises(SlurmParserError):
+            SlurmUser.new_from_sacctmgr("User - jane")
+
+    def test_get_account_index(self):
+        cluster = SlurmCluster.new_from_stream(
+            StringIO(
+                "Cluster - 'alpha'\n"
+                "Parent - 'root'\n"
+                "Account - 'physics'\n"
+                "Parent - 'physics'\n"
+                "Account - 'astro'\n"
+                "Parent - 'astro'\n"
+                "Account - 'cosmo'\n"
+                "User - 'jane'\n"
+            )
+        )
+        self.assertEqual(sorted(cluster.account_index), ["astro", "cosmo", "physics", "root"])
+        self.assertIn("jane", cluster.get_account("astro").users)
+        self.assertIs(cluster.get_account("cosmo"), cluster.accounts["physics"].accounts["astro"].accounts["cosmo"])
+        self.assertIsNone(cluster.get_account("chemistry"))
+
+        # accounts added after parsing are still found
+        cluster.accounts["physics"].add_account(SlurmAccount("chemistry"))
+        self.assertEqual(cluster.get_account("chemistry").name, "chemistry")
+
+    def test_parse_benchmark(self):
+        """Parse a synthetic 200k line dump"""
+        start = time.perf_counter()
+        cluster = SlurmCluster.new_from_stream(synthetic_dump(200000))
+        elapsed = time.perf_counter() - start
+        logger.info("Parsed synthetic 200k line sacctmgr dump in %.2fs", elapsed)
+
+        self.assertEqual(cluster.name, "bench")
+        self.assertEqual(len(cluster.accounts), 201)
+        num_accounts = sum(1 for line in synthetic_dump(200000) if line.startswith("Account"))
+        self.assertEqual(len(cluster.account_index), num_accounts + 1)  # plus root
+        account = cluster.get_account("group3-203")
+        self.assertEqual(len(account.users), 20)
+        # identical spec strings are shared
+        spec = account.users["user1"].spec_list()[1]
+        self.assertIs(spec, cluster.get_account("group5-5").users["user2"].spec_list()[1])
@@ -0,0 +1,244 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import json
+import os
+import tempfile
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from coldfront.config.env import ENV
+from coldfront.core.allocation.models import (
+    AllocationAttributeType,
+    AllocationStatusChoice,
+    AllocationUserStatusChoice,
+)
+from coldfront.core.resource.models import ResourceAttribute, ResourceAttributeType, ResourceType
+from coldfront.core.test_helpers.factories import (
+    AAttributeTypeFactory,
+    AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationFactory,
+    AllocationUserFactory,
+    ProjectFactory,
+    ResourceFactory,
+    UserFactory,
+)
+from coldfront.plugins.slurm.tests.test_batch import fake_sacctmgr
+from coldfront.plugins.slurm.utils import SlurmBatch
+
+COMMAND_MODULE = "coldfront.plugins.slurm.management.commands.slurm_check"
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_SLURM", default=False), "Only run Slurm sync queue tests if enabled")
+class IncrementalSyncTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        call_command("add_default_project_choices")
+        call_command("add_allocation_defaults")
+        call_command("add_resource_defaults")
+
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.resource = ResourceFactory(resource_type=ResourceType.objects.get(name="Cluster"))
+        ResourceAttribute.objects.create(
+            resource=cls.resource,
+            resource_attribute_type=ResourceAttributeType.objects.get(name="slurm_cluster"),
+            value="test_cluster",
+        )
+        cls.partition = ResourceFactory(
+            resource_type=ResourceType.objects.get(name="Cluster Partition"), parent_resource=cls.resource
+        )
+        cls.allocation = AllocationFactory(
+            project=ProjectFactory(), status=AllocationStatusChoice.objects.get(name="Active")
+        )
+        cls.allocation.resources.add(cls.partition)
+        AllocationAttributeFactory(
+            allocation=cls.allocation,
+            value="physics",
+            allocation_attribute_type=AllocationAttributeTypeFactory(
+                name="slurm_account_name", attribute_type=AAttributeTypeFactory(name="Text")
+            ),
+        )
+        for name, value in [("slurm_specs", "Fairshare=100"), ("slurm_user_specs", "QOS+=debug")]:
+            AllocationAttributeFactory(
+                allocation=cls.allocation,
+                value=value,
+                allocation_attribute_type=AllocationAttributeType.objects.get(name=name),
+            )
+        cls.allocation_user = AllocationUserFactory(
+            allocation=cls.allocation,
+            user=UserFactory(username="jane"),
+            status=AllocationUserStatusChoice.objects.get(name="Active"),
+        )
+
+    def setUp(self):
+        from coldfront.plugins.slurm.tasks import queue_allocation_user
+
+        queue_allocation_user(self.allocation_user.pk)
+
+    def _changes(self):
+        from coldfront.plugins.slurm.models import SlurmAssociationChange
+
+        return list(SlurmAssociationChange.objects.values_list("cluster", "account", "user"))
+
+    def test_queue_allocation_user(self):
+        """partitions are queued under the cluster of their parent resource"""
+        self.assertCountEqual(self._changes(), [("test_cluster", "physics", "jane"), ("test_cluster", "physics", "")])
+
+    def test_queue_allocation(self):
+        from coldfront.plugins.slurm.tasks import queue_allocation
+
+        AllocationUserFactory(allocation=self.allocation, user=UserFactory(username="john"))
+        queue_allocation(self.allocation.pk)
+        self.assertEqual(len(self._changes()), 3)
+
+    def test_queue_allocations(self):
+        from coldfront.plugins.slurm.models import SlurmAssociationChange
+        from coldfront.plugins.slurm.tasks import queue_allocations
+
+        SlurmAssociationChange.objects.all().delete()
+        AllocationUserFactory(allocation=self.allocation, user=UserFactory(username="john"))
+        queue_allocations([self.allocation.pk, AllocationFactory().pk])
+        self.assertEqual(len(self._changes()), 3)
+
+    def test_queue_allocations_queries(self):
+        """The accounts and clusters of a batch are found with the same queries however many allocations it has"""
+        from coldfront.plugins.slurm.tasks import queue_allocations
+
+        allocation = AllocationFactory(project=ProjectFactory())
+        allocation.resources.add(self.partition)
+        AllocationAttributeFactory(
+            allocation=allocation,
+            value="chemistry",
+            allocation_attribute_type=AllocationAttributeType.objects.get(name="slurm_account_name"),
+        )
+        AllocationUserFactory(allocation=allocation, user=UserFactory(username="john"))
+
+        def lookups(allocation_pks):
+            with CaptureQueriesContext(connection) as queries:
+                queue_allocations(allocation_pks)
+            return [
+                query["sql"]
+                for query in queries
+                if "slurm_slurmassociationchange" not in query["sql"] and "SAVEPOINT" not in query["sql"]
+            ]
+
+        self.assertEqual(len(lookups([self.allocation.pk])), len(lookups([self.allocation.pk, allocation.pk])))
+        self.assertIn(("test_cluster", "chemistry", "john"), self._changes())
+
+    def _slurm_check(self, **options):
+        """Run slurm_check --incremental against the fake sacctmgr, returns the output and commands run"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log = os.path.join(tmpdir, "log")
+            state = os.path.join(tmpdir, "state.json")
+            with open(state, "w") as fh:
+                json.dump({"associations": [["jane", "physics"]], "defaults": {}, "fail": []}, fh)
+
+            out = StringIO()
+            with (
+                patch.dict(os.environ, {"FAKE_SACCTMGR_LOG": log, "FAKE_SACCTMGR_STATE": state}),
+                fake_sacctmgr(),
+            ):
+                call_command("slurm_check", incremental=True, stdout=out, **options)
+
+            commands = []
+            if os.path.exists(log):
+                with open(log) as fh:
+                    commands = [json.loads(line) for line in fh]
+
+        return out.getvalue(), commands
+
+    def test_sync_add(self):
+        """Associations are added with their specs, and the specs are set in case they already exist"""
+        out, commands = self._slurm_check(sync=True)
+        self.assertEqual(
+            [command[2:] for command in commands],
+            [
+                ["create", "account", "name=physics", "cluster=test_cluster", "Fairshare=100"],
+                ["modify", "account", "where", "name=physics", "cluster=test_cluster", "set", "Fairshare=100"],
+                ["create", "user", "name=jane", "cluster=test_cluster", "account=physics", "QOS+=debug"],
+                [
+                    "modify",
+                    "user",
+                    "where",
+                    "name=jane",
+                    "cluster=test_cluster",
+                    "account=physics",
+                    "set",
+                    "QOS+=debug",
+                ],
+            ],
+        )
+        self.assertEqual(
+            out.splitlines(),
+            [
+                "\tphysics\ttest_cluster\tAdd",
+                "\tphysics\ttest_cluster\tModify\tFairshare=100",
+                "jane\tphysics\ttest_cluster\tAdd",
+                "jane\tphysics\ttest_cluster\tModify\tQOS+=debug",
+            ],
+        )
+        self.assertEqual(self._changes(), [])
+
+    def test_sync_remove(self):
+        self.allocation.status = AllocationStatusChoice.objects.get(name="Expired")
+        self.allocation.save()
+        out, commands = self._slurm_check(sync=True)
+        self.assertEqual(
+            [command[2:4] for command in commands],
+            [["User=jane", "Cluster=test_cluster"], ["delete", "user"], ["delete", "account"]],
+        )
+        self.assertEqual(out, "\tphysics\ttest_cluster\tRemove\njane\tphysics\ttest_cluster\tRemove\n")
+        self.assertEqual(self._changes(), [])
+
+    def test_sync_drops_unknown_clusters(self):
+        from coldfront.plugins.slurm.models import SlurmAssociationChange
+
+        SlurmAssociationChange.objects.create(cluster="retired", account="physics", user="jane")
+        SlurmAssociationChange.objects.create(cluster="ignored", account="physics", user="jane")
+
+        with patch(f"{COMMAND_MODULE}.SLURM_IGNORE_CLUSTERS", ["ignored"]):
+            _, commands = self._slurm_check(sync=True)
+
+        self.assertEqual(len(commands), 4)
+        self.assertEqual(self._changes(), [])
+
+    def test_sync_keeps_changes_queued_during_run(self):
+        """A change queued again while the sync is running is synced again on the next run"""
+        from coldfront.plugins.slurm.tasks import queue_allocation_user
+
+        run = SlurmBatch.run
+
+        def run_and_requeue(batch):
+            queue_allocation_user(self.allocation_user.pk)
+            return run(batch)
+
+        with patch.object(SlurmBatch, "run", run_and_requeue):
+            self._slurm_check(sync=True)
+        self.assertCountEqual(self._changes(), [("test_cluster", "physics", "jane"), ("test_cluster", "physics", "")])
+
+        _, commands = self._slurm_check(sync=True)
+        self.assertEqual(len(commands), 4)
+        self.assertEqual(self._changes(), [])
+
+    def test_report_only(self):
+        out, commands = self._slurm_check()
+        self.assertEqual(commands, [])
+        self.assertEqual(len(out.splitlines()), 4)
+        self.assertEqual(len(self._changes()), 2)
+
+    def test_noop_keeps_queue(self):
+        out, commands = self._slurm_check(sync=True, noop=True)
+        self.assertEqual(commands, [])
+        self.assertEqual(len(out.splitlines()), 4)
+        self.assertEqual(len(self._changes()), 2)
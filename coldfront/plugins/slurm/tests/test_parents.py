@@ -5,7 +5,9 @@
 from io import StringIO
 
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from coldfront.core.allocation.models import Allocation, AllocationUserStatusChoice
 from coldfront.core.resource.models import ResourceAttribute, ResourceAttributeType, ResourceType
@@ -20,7 +22,7 @@ from coldfront.core.test_helpers.factories import (
     ResourceFactory,
     UserFactory,
 )
-from coldfront.plugins.slurm.associations import SlurmCluster
+from coldfront.plugins.slurm.associations import SlurmAccount, SlurmCluster
 
 # Building this account structure in slurm/coldfront
 # 'a' represents an account and 'u' represents a user
@@ -244,3 +246,31 @@ User - 'u2'
         }
         self.maxDiff = None
         self.assertEqual(expected, cluster.get_objects_to_remove(coldfront_cluster))
+
+    def test_slurm_from_resource_query_count(self):
+        """building from a resource uses a fixed number of queries"""
+        with CaptureQueriesContext(connection) as ctx:
+            SlurmCluster.new_from_resource(self.resource)
+        num_queries = len(ctx.captured_queries)
+
+        san_aat = self.a1.allocationattribute_set.get(allocation_attribute_type__name="slurm_account_name")
+        for i in range(5):
+            allocation = Allocation.objects.create(project=self.project, status=self.a1.status)
+            allocation.resources.add(self.resource)
+            AllocationAttributeFactory(
+                allocation=allocation, value=f"extra{i}", allocation_attribute_type=san_aat.allocation_attribute_type
+            )
+            AllocationUserFactory(allocation=allocation, user=UserFactory(username=f"extra_user{i}"))
+
+        with CaptureQueriesContext(connection) as ctx:
+            cluster = SlurmCluster.new_from_resource(self.resource)
+        self.assertEqual(num_queries, len(ctx.captured_queries))
+        self.assertIn("extra4", cluster.accounts)
+        self.assertIn("extra_user4", cluster.accounts["extra4"].users)
+
+    def test_slurm_account_add_allocation_without_prefetch(self):
+        """allocations not loaded through get_slurm_allocations are still supported"""
+        account = SlurmAccount("a4")
+        account.add_allocation(self.a4, Allocation.objects.filter(pk=self.a4.pk))
+        self.assertEqual(account.parent_account_name, "a3")
+        self.assertEqual(sorted(account.users.keys()), ["u1", "u2"])
@@ -6,6 +6,7 @@ import csv
 import logging
 import shlex
 import subprocess
+from collections import defaultdict
 from io import StringIO
 
 from coldfront.core.utils.common import import_from_settings
@@ -21,6 +22,8 @@ SLURM_CMD_REMOVE_QOS = SLURM_SACCTMGR_PATH + " -Q -i modify user where name={} c
 SLURM_CMD_REMOVE_ACCOUNT = SLURM_SACCTMGR_PATH + " -Q -i delete account where name={} cluster={}"
 SLURM_CMD_ADD_ACCOUNT = SLURM_SACCTMGR_PATH + " -Q -i create account name={} cluster={}"
 SLURM_CMD_ADD_USER = SLURM_SACCTMGR_PATH + " -Q -i create user name={} cluster={} account={}"
+SLURM_CMD_MODIFY_ACCOUNT = SLURM_SACCTMGR_PATH + " -Q -i modify account where name={} cluster={} set"
+SLURM_CMD_MODIFY_USER = SLURM_SACCTMGR_PATH + " -Q -i modify user where name={} cluster={} account={} set"
 SLURM_CMD_CHECK_ASSOCIATION = (
     SLURM_SACCTMGR_PATH + " list associations User={} Cluster={} Account={} Format=Cluster,Account,User,QOS -P"
 )
@@ -31,6 +34,9 @@ SLURM_CMD_CHANGE_DEFAULT_ACCOUNT = (
 )
 SLURM_CMD_BLOCK_ACCOUNT = SLURM_SACCTMGR_PATH + " -Q -i modify account {} where Cluster={} set GrpSubmitJobs=0"
 SLURM_CMD_DUMP_CLUSTER = SLURM_SACCTMGR_PATH + " dump {} file={}"
+SLURM_CMD_LIST_DEFAULT_ACCOUNTS = SLURM_SACCTMGR_PATH + " show user User={} Cluster={} Format=User,DefaultAccount -Pn"
+SLURM_CMD_LIST_USER_ACCOUNTS = SLURM_SACCTMGR_PATH + " list associations User={} Cluster={} Format=User,Account -Pn"
+SLURM_BATCH_SIZE = import_from_settings("SLURM_BATCH_SIZE", 100)
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +61,10 @@ def _run_slurm_cmd(cmd, noop=True):
             # We tried to add something that already exists. Don't throw error
             logger.warning("Nothing new to add: %s", cmd)
             return e.stdout
+        if "Nothing modified" in str(e.stdout):
+            # The specs we tried to set were already set. Don't throw error
+            logger.warning("Nothing to modify: %s", cmd)
+            return e.stdout
 
         logger.error("Slurm command failed: %s", cmd)
         err_msg = "return_value={} stdout={} stderr={}".format(e.returncode, e.stdout, e.stderr)
@@ -67,6 +77,11 @@ def _run_slurm_cmd(cmd, noop=True):
 
 
 def slurm_remove_assoc(user, cluster, account, noop=False):
+    if noop:
+        # Can't look up the default account without running sacctmgr
+        _remove_assoc(user=user, cluster=cluster, account=account, noop=noop)
+        return
+
     # check default account
     cmd = SLURM_CMD_CHECK_DEFAULT_ACCOUNT.format(shlex.quote(user), shlex.quote(cluster))
     output = _run_slurm_cmd(cmd, noop=noop)
@@ -154,6 +169,227 @@ def slurm_dump_cluster(cluster, fname, noop=False):
     _run_slurm_cmd(cmd, noop=noop)
 
 
+class SlurmOperation:
+    """A sacctmgr addition or removal queued in a SlurmBatch.
+
+    Attributes:
+        action (str): one of the SlurmBatch actions
+        cluster (str): name of the Slurm cluster
+        account (str): name of the Slurm account
+        user (str): username of the Slurm user, None for account operations
+        qos (str): QOS spec to set when removing QOSes
+        specs (list[str]): Slurm specs to set when adding or modifying users or accounts
+        error (SlurmError): error running the operation, None if it succeeded
+    """
+
+    def __init__(self, action, cluster, account, user=None, qos=None, specs=None):
+        self.action = action
+        self.cluster = cluster
+        self.account = account
+        self.user = user
+        self.qos = qos
+        self.specs = specs or []
+        self.error = None
+
+    def __str__(self):
+        return f"{self.action} cluster={self.cluster} account={self.account} user={self.user}"
+
+
+class SlurmBatch:
+    """Runs sacctmgr additions and removals in batches.
+
+    Operations are queued and then run with one sacctmgr command per cluster and account (or QOS/specs) for up
+    to batch_size users or accounts at a time, instead of one command per user. If a batched command fails,
+    the operations in it are retried one at a time so the outcome of each operation can be reported in its
+    error attribute. Commands are logged but not run in noop mode, the same as the slurm_* functions.
+    """
+
+    ADD_ACCOUNT = "add_account"
+    MODIFY_ACCOUNT = "modify_account"
+    ADD_USER = "add_user"
+    MODIFY_USER = "modify_user"
+    REMOVE_QOS = "remove_qos"
+    REMOVE_USER = "remove_user"
+    REMOVE_ACCOUNT = "remove_account"
+
+    def __init__(self, noop=False, batch_size=SLURM_BATCH_SIZE):
+        self.noop = noop
+        self.batch_size = batch_size
+        self.operations: list[SlurmOperation] = []
+
+    def _queue(self, *args, **kwargs):
+        operation = SlurmOperation(*args, **kwargs)
+        self.operations.append(operation)
+        return operation
+
+    def add_account(self, cluster, account, specs=None):
+        return self._queue(self.ADD_ACCOUNT, cluster, account, specs=specs)
+
+    def add_assoc(self, user, cluster, account, specs=None):
+        return self._queue(self.ADD_USER, cluster, account, user=user, specs=specs)
+
+    def modify_account(self, cluster, account, specs):
+        return self._queue(self.MODIFY_ACCOUNT, cluster, account, specs=specs)
+
+    def modify_assoc(self, user, cluster, account, specs):
+        return self._queue(self.MODIFY_USER, cluster, account, user=user, specs=specs)
+
+    def remove_qos(self, user, cluster, account, qos):
+        return self._queue(self.REMOVE_QOS, cluster, account, user=user, qos=qos)
+
+    def remove_assoc(self, user, cluster, account):
+        return self._queue(self.REMOVE_USER, cluster, account, user=user)
+
+    def remove_account(self, cluster, account):
+        return self._queue(self.REMOVE_ACCOUNT, cluster, account)
+
+    def _run_cmd(self, cmd):
+        return _run_slurm_cmd(cmd, noop=self.noop)
+
+    def _run_batched(self, operations, build_cmd):
+        """Run operations with a single command, falling back to one command per operation on failure"""
+        try:
+            self._run_cmd(build_cmd(operations))
+            return
+        except SlurmError as e:
+            if len(operations) == 1:
+                operations[0].error = e
+                return
+            logger.warning("Batched Slurm command failed, retrying %s operations one at a time: %s", len(operations), e)
+
+        for operation in operations:
+            try:
+                self._run_cmd(build_cmd([operation]))
+            except SlurmError as e:
+                operation.error = e
+
+    def _chunks(self, operations):
+        for i in range(0, len(operations), self.batch_size):
+            yield operations[i : i + self.batch_size]
+
+    def _read_user_accounts(self, cmd):
+        """Run a sacctmgr list command with User|Account output and return a mapping of user to accounts"""
+        output = self._run_cmd(cmd)
+        accounts = defaultdict(list)
+        if output is None:
+            return accounts
+        for line in output.decode("UTF-8").splitlines():
+            user, _, account = line.partition("|")
+            accounts[user].append(account)
+        return accounts
+
+    def _change_default_accounts(self, cluster, operations, removing):
+        """Change the default account of users whose default account is about to be removed to one of their
+        other accounts. Returns the operations that can go ahead with the removal."""
+        if self.noop:
+            # Can't look up the default accounts without running sacctmgr
+            return operations
+
+        users = ",".join(op.user for op in operations)
+        try:
+            defaults = self._read_user_accounts(
+                SLURM_CMD_LIST_DEFAULT_ACCOUNTS.format(shlex.quote(users), shlex.quote(cluster))
+            )
+            changing = [op for op in operations if op.account in defaults.get(op.user, [])]
+            if not changing:
+                return operations
+
+            users = ",".join(op.user for op in changing)
+            user_accounts = self._read_user_accounts(
+                SLURM_CMD_LIST_USER_ACCOUNTS.format(shlex.quote(users), shlex.quote(cluster))
+            )
+        except SlurmError as e:
+            for op in operations:
+                op.error = e
+            return []
+
+        new_defaults = defaultdict(list)
+        for op in changing:
+            others = [a for a in user_accounts.get(op.user, []) if a != op.account]
+            # Prefer accounts the user is not about to be removed from as well
+            others.sort(key=lambda a: a in removing[op.user])
+            if others:
+                new_defaults[others[0]].append(op)
+
+        for account, ops in new_defaults.items():
+            for chunk in self._chunks(ops):
+                self._run_batched(
+                    chunk,
+                    lambda ops, account=account: SLURM_CMD_CHANGE_DEFAULT_ACCOUNT.format(
+                        shlex.quote(",".join(op.user for op in ops)), shlex.quote(cluster), shlex.quote(account)
+                    ),
+                )
+
+        return [op for op in operations if op.error is None]
+
+    def _build_cmd(self, action, operations):
+        op = operations[0]
+        names = ",".join(o.user if o.user is not None else o.account for o in operations)
+        if action == self.ADD_ACCOUNT:
+            cmd = SLURM_CMD_ADD_ACCOUNT.format(shlex.quote(names), shlex.quote(op.cluster))
+        elif action == self.MODIFY_ACCOUNT:
+            cmd = SLURM_CMD_MODIFY_ACCOUNT.format(shlex.quote(names), shlex.quote(op.cluster))
+        elif action == self.ADD_USER:
+            cmd = SLURM_CMD_ADD_USER.format(shlex.quote(names), shlex.quote(op.cluster), shlex.quote(op.account))
+        elif action == self.MODIFY_USER:
+            cmd = SLURM_CMD_MODIFY_USER.format(shlex.quote(names), shlex.quote(op.cluster), shlex.quote(op.account))
+        elif action == self.REMOVE_QOS:
+            cmd = SLURM_CMD_REMOVE_QOS.format(
+                shlex.quote(names), shlex.quote(op.cluster), shlex.quote(op.account), shlex.quote(op.qos)
+            )
+        elif action == self.REMOVE_USER:
+            cmd = SLURM_CMD_REMOVE_USER.format(shlex.quote(names), shlex.quote(op.cluster), shlex.quote(op.account))
+        else:
+            cmd = SLURM_CMD_REMOVE_ACCOUNT.format(shlex.quote(names), shlex.quote(op.cluster))
+
+        if len(op.specs) > 0:
+            cmd += " " + " ".join(op.specs)
+        return cmd
+
+    def _group_key(self, op):
+        if op.action in (self.ADD_ACCOUNT, self.MODIFY_ACCOUNT, self.REMOVE_ACCOUNT):
+            return (op.cluster, tuple(op.specs))
+        return (op.cluster, op.account, op.qos, tuple(op.specs))
+
+    def run(self):
+        """Run the queued operations. Accounts are added before users and removed after users. The queue is
+        emptied, so the batch can be reused without running the same operations again.
+
+        Returns:
+            list[SlurmOperation]: the operations in the order they were queued
+        """
+        operations, self.operations = self.operations, []
+
+        removing = defaultdict(set)
+        for op in operations:
+            if op.action == self.REMOVE_USER:
+                removing[op.user].add(op.account)
+
+        for action in [
+            self.ADD_ACCOUNT,
+            self.MODIFY_ACCOUNT,
+            self.ADD_USER,
+            self.MODIFY_USER,
+            self.REMOVE_QOS,
+            self.REMOVE_USER,
+            self.REMOVE_ACCOUNT,
+        ]:
+            groups = defaultdict(list)
+            for op in operations:
+                if op.action == action:
+                    groups[self._group_key(op)].append(op)
+
+            for ops in groups.values():
+                for chunk in self._chunks(ops):
+                    if action == self.REMOVE_USER:
+                        chunk = self._change_default_accounts(chunk[0].cluster, chunk, removing)
+                        if not chunk:
+                            continue
+                    self._run_batched(chunk, lambda ops, action=action: self._build_cmd(action, ops))
+
+        return operations
+
+
 def parse_qos(qos: str) -> list[str]:
     """Parses QOS spec string into a list of QOSes"""
     if qos.startswith("QOS+="):
@@ -5,6 +5,7 @@
 import logging
 import os
 import sys
+from functools import partial
 
 from django.core.management.base import BaseCommand
 from django.db.models import Q
@@ -19,10 +20,9 @@ from coldfront.plugins.xdmod.utils import (
     XDMOD_RESOURCE_ATTRIBUTE_NAME,
     XDMOD_STORAGE_ATTRIBUTE_NAME,
     XDMOD_STORAGE_GROUP_ATTRIBUTE_NAME,
+    XDMOD_WORKERS,
+    XdmodClient,
     XdmodNotFoundError,
-    xdmod_fetch_cloud_core_time,
-    xdmod_fetch_total_cpu_hours,
-    xdmod_fetch_total_storage,
 )
 
 logger = logging.getLogger(__name__)
@@ -42,6 +42,19 @@ class Command(BaseCommand):
         parser.add_argument("-x", "--header", help="Include header in output", action="store_true")
         parser.add_argument("-m", "--statistic", help="XDMoD statistic (default total_cpu_hours)", required=True)
         parser.add_argument("--expired", help="XDMoD statistic for archived projects", action="store_true")
+        parser.add_argument(
+            "-b",
+            "--bulk",
+            help="Fetch usage for all accounts sharing resources and dates in one grouped XDMoD request",
+            action="store_true",
+        )
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=XDMOD_WORKERS,
+            help=f"Number of concurrent requests to XDMoD (default {XDMOD_WORKERS})",
+        )
 
     def write(self, data):
         try:
@@ -51,6 +64,68 @@ class Command(BaseCommand):
             os.dup2(devnull, sys.stdout.fileno())
             sys.exit(1)
 
+    def get_xdmod_resources(self, s):
+        resources = []
+        for r in s.resources.all():
+            rname = r.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
+            if not rname and r.parent_resource:
+                rname = r.parent_resource.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
+
+            if not rname:
+                continue
+
+            if self.filter_resource and self.filter_resource != rname:
+                continue
+
+            resources.append(rname)
+
+        return resources
+
+    def fetch_usages(self, to_fetch, fetch, fetch_grouped):
+        """Fetch usage for the allocations, spreading the requests across the workers of self.client
+
+        Params:
+            to_fetch (list): (allocation, account or project, quota, resources) tuples
+            fetch (callable): fetches the usage of a single account from XDMoD
+            fetch_grouped (callable): fetches the usage of many accounts from XDMoD, returning a dict
+
+        Returns:
+            dict: the usage of each allocation XDMoD has data for, by allocation id
+        """
+        if not self.bulk:
+
+            def fetch_allocation(item):
+                s, name, _, resources = item
+                try:
+                    return fetch(s.start_date, s.end_date, name, resources=resources)
+                except XdmodNotFoundError:
+                    return None
+
+            usages = {}
+            for item, usage in zip(to_fetch, self.client.map(fetch_allocation, to_fetch)):
+                if usage is not None:
+                    usages[item[0].pk] = usage
+            return usages
+
+        # Allocations with the same resources and dates share a grouped request
+        allocations_by_name = {}
+        for s, name, _, resources in to_fetch:
+            key = (s.start_date, s.end_date, tuple(resources))
+            allocations_by_name.setdefault(key, {}).setdefault(name, []).append(s)
+
+        def fetch_group(item):
+            (start, end, resources), allocations = item
+            return fetch_grouped(start, end, list(allocations), resources=list(resources))
+
+        groups = list(allocations_by_name.items())
+        usages = {}
+        for (_, allocations), grouped_usage in zip(groups, self.client.map(fetch_group, groups)):
+            for name, usage in grouped_usage.items():
+                for s in allocations.get(name, []):
+                    usages[s.pk] = usage
+
+        return usages
+
     def process_total_storage(self):
         header = [
             "allocation_id",
@@ -91,6 +166,7 @@ class Command(BaseCommand):
                 & Q(allocationattribute__value=self.filter_account)
             )
 
+        to_fetch = []
         for s in allocations.distinct():
             account_name = s.get_attribute(XDMOD_STORAGE_GROUP_ATTRIBUTE_NAME)
             if not account_name:
@@ -102,19 +178,7 @@ class Command(BaseCommand):
                 logger.warning("%s attribute not found for allocation: %s", XDMOD_STORAGE_ATTRIBUTE_NAME, s)
                 continue
 
-            resources = []
-            for r in s.resources.all():
-                rname = r.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-                if not rname and r.parent_resource:
-                    rname = r.parent_resource.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-
-                if not rname:
-                    continue
-
-                if self.filter_resource and self.filter_resource != rname:
-                    continue
-
-                resources.append(rname)
+            resources = self.get_xdmod_resources(s)
 
             if len(resources) == 0:
                 logger.warning(
@@ -122,16 +186,24 @@ class Command(BaseCommand):
                 )
                 continue
 
-            try:
-                usage = xdmod_fetch_total_storage(
-                    s.start_date, s.end_date, account_name, resources=resources, statistics="avg_physical_usage"
-                )
-            except XdmodNotFoundError:
+            to_fetch.append((s, account_name, cpu_hours, resources))
+
+        usages = self.fetch_usages(
+            to_fetch,
+            partial(self.client.fetch_total_storage, statistics="avg_physical_usage"),
+            partial(self.client.fetch_total_storage_by_account, statistics="avg_physical_usage"),
+        )
+
+        sync_usages = {}
+        for s, account_name, cpu_hours, resources in to_fetch:
+            if s.pk not in usages:
                 logger.warning(
                     "No data in XDMoD found for allocation %s account %s resources %s", s, account_name, resources
                 )
                 continue
 
+            usage = usages[s.pk]
+
             logger.warning(
                 "Total GB = %s for allocation %s account %s GB %s resources %s",
                 usage,
@@ -140,8 +212,7 @@ class Command(BaseCommand):
                 cpu_hours,
                 resources,
             )
-            if self.sync:
-                s.set_usage(XDMOD_STORAGE_ATTRIBUTE_NAME, usage)
+            sync_usages[s.pk] = {XDMOD_STORAGE_ATTRIBUTE_NAME: usage}
 
             self.write(
                 "\t".join(
@@ -156,6 +227,9 @@ class Command(BaseCommand):
                 )
             )
 
+        if self.sync:
+            Allocation.bulk_set_usage(sync_usages)
+
     def process_total_gpu_hours(self):
         header = [
             "allocation_id",
@@ -196,6 +270,7 @@ class Command(BaseCommand):
                 & Q(allocationattribute__value=self.filter_account)
             )
 
+        to_fetch = []
         for s in allocations.distinct():
             account_name = s.get_attribute(XDMOD_ACCOUNT_ATTRIBUTE_NAME)
             if not account_name:
@@ -207,19 +282,7 @@ class Command(BaseCommand):
                 logger.warning("%s attribute not found for allocation: %s", XDMOD_ACC_HOURS_ATTRIBUTE_NAME, s)
                 continue
 
-            resources = []
-            for r in s.resources.all():
-                rname = r.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-                if not rname and r.parent_resource:
-                    rname = r.parent_resource.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-
-                if not rname:
-                    continue
-
-                if self.filter_resource and self.filter_resource != rname:
-                    continue
-
-                resources.append(rname)
+            resources = self.get_xdmod_resources(s)
 
             if len(resources) == 0:
                 logger.warning(
@@ -227,16 +290,24 @@ class Command(BaseCommand):
                 )
                 continue
 
-            try:
-                usage = xdmod_fetch_total_cpu_hours(
-                    s.start_date, s.end_date, account_name, resources=resources, statistics="total_gpu_hours"
-                )
-            except XdmodNotFoundError:
+            to_fetch.append((s, account_name, cpu_hours, resources))
+
+        usages = self.fetch_usages(
+            to_fetch,
+            partial(self.client.fetch_total_cpu_hours, statistics="total_gpu_hours"),
+            partial(self.client.fetch_total_cpu_hours_by_account, statistics="total_gpu_hours"),
+        )
+
+        sync_usages = {}
+        for s, account_name, cpu_hours, resources in to_fetch:
+            if s.pk not in usages:
                 logger.warning(
                     "No data in XDMoD found for allocation %s account %s resources %s", s, account_name, resources
                 )
                 continue
 
+            usage = usages[s.pk]
+
             logger.warning(
                 "Total Accelerator hours = %s for allocation %s account %s gpu_hours %s resources %s",
                 usage,
@@ -245,8 +316,7 @@ class Command(BaseCommand):
                 cpu_hours,
                 resources,
             )
-            if self.sync:
-                s.set_usage(XDMOD_ACC_HOURS_ATTRIBUTE_NAME, usage)
+            sync_usages[s.pk] = {XDMOD_ACC_HOURS_ATTRIBUTE_NAME: usage}
 
             self.write(
                 "\t".join(
@@ -261,6 +331,9 @@ class Command(BaseCommand):
                 )
             )
 
+        if self.sync:
+            Allocation.bulk_set_usage(sync_usages)
+
     def process_total_cpu_hours(self):
         header = [
             "allocation_id",
@@ -296,6 +369,7 @@ class Command(BaseCommand):
                 & Q(allocationattribute__value=self.filter_account)
             )
 
+        to_fetch = []
         for s in allocations.distinct():
             account_name = s.get_attribute(XDMOD_ACCOUNT_ATTRIBUTE_NAME)
             if not account_name:
@@ -307,19 +381,7 @@ class Command(BaseCommand):
                 logger.warning("%s attribute not found for allocation: %s", XDMOD_CPU_HOURS_ATTRIBUTE_NAME, s)
                 continue
 
-            resources = []
-            for r in s.resources.all():
-                rname = r.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-                if not rname and r.parent_resource:
-                    rname = r.parent_resource.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-
-                if not rname:
-                    continue
-
-                if self.filter_resource and self.filter_resource != rname:
-                    continue
-
-                resources.append(rname)
+            resources = self.get_xdmod_resources(s)
 
             if len(resources) == 0:
                 logger.warning(
@@ -327,14 +389,22 @@ class Command(BaseCommand):
                 )
                 continue
 
-            try:
-                usage = xdmod_fetch_total_cpu_hours(s.start_date, s.end_date, account_name, resources=resources)
-            except XdmodNotFoundError:
+            to_fetch.append((s, account_name, cpu_hours, resources))
+
+        usages = self.fetch_usages(
+            to_fetch, self.client.fetch_total_cpu_hours, self.client.fetch_total_cpu_hours_by_account
+        )
+
+        sync_usages = {}
+        for s, account_name, cpu_hours, resources in to_fetch:
+            if s.pk not in usages:
                 logger.warning(
                     "No data in XDMoD found for allocation %s account %s resources %s", s, account_name, resources
                 )
                 continue
 
+            usage = usages[s.pk]
+
             logger.warning(
                 "Total CPU hours = %s for allocation %s account %s cpu_hours %s resources %s",
                 usage,
@@ -343,8 +413,7 @@ class Command(BaseCommand):
                 cpu_hours,
                 resources,
             )
-            if self.sync:
-                s.set_usage(XDMOD_CPU_HOURS_ATTRIBUTE_NAME, usage)
+            sync_usages[s.pk] = {XDMOD_CPU_HOURS_ATTRIBUTE_NAME: usage}
 
             self.write(
                 "\t".join(
@@ -359,6 +428,9 @@ class Command(BaseCommand):
                 )
             )
 
+        if self.sync:
+            Allocation.bulk_set_usage(sync_usages)
+
     def process_cloud_core_time(self):
         header = [
             "allocation_id",
@@ -394,6 +466,7 @@ class Command(BaseCommand):
                 & Q(allocationattribute__value=self.filter_project)
             )
 
+        to_fetch = []
         for s in allocations.distinct():
             project_name = s.get_attribute(XDMOD_CLOUD_PROJECT_ATTRIBUTE_NAME)
             if not project_name:
@@ -405,19 +478,7 @@ class Command(BaseCommand):
                 logger.warning("%s attribute not found for allocation: %s", XDMOD_CLOUD_CORE_TIME_ATTRIBUTE_NAME, s)
                 continue
 
-            resources = []
-            for r in s.resources.all():
-                rname = r.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-                if not rname and r.parent_resource:
-                    rname = r.parent_resource.get_attribute(XDMOD_RESOURCE_ATTRIBUTE_NAME)
-
-                if not rname:
-                    continue
-
-                if self.filter_resource and self.filter_resource != rname:
-                    continue
-
-                resources.append(rname)
+            resources = self.get_xdmod_resources(s)
 
             if len(resources) == 0:
                 logger.warning(
@@ -425,14 +486,22 @@ class Command(BaseCommand):
                 )
                 continue
 
-            try:
-                usage = xdmod_fetch_cloud_core_time(s.start_date, s.end_date, project_name, resources=resources)
-            except XdmodNotFoundError:
+            to_fetch.append((s, project_name, core_time, resources))
+
+        usages = self.fetch_usages(
+            to_fetch, self.client.fetch_cloud_core_time, self.client.fetch_cloud_core_time_by_project
+        )
+
+        sync_usages = {}
+        for s, project_name, core_time, resources in to_fetch:
+            if s.pk not in usages:
                 logger.warning(
                     "No data in XDMoD found for allocation %s project %s resources %s", s, project_name, resources
                 )
                 continue
 
+            usage = usages[s.pk]
+
             logger.warning(
                 "Cloud core time = %s for allocation %s project %s core_time %s resources %s",
                 usage,
@@ -441,8 +510,7 @@ class Command(BaseCommand):
                 core_time,
                 resources,
             )
-            if self.sync:
-                s.set_usage(XDMOD_CLOUD_CORE_TIME_ATTRIBUTE_NAME, usage)
+            sync_usages[s.pk] = {XDMOD_CLOUD_CORE_TIME_ATTRIBUTE_NAME: usage}
 
             self.write(
                 "\t".join(
@@ -457,6 +525,9 @@ class Command(BaseCommand):
                 )
             )
 
+        if self.sync:
+            Allocation.bulk_set_usage(sync_usages)
+
     def handle(self, *args, **options):
         verbosity = int(options["verbosity"])
         root_logger = logging.getLogger("")
@@ -469,6 +540,8 @@ class Command(BaseCommand):
         else:
             root_logger.setLevel(logging.WARNING)
 
+        self.bulk = options["bulk"]
+
         self.sync = False
         if options["sync"]:
             self.sync = True
@@ -503,14 +576,15 @@ class Command(BaseCommand):
         if options["statistic"]:
             statistic = options["statistic"]
 
-        if statistic == "total_cpu_hours":
-            self.process_total_cpu_hours()
-        elif statistic == "cloud_core_time":
-            self.process_cloud_core_time()
-        elif statistic == "total_acc_hours":
-            self.process_total_gpu_hours()
-        elif statistic == "total_storage":
-            self.process_total_storage()
-        else:
-            logger.error("Unsupported XDMoD statistic")
-            sys.exit(1)
+        with XdmodClient(workers=options["workers"]) as self.client:
+            if statistic == "total_cpu_hours":
+                self.process_total_cpu_hours()
+            elif statistic == "cloud_core_time":
+                self.process_cloud_core_time()
+            elif statistic == "total_acc_hours":
+                self.process_total_gpu_hours()
+            elif statistic == "total_storage":
+                self.process_total_storage()
+            else:
+                logger.error("Unsupported XDMoD statistic")
+                sys.exit(1)
@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import io
+import unittest
+
+from django.test import SimpleTestCase
+
+from coldfront.config.env import ENV
+from coldfront.plugins.xdmod.tests.xdmod_stub import XdmodStubServer
+
+if ENV.bool("PLUGIN_XDMOD", default=False):
+    from coldfront.plugins.xdmod import utils
+
+ACCOUNTS = [f"account{i}" for i in range(20)]
+
+USAGE = {
+    ("Jobs", "total_cpu_hours"): {account: str(i * 10) for i, account in enumerate(ACCOUNTS)},
+}
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_XDMOD", default=False), "Only run XdmodClient tests if enabled")
+class XdmodClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = XdmodStubServer(USAGE)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        self.client = utils.XdmodClient(url=self.server.url, workers=4, retries=2, backoff=0)
+        self.addCleanup(self.client.close)
+
+    def test_fetch(self):
+        self.assertEqual(self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "account3", ["c1"]), 30.0)
+        with self.assertRaises(utils.XdmodNotFoundError):
+            self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "missing", ["c1"])
+
+    def test_default_params_unchanged(self):
+        """Each request builds its own parameters rather than changing the shared defaults"""
+        default_params = dict(utils._DEFAULT_PARAMS)
+        self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "account3", ["c1"])
+        with self.assertRaises(utils.XdmodNotFoundError):
+            self.client.fetch_cloud_core_time("2025-01-01", "2025-12-31", "project", ["c1"])
+
+        self.assertEqual(utils._DEFAULT_PARAMS, default_params)
+        self.assertNotIn("pi_filter", self.server.requests[1])
+
+    def test_retry(self):
+        """Unavailable responses are retried"""
+        self.server.failures = 2
+        self.assertEqual(self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "account1", ["c1"]), 10.0)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_exhausted(self):
+        self.server.failures = 3
+        with self.assertRaises(utils.XdmodError):
+            self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "account1", ["c1"])
+
+    def test_map(self):
+        """Concurrent fetches over the shared session return results in order"""
+        usage = self.client.map(
+            lambda account: self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", account, ["c1"]), ACCOUNTS
+        )
+
+        self.assertEqual(usage, [i * 10.0 for i in range(20)])
+        self.assertEqual(len(self.server.requests), 20)
+
+    def test_json_error(self):
+        """A json response is an error even when the request succeeds"""
+        self.server.error = {"success": False, "message": "Invalid filter value"}
+        with self.assertRaisesMessage(utils.XdmodNotFoundError, "Invalid filter value"):
+            self.client.fetch_total_cpu_hours("2025-01-01", "2025-12-31", "account1", ["c1"])
+        # grouped requests treat it as no data for the chunk, the same as a single account
+        self.assertEqual(self.client.fetch_total_cpu_hours_by_account("2025-01-01", "2025-12-31", ACCOUNTS, ["c1"]), {})
+
+    def test_fetch_storage_without_value(self):
+        """Storage rows without a value are left out rather than converted"""
+        self.server.usage = {("Storage", "physical_usage"): {"account1": "", "account2": "2e9"}}
+
+        self.assertIsNone(self.client.fetch_total_storage("2025-01-01", "2025-12-31", "account1", ["c1"]))
+        self.assertEqual(
+            self.client.fetch_total_storage_by_account("2025-01-01", "2025-12-31", ["account1", "account2"], ["c1"]),
+            {"account2": 2.0},
+        )
+
+    def test_iter_rows_grouped(self):
+        rows = list(
+            self.client.iter_rows(
+                {
+                    "group_by": "pi",
+                    "realm": "Jobs",
+                    "statistic": "total_cpu_hours",
+                    "pi_filter": '"account1,account2,missing"',
+                }
+            )
+        )
+        self.assertEqual(rows, [utils.XdmodRow("account1", 10.0), utils.XdmodRow("account2", 20.0)])
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_XDMOD", default=False), "Only run XDMoD parsing tests if enabled")
+class XdmodParseTest(SimpleTestCase):
+    def test_iterparse_rows(self):
+        """Rows are parsed incrementally into typed records"""
+        document = "<xdmod-xml-dataset><header/><rows>{}</rows></xdmod-xml-dataset>".format(
+            "".join(
+                f"<row><cell><value>account{i}</value></cell><cell><value>{i}.5</value></cell></row>"
+                for i in range(10000)
+            )
+        )
+        rows = utils._iterparse_rows(io.BytesIO(document.encode()))
+
+        self.assertEqual(next(rows), utils.XdmodRow("account0", 0.5))
+        group, value = list(rows)[-1]
+        self.assertEqual((group, value), ("account9999", 9999.5))
+
+    def test_iterparse_rows_invalid(self):
+        for document in [
+            "<xdmod-xml-dataset><header/></xdmod-xml-dataset>",
+            "<xdmod-xml-dataset><rows><row><cell><value>a</value></cell></row></rows></xdmod-xml-dataset>",
+            "<xdmod-xml-dataset><rows><row><cell><value>a</value></cell><cell><value>n/a</value></cell></row>",
+            "<xdmod-xml-dataset><rows><row>",
+        ]:
+            with self.assertRaises(utils.XdmodError):
+                list(utils._iterparse_rows(io.BytesIO(document.encode())))
+
+    def test_capped_reader(self):
+        """Only the start of a response body is kept for logging"""
+        reader = utils._CappedReader(io.BytesIO(b"x" * 5000), 100)
+        while reader.read(64):
+            pass
+
+        self.assertEqual(reader.captured(), "x" * 100 + "... (4900 bytes truncated)")
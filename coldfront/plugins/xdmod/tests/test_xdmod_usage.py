@@ -0,0 +1,141 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import datetime
+import unittest
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from coldfront.config.env import ENV
+from coldfront.core.allocation.models import AllocationAttributeUsage
+from coldfront.core.test_helpers.factories import (
+    AAttributeTypeFactory,
+    AllocationAttributeFactory,
+    AllocationAttributeTypeFactory,
+    AllocationFactory,
+    ResourceAttributeFactory,
+    ResourceAttributeTypeFactory,
+    ResourceFactory,
+)
+from coldfront.plugins.xdmod.tests.xdmod_stub import XdmodStubServer
+
+UTILS_MODULE = "coldfront.plugins.xdmod.utils"
+
+USAGE = {
+    ("Jobs", "total_cpu_hours"): {"physics": "1200.5", "chem": "30", "bio": "7"},
+    ("Cloud", "cloud_core_time"): {"cloudproj": "88"},
+}
+
+
+@unittest.skipUnless(ENV.bool("PLUGIN_XDMOD", default=False), "Only run xdmod_usage tests if enabled")
+class XdmodUsageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        resource = ResourceFactory(name="cluster")
+        ResourceAttributeFactory(
+            resource=resource,
+            resource_attribute_type=ResourceAttributeTypeFactory(name="xdmod_resource"),
+            value="cluster1",
+        )
+
+        account_type = AllocationAttributeTypeFactory(
+            name="slurm_account_name", attribute_type=AAttributeTypeFactory(name="Text")
+        )
+        cloud_type = AllocationAttributeTypeFactory(
+            name="Cloud Account Name", attribute_type=AAttributeTypeFactory(name="Text")
+        )
+        hours_type = AllocationAttributeTypeFactory(
+            name="Core Usage (Hours)", attribute_type=AAttributeTypeFactory(name="Int"), has_usage=True
+        )
+
+        cls.allocations = {}
+        for name, attribute_type in [
+            ("physics", account_type),
+            ("chem", account_type),
+            ("nodata", account_type),
+            ("cloudproj", cloud_type),
+        ]:
+            allocation = AllocationFactory(start_date=datetime.date(2025, 1, 1), end_date=datetime.date(2025, 12, 31))
+            allocation.resources.add(resource)
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=attribute_type, value=name)
+            AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=hours_type, value=5000)
+            cls.allocations[name] = allocation
+
+        # different dates, so fetched in its own grouped request
+        allocation = AllocationFactory(start_date=datetime.date(2024, 1, 1), end_date=datetime.date(2024, 12, 31))
+        allocation.resources.add(resource)
+        AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=account_type, value="bio")
+        AllocationAttributeFactory(allocation=allocation, allocation_attribute_type=hours_type, value=5000)
+        cls.allocations["bio"] = allocation
+
+    def setUp(self):
+        self.server = XdmodStubServer(USAGE)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        url = patch(f"{UTILS_MODULE}.XDMOD_API_URL", self.server.url)
+        url.start()
+        self.addCleanup(url.stop)
+
+    def _xdmod_usage(self, **options):
+        out = StringIO()
+        call_command("xdmod_usage", verbosity=0, stdout=out, **options)
+        return sorted(out.getvalue().splitlines())
+
+    def test_bulk_matches_per_allocation(self):
+        """Grouped requests report the same usage as one request per allocation, in fewer requests"""
+        rows = self._xdmod_usage(statistic="total_cpu_hours", workers=1)
+        self.assertEqual(len(self.server.requests), 4)
+
+        self.server.requests.clear()
+        self.assertEqual(self._xdmod_usage(statistic="total_cpu_hours", workers=4), rows)
+        self.assertEqual(len(self.server.requests), 4)
+
+        self.server.requests.clear()
+        self.assertEqual(self._xdmod_usage(statistic="total_cpu_hours", bulk=True), rows)
+        self.assertEqual(len(self.server.requests), 2)
+
+        self.assertEqual([row.split("\t")[-1] for row in rows], ["1200.5", "30.0", "7.0"])
+        grouped = [request for request in self.server.requests if request["start_date"] == "2025-01-01"][0]
+        self.assertEqual(grouped["pi_filter"], '"chem,nodata,physics"')
+        self.assertEqual(grouped["group_by"], "pi")
+
+    def test_bulk_chunked(self):
+        """Accounts are split across requests of at most XDMOD_GROUPED_CHUNK_SIZE"""
+        with patch(f"{UTILS_MODULE}.XDMOD_GROUPED_CHUNK_SIZE", 2):
+            rows = self._xdmod_usage(statistic="total_cpu_hours", bulk=True)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_bulk_sync(self):
+        """Grouped usage is saved to the allocation attributes"""
+        self._xdmod_usage(statistic="total_cpu_hours", bulk=True, sync=True)
+        self._xdmod_usage(statistic="cloud_core_time", bulk=True, sync=True)
+
+        usage = dict(
+            AllocationAttributeUsage.objects.filter(
+                allocation_attribute__allocation_attribute_type__name="Core Usage (Hours)"
+            ).values_list("allocation_attribute__allocation", "value")
+        )
+        self.assertEqual(
+            usage,
+            {
+                self.allocations["physics"].pk: 1200.5,
+                self.allocations["chem"].pk: 30,
+                self.allocations["nodata"].pk: 0,
+                self.allocations["bio"].pk: 7,
+                self.allocations["cloudproj"].pk: 88,
+            },
+        )
+
+    def test_bulk_no_data(self):
+        """XDMoD's json reply for a chunk without data is no usage, not a failed run"""
+        self.server.error = {"success": False, "message": "No data"}
+
+        self.assertEqual(self._xdmod_usage(statistic="total_cpu_hours", bulk=True), [])
+        self.assertEqual(self._xdmod_usage(statistic="total_cpu_hours"), [])
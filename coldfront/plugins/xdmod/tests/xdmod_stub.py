@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: (C) ColdFront Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""Stand-in for the XDMoD user_interface.php endpoint used by the XDMoD plugin tests.
+
+The server answers get_data requests from the usage dict it is given:
+
+    {
+        ("realm", "statistic"): {"account or project": "value", ...},
+    }
+
+returning a row for each account or project in the request's pi_filter or project_filter that has usage.
+Every request's parameters are recorded in XdmodStubServer.requests. The first XdmodStubServer.failures
+requests get a 503 response. If XdmodStubServer.error is set, it is returned as a json error instead.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+ROW = "<row><cell><value>{}</value></cell><cell><value>{}</value></cell></row>"
+
+DATASET = """<?xml version="1.0" encoding="UTF-8"?>
+<xdmod-xml-dataset>
+  <header><title>{}</title></header>
+  <rows>{}</rows>
+</xdmod-xml-dataset>
+"""
+
+
+class XdmodStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        with self.server.lock:
+            self.server.requests.append(params)
+            fail = self.server.failures > 0
+            self.server.failures -= 1
+
+        if fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.server.error is not None:
+            body = json.dumps(self.server.error).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        filter_name = "pi_filter" if params.get("group_by") == "pi" else "project_filter"
+        names = params.get(filter_name, "").strip('"').split(",")
+        usage = self.server.usage.get((params.get("realm"), params.get("statistic")), {})
+        rows = "".join(ROW.format(escape(name), escape(str(usage[name]))) for name in names if name in usage)
+
+        body = DATASET.format(escape(params.get("statistic", "")), rows).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class XdmodStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, usage):
+        super().__init__(("127.0.0.1", 0), XdmodStubHandler)
+        self.usage = usage
+        self.requests = []
+        self.failures = 0
+        self.error = None
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
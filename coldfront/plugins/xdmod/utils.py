@@ -2,11 +2,15 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
-import json
+import itertools
 import logging
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from coldfront.core.utils.common import import_from_settings
 
@@ -27,6 +31,19 @@ XDMOD_STORAGE_GROUP_ATTRIBUTE_NAME = import_from_settings("XDMOD_STORAGE_GROUP_A
 
 XDMOD_API_URL = import_from_settings("XDMOD_API_URL")
 
+# Number of accounts (or cloud projects) to filter on in a single grouped request
+XDMOD_GROUPED_CHUNK_SIZE = import_from_settings("XDMOD_GROUPED_CHUNK_SIZE", 100)
+
+# Number of concurrent requests to XDMoD, and the size of the connection pool
+XDMOD_WORKERS = import_from_settings("XDMOD_WORKERS", 4)
+# Seconds to wait for XDMoD to accept the connection and to send the response
+XDMOD_TIMEOUT = import_from_settings("XDMOD_TIMEOUT", (10, 300))
+# Failed connections and 429/5xx responses are retried, waiting backoff * 2^(retry - 1) seconds in between
+XDMOD_RETRIES = import_from_settings("XDMOD_RETRIES", 3)
+XDMOD_RETRY_BACKOFF = import_from_settings("XDMOD_RETRY_BACKOFF", 1)
+# Response bodies are logged at DEBUG, up to this many bytes
+XDMOD_LOG_MAX_BYTES = import_from_settings("XDMOD_LOG_MAX_BYTES", 2048)
+
 _ENDPOINT_CORE_HOURS = "/controllers/user_interface.php"
 
 _DEFAULT_PARAMS = {
@@ -49,133 +66,302 @@ class XdmodNotFoundError(XdmodError):
     pass
 
 
-def xdmod_fetch_total_cpu_hours(start, end, account, resources=None, statistics="total_cpu_hours"):
-    if resources is None:
-        resources = []
-
-    url = "{}{}".format(XDMOD_API_URL, _ENDPOINT_CORE_HOURS)
-    payload = _DEFAULT_PARAMS
-    payload["pi_filter"] = '"{}"'.format(account)
-    payload["resource_filter"] = '"{}"'.format(",".join(resources))
-    payload["start_date"] = start
-    payload["end_date"] = end
-    payload["group_by"] = "pi"
-    payload["realm"] = "Jobs"
-    payload["operation"] = "get_data"
-    payload["statistic"] = statistics
-    r = requests.get(url, params=payload)
-
-    logger.info(r.url)
-    logger.info(r.text)
+class XdmodRow:
+    """A row of an XDMoD get_data response: the group (PI account or cloud project) and its statistic"""
 
-    try:
-        error = r.json()
-        # XXX fix me. Here we assume any json response is bad as we're
-        # expecting xml but XDMoD should just return json always.
-        raise XdmodNotFoundError("Got json response but expected XML: {}".format(error))
-    except json.decoder.JSONDecodeError:
-        pass
-    except requests.exceptions.JSONDecodeError:
-        pass
+    __slots__ = ("group", "value")
 
-    try:
-        root = ET.fromstring(r.text)
-    except ET.ParserError as e:
-        raise XdmodError("Invalid XML data returned from XDMoD API: {}".format(e))
+    def __init__(self, group, value):
+        self.group = group
+        self.value = value
 
-    rows = root.find("rows")
-    if len(rows) != 1:
-        raise XdmodNotFoundError("Rows not found for {} - {}".format(account, resources))
+    def __iter__(self):
+        return iter((self.group, self.value))
 
-    cells = rows.find("row").findall("cell")
-    if len(cells) != 2:
-        raise XdmodError("Invalid XML data returned from XDMoD API: Cells not found")
+    def __eq__(self, other):
+        return isinstance(other, XdmodRow) and tuple(self) == tuple(other)
 
-    core_hours = cells[1].find("value").text
+    def __repr__(self):
+        return "XdmodRow(group={!r}, value={!r})".format(self.group, self.value)
 
-    return core_hours
 
+def _truncate(text, limit=None):
+    limit = XDMOD_LOG_MAX_BYTES if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return "{}... ({} characters truncated)".format(text[:limit], len(text) - limit)
 
-def xdmod_fetch_total_storage(start, end, account, resources=None, statistics="physical_usage"):
-    if resources is None:
-        resources = []
-
-    payload_end = end
-    if payload_end is None:
-        payload_end = "2099-01-01"
-    url = "{}{}".format(XDMOD_API_URL, _ENDPOINT_CORE_HOURS)
-    payload = _DEFAULT_PARAMS
-    payload["pi_filter"] = '"{}"'.format(account)
-    payload["resource_filter"] = "{}".format(",".join(resources))
-    payload["start_date"] = start
-    payload["end_date"] = payload_end
-    payload["group_by"] = "pi"
-    payload["realm"] = "Storage"
-    payload["operation"] = "get_data"
-    payload["statistic"] = statistics
-    r = requests.get(url, params=payload)
-
-    logger.info(r.url)
-    logger.info(r.text)
 
+class _CappedReader:
+    """File-like wrapper that keeps the first limit bytes read through it, for logging"""
+
+    def __init__(self, fh, limit):
+        self.fh = fh
+        self.limit = limit
+        self.head = b""
+        self.length = 0
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        if len(self.head) < self.limit:
+            self.head += data[: self.limit - len(self.head)]
+        self.length += len(data)
+        return data
+
+    def captured(self):
+        text = self.head.decode(errors="replace")
+        if self.length > self.limit:
+            text += "... ({} bytes truncated)".format(self.length - self.limit)
+        return text
+
+
+def _parse_value(text):
+    if text is None or not text.strip():
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        raise XdmodError("Invalid XML data returned from XDMoD API: {!r} is not a number".format(text))
+
+
+def _iterparse_rows(fh):
+    """
+    Params:
+        fh (file): an XDMoD get_data XML document
+
+    Yields:
+        XdmodRow: each row in the document, discarding each row once it is parsed
+    """
+    rows = None
     try:
-        root = ET.fromstring(r.text)
-    except ET.ParserError as e:
+        for event, elem in ET.iterparse(fh, events=("start", "end")):
+            if event == "start":
+                if elem.tag == "rows":
+                    rows = elem
+                continue
+
+            if elem.tag != "row" or rows is None:
+                continue
+
+            cells = elem.findall("cell")
+            if len(cells) != 2:
+                raise XdmodError("Invalid XML data returned from XDMoD API: Cells not found")
+
+            yield XdmodRow(cells[0].findtext("value"), _parse_value(cells[1].findtext("value")))
+            rows.clear()
+    except ET.ParseError as e:
         raise XdmodError("Invalid XML data returned from XDMoD API: {}".format(e))
 
-    rows = root.find("rows")
-    if len(rows) != 1:
-        raise XdmodNotFoundError("Rows not found for {} - {}".format(account, resources))
+    if rows is None:
+        raise XdmodError("Invalid XML data returned from XDMoD API: Rows not found")
+
+
+class XdmodClient:
+    """Fetches usage from the XDMoD API over a pooled session
+
+    Requests that fail to connect or get a 429/5xx response are retried with exponential backoff. The
+    session is safe to share between the threads of XdmodClient.map, which fetches up to workers at once.
+    """
+
+    def __init__(
+        self,
+        url=None,
+        workers=None,
+        timeout=None,
+        retries=None,
+        backoff=None,
+    ):
+        self.url = "{}{}".format(url if url is not None else XDMOD_API_URL, _ENDPOINT_CORE_HOURS)
+        self.workers = workers if workers is not None else XDMOD_WORKERS
+        self.timeout = timeout if timeout is not None else XDMOD_TIMEOUT
+
+        retry = Retry(
+            total=retries if retries is not None else XDMOD_RETRIES,
+            backoff_factor=backoff if backoff is not None else XDMOD_RETRY_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+        )
+        adapter = HTTPAdapter(pool_maxsize=self.workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def map(self, fetch, items):
+        """
+        Params:
+            fetch (callable): called with each item, from up to self.workers threads at once
+            items (iterable): the items to fetch
+
+        Returns:
+            list: the results of fetch, in the order of items
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fetch, items))
+
+    def iter_rows(self, params):
+        """Stream the rows of an XDMoD get_data response without holding the whole document in memory
+
+        Params:
+            params (dict): request parameters, added to a copy of the default parameters
+
+        Yields:
+            XdmodRow: the group and value of each row
+        """
+        payload = dict(_DEFAULT_PARAMS)
+        payload.update(params)
+        try:
+            with self.session.get(self.url, params=payload, timeout=self.timeout, stream=True) as r:
+                logger.info(r.url)
+
+                if not r.ok:
+                    raise XdmodError("XDMoD API returned {} {}: {}".format(r.status_code, r.reason, _truncate(r.text)))
+
+                # XDMoD reports errors as json even when asked for xml
+                if "json" in r.headers.get("Content-Type", ""):
+                    raise XdmodNotFoundError("Got json response but expected XML: {}".format(_truncate(r.text)))
+
+                r.raw.decode_content = True
+                body = _CappedReader(r.raw, XDMOD_LOG_MAX_BYTES)
+                try:
+                    yield from _iterparse_rows(body)
+                finally:
+                    logger.debug("%s", body.captured())
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            raise XdmodError("Failed to fetch data from XDMoD API: {}".format(e))
+
+    def _fetch_value(self, params, name, resources):
+        rows = list(itertools.islice(self.iter_rows(params), 2))
+        if len(rows) != 1:
+            raise XdmodNotFoundError("Rows not found for {} - {}".format(name, resources))
+
+        return rows[0].value
+
+    def _fetch_grouped(self, params, filter_name, names, quote=True):
+        """Fetch a statistic for many PIs or projects, filtering on up to XDMOD_GROUPED_CHUNK_SIZE at a time
+
+        Params:
+            params (dict): request parameters, which must group by the filtered dimension
+            filter_name (str): the request parameter to filter on, e.g. pi_filter
+            names (list): the accounts or projects to fetch
+            quote (bool): whether the filter value is quoted
+
+        Returns:
+            dict: the value of the statistic for each account or project XDMoD has data for, chunks XDMoD has no
+                data for are left out
+        """
+        names = sorted(set(names))
+        values = {}
+        for i in range(0, len(names), XDMOD_GROUPED_CHUNK_SIZE):
+            chunk_filter = ",".join(names[i : i + XDMOD_GROUPED_CHUNK_SIZE])
+            chunk_params = dict(params)
+            chunk_params[filter_name] = '"{}"'.format(chunk_filter) if quote else chunk_filter
+
+            try:
+                for row in self.iter_rows(chunk_params):
+                    values[row.group] = row.value
+            except XdmodNotFoundError as e:
+                # XDMoD's reply when none of the chunk has data, the same as a missing account on its own
+                logger.debug("No data in XDMoD for %s: %s", chunk_filter, e)
+
+        return values
+
+    def _jobs_params(self, start, end, resources, statistics):
+        return {
+            "resource_filter": '"{}"'.format(",".join(resources or [])),
+            "start_date": start,
+            "end_date": end,
+            "group_by": "pi",
+            "realm": "Jobs",
+            "operation": "get_data",
+            "statistic": statistics,
+        }
+
+    def _storage_params(self, start, end, resources, statistics):
+        return {
+            "resource_filter": "{}".format(",".join(resources or [])),
+            "start_date": start,
+            "end_date": end if end is not None else "2099-01-01",
+            "group_by": "pi",
+            "realm": "Storage",
+            "operation": "get_data",
+            "statistic": statistics,
+        }
+
+    def _cloud_params(self, start, end, resources):
+        return {
+            "resource_filter": '"{}"'.format(",".join(resources or [])),
+            "start_date": start,
+            "end_date": end,
+            "group_by": "project",
+            "realm": "Cloud",
+            "operation": "get_data",
+            "statistic": "cloud_core_time",
+        }
+
+    def fetch_total_cpu_hours(self, start, end, account, resources=None, statistics="total_cpu_hours"):
+        params = self._jobs_params(start, end, resources, statistics)
+        params["pi_filter"] = '"{}"'.format(account)
+        return self._fetch_value(params, account, resources)
+
+    def fetch_total_storage(self, start, end, account, resources=None, statistics="physical_usage"):
+        params = self._storage_params(start, end, resources, statistics)
+        params["pi_filter"] = '"{}"'.format(account)
+        value = self._fetch_value(params, account, resources)
+        return value / 1e9 if value is not None else None
+
+    def fetch_cloud_core_time(self, start, end, project, resources=None):
+        params = self._cloud_params(start, end, resources)
+        params["project_filter"] = project
+        return self._fetch_value(params, project, resources)
+
+    def fetch_total_cpu_hours_by_account(self, start, end, accounts, resources=None, statistics="total_cpu_hours"):
+        """Grouped version of fetch_total_cpu_hours, returning a dict of account to usage"""
+        return self._fetch_grouped(self._jobs_params(start, end, resources, statistics), "pi_filter", accounts)
+
+    def fetch_total_storage_by_account(self, start, end, accounts, resources=None, statistics="physical_usage"):
+        """Grouped version of fetch_total_storage, returning a dict of account to usage in GB"""
+        usage = self._fetch_grouped(self._storage_params(start, end, resources, statistics), "pi_filter", accounts)
+        return {account: value / 1e9 for account, value in usage.items() if value is not None}
+
+    def fetch_cloud_core_time_by_project(self, start, end, projects, resources=None):
+        """Grouped version of fetch_cloud_core_time, returning a dict of project to core time"""
+        return self._fetch_grouped(self._cloud_params(start, end, resources), "project_filter", projects, quote=False)
 
-    cells = rows.find("row").findall("cell")
-    if len(cells) != 2:
-        raise XdmodError("Invalid XML data returned from XDMoD API: Cells not found")
 
-    physical_usage = float(cells[1].find("value").text) / 1e9
+def xdmod_fetch_total_cpu_hours(start, end, account, resources=None, statistics="total_cpu_hours"):
+    with XdmodClient() as client:
+        return client.fetch_total_cpu_hours(start, end, account, resources=resources, statistics=statistics)
 
-    return physical_usage
+
+def xdmod_fetch_total_storage(start, end, account, resources=None, statistics="physical_usage"):
+    with XdmodClient() as client:
+        return client.fetch_total_storage(start, end, account, resources=resources, statistics=statistics)
 
 
 def xdmod_fetch_cloud_core_time(start, end, project, resources=None):
-    if resources is None:
-        resources = []
-
-    url = "{}{}".format(XDMOD_API_URL, _ENDPOINT_CORE_HOURS)
-    payload = _DEFAULT_PARAMS
-    payload["project_filter"] = project
-    payload["resource_filter"] = '"{}"'.format(",".join(resources))
-    payload["start_date"] = start
-    payload["end_date"] = end
-    payload["group_by"] = "project"
-    payload["realm"] = "Cloud"
-    payload["operation"] = "get_data"
-    payload["statistic"] = "cloud_core_time"
-    r = requests.get(url, params=payload)
-
-    logger.info(r.url)
-    logger.info(r.text)
+    with XdmodClient() as client:
+        return client.fetch_cloud_core_time(start, end, project, resources=resources)
 
-    try:
-        error = r.json()
-        # XXX fix me. Here we assume any json response is bad as we're
-        # expecting xml but XDMoD should just return json always.
-        raise XdmodNotFoundError("Got json response but expected XML: {}".format(error))
-    except json.decoder.JSONDecodeError:
-        pass
 
-    try:
-        root = ET.fromstring(r.text)
-    except ET.ParserError as e:
-        raise XdmodError("Invalid XML data returned from XDMoD API: {}".format(e))
+def xdmod_fetch_total_cpu_hours_by_account(start, end, accounts, resources=None, statistics="total_cpu_hours"):
+    with XdmodClient() as client:
+        return client.fetch_total_cpu_hours_by_account(start, end, accounts, resources=resources, statistics=statistics)
 
-    rows = root.find("rows")
-    if len(rows) != 1:
-        raise XdmodNotFoundError("Rows not found for {} - {}".format(project, resources))
 
-    cells = rows.find("row").findall("cell")
-    if len(cells) != 2:
-        raise XdmodError("Invalid XML data returned from XDMoD API: Cells not found")
+def xdmod_fetch_total_storage_by_account(start, end, accounts, resources=None, statistics="physical_usage"):
+    with XdmodClient() as client:
+        return client.fetch_total_storage_by_account(start, end, accounts, resources=resources, statistics=statistics)
 
-    core_hours = cells[1].find("value").text
 
-    return core_hours
+def xdmod_fetch_cloud_core_time_by_project(start, end, projects, resources=None):
+    with XdmodClient() as client:
+        return client.fetch_cloud_core_time_by_project(start, end, projects, resources=resources)